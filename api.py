@@ -0,0 +1,330 @@
+"""API HTTP (JSON) pour l'application mobile et les garages partenaires.
+
+    python cli.py api --port 8600
+
+Même base et mêmes fonctions que l'interface Streamlit ; les appels SQLite,
+bloquants, passent par un pool de threads borné. En réseau multi-garages,
+l'en-tête X-Garage désigne le garage (base principale sinon).
+"""
+import asyncio
+import base64
+import contextvars
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+
+from starlette.applications import Starlette
+from starlette.datastructures import Headers
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+import passwords
+import scheduling as sch
+import tenants
+import utils as u
+
+DB_WORKERS = int(os.environ.get("VIDANGE_API_DB_WORKERS", "8"))
+DB_QUEUE = int(os.environ.get("VIDANGE_API_DB_QUEUE", "256"))     # appels en attente au-delà : 503
+TOKEN_TTL = 7 * 24 * 3600
+# Clé de signature des jetons : VIDANGE_API_SECRET, sinon ce fichier (0600, hors base et copies)
+SECRET_FILE = os.environ.get("VIDANGE_API_SECRET_FILE")
+CATALOG_TTL = 1.0                                                  # comme CACHE_CHECK_INTERVAL
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+# ---------------- Exécution bornée ----------------
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="api-db")
+_slots = threading.BoundedSemaphore(DB_WORKERS + DB_QUEUE)
+
+async def db(fn, *args, **kwargs):
+    """Exécute fn dans le pool ; refuse plutôt que d'empiler sans limite."""
+    if not _slots.acquire(blocking=False):
+        raise ApiError(503, "serveur surchargé, réessayer")
+    # run_in_executor ne transmet pas le contexte : le garage de la requête suit explicitement
+    ctx = contextvars.copy_context()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, lambda: ctx.run(fn, *args, **kwargs))
+    finally:
+        _slots.release()
+
+
+# ---------------- Réponses ----------------
+def _json(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, "item"):         # scalaires numpy
+        return value.item()
+    raise TypeError(type(value).__name__)
+
+def ok(data, status=200) -> Response:
+    return Response(json.dumps(data, default=_json, ensure_ascii=False), status, media_type="application/json")
+
+async def body(request: Request) -> dict:
+    try:
+        data = await request.json()
+    except ValueError:
+        raise ApiError(400, "JSON invalide")
+    if not isinstance(data, dict):
+        raise ApiError(400, "objet JSON attendu")
+    return data
+
+def _ids(value) -> list:
+    if isinstance(value, str):
+        value = [v for v in value.split(",") if v.strip()]
+    try:
+        return [int(v) for v in value or []]
+    except (TypeError, ValueError):
+        raise ApiError(400, "service_ids : liste d'entiers attendue")
+
+
+# ---------------- Jetons ----------------
+_secret = None
+
+def _secret_file() -> str:
+    return SECRET_FILE or os.path.join(u.data_dir(), ".api_secret")
+
+def _load_secret() -> bytes:
+    # Ancienne clé gardée dans config (donc copiée dans chaque sauvegarde) : retirée et remplacée
+    if u.get_config("api_secret") is not None:
+        with u.catalog_transaction() as conn:
+            conn.execute("DELETE FROM config WHERE key='api_secret'")
+    secret = os.environ.get("VIDANGE_API_SECRET")
+    if secret:
+        return secret.encode()
+    path = _secret_file()
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, encoding="ascii") as f:       # créé par un autre processus de l'API
+            return f.read().strip().encode()
+    secret = secrets.token_hex(32)
+    with os.fdopen(fd, "w", encoding="ascii") as f:
+        f.write(secret)
+    return secret.encode()
+
+def _sign(payload: bytes) -> str:
+    return base64.urlsafe_b64encode(hmac.new(_secret, payload, hashlib.sha256).digest()[:18]).decode()
+
+def issue_token(user_id, now=None) -> str:
+    payload = f"{int(user_id)}.{int((now or time.time()) + TOKEN_TTL)}"
+    return f"{payload}.{_sign(payload.encode())}"
+
+def user_id_from(request: Request) -> int:
+    auth = request.headers.get("authorization", "")
+    token = auth[7:] if auth.lower().startswith("bearer ") else ""
+    uid, _, rest = token.partition(".")
+    expires, _, sig = rest.partition(".")
+    if not (uid.isdigit() and expires.isdigit()) or not hmac.compare_digest(sig, _sign(f"{uid}.{expires}".encode())):
+        raise ApiError(401, "jeton absent ou invalide")
+    if int(expires) < time.time():
+        raise ApiError(401, "jeton expiré")
+    return int(uid)
+
+
+# ---------------- Catalogue ----------------
+class CatalogResponse:
+    """Corps JSON du catalogue, reconstruit seulement quand la version du cache change.
+
+    Entre deux vérifications (CATALOG_TTL), la réponse part sans passer par le
+    pool de threads ni sérialiser à nouveau.
+    """
+
+    def __init__(self):
+        self._body = None
+        self._source = None
+        self._expires = 0.0
+        self._lock = asyncio.Lock()
+
+    def _build(self):
+        data = u.get_cache().get()
+        if data is self._source:
+            return self._body, data
+        fields = ("id", "name", "base_price_da", "duration_min", "category")
+        payload = {"services": [{f: getattr(s, f) for f in fields} for s in data["active"]],
+                   "domicile_surcharge_da": int(data["config"].get("domicile_surcharge_da", "3000"))}
+        return json.dumps(payload, ensure_ascii=False).encode(), data
+
+    async def get(self) -> bytes:
+        if time.monotonic() < self._expires:
+            return self._body
+        async with self._lock:
+            if time.monotonic() >= self._expires:
+                self._body, self._source = await db(self._build)
+                self._expires = time.monotonic() + CATALOG_TTL
+        return self._body
+
+_catalogs = {}
+
+def catalog() -> CatalogResponse:
+    # Un catalogue par garage (prix et supplément propres à chacun)
+    path = u.current_path()
+    if path not in _catalogs:
+        _catalogs[path] = CatalogResponse()
+    return _catalogs[path]
+
+
+# ---------------- Points d'entrée ----------------
+async def post_auth(request):
+    data = await body(request)
+    ip = request.client.host if request.client else None
+    try:
+        user = await db(u.authenticate, str(data.get("email", "")), str(data.get("password", "")), ip)
+    except passwords.LoginRateLimited as e:
+        raise ApiError(429, str(e), retry_after=round(e.retry_after))
+    except passwords.PasswordBusy:
+        raise ApiError(503, "trop de connexions simultanées, réessayer")
+    if not user:
+        raise ApiError(401, "identifiants invalides")
+    return ok({"token": issue_token(user["id"]), "user": user})
+
+async def get_services(request):
+    return Response(await catalog().get(), media_type="application/json")
+
+async def get_vehicles(request):
+    uid = user_id_from(request)
+    return ok([v._asdict() for v in await db(u.user_vehicles, uid)])
+
+def _quote(service_ids, booking_type):
+    total, base, surcharge, duration = u.quote_engine().quote(service_ids, booking_type)
+    return {"total_da": total, "services_da": base, "surcharge_da": surcharge, "duration_min": duration}
+
+async def post_quote(request):
+    data = await body(request)
+    booking_type = data.get("booking_type", "atelier")
+    if booking_type not in ("atelier", "domicile"):
+        raise ApiError(400, "booking_type : atelier ou domicile")
+    return ok(await db(_quote, _ids(data.get("service_ids")), booking_type))
+
+async def get_slots(request):
+    try:
+        day = date.fromisoformat(request.query_params.get("date", ""))
+    except ValueError:
+        raise ApiError(400, "date : AAAA-MM-JJ attendu")
+    slots = await db(sch.available_slots, day, _ids(request.query_params.get("service_ids", "")))
+    return ok({"date": day, "slots": [s.strftime("%H:%M") for s in slots]})
+
+def _coordinate(data, key, limit):
+    value = data.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not -limit <= value <= limit:
+        raise ApiError(400, f"{key} : nombre entre -{limit} et {limit} attendu")
+    return float(value)
+
+def _create_booking(uid, data):
+    vehicle_id = int(data["vehicle_id"])
+    if vehicle_id not in {v.id for v in u.user_vehicles(uid)}:
+        raise ApiError(404, "véhicule inconnu")
+    service_ids = _ids(data.get("service_ids"))
+    if not service_ids:
+        raise ApiError(400, "service_ids : au moins un service")
+    active = {s.id for s in u.service_rows(active_only=True)}
+    unknown = [sid for sid in service_ids if sid not in active]
+    if unknown:
+        raise ApiError(400, f"service_ids : services inconnus ou inactifs {unknown}")
+    booking_type = data.get("booking_type", "atelier")
+    if booking_type not in ("atelier", "domicile"):
+        raise ApiError(400, "booking_type : atelier ou domicile")
+    payment_mode = data.get("payment_mode", "sur_place")
+    if payment_mode not in u.PAYMENT_MODES:
+        raise ApiError(400, f"payment_mode : {', '.join(u.PAYMENT_MODES)}")
+    mileage = data.get("mileage")
+    if mileage is not None and (isinstance(mileage, bool) or not isinstance(mileage, int) or mileage < 0):
+        raise ApiError(400, "mileage : entier positif attendu")
+    home = booking_type == "domicile"
+    latitude = _coordinate(data, "latitude", 90) if home else None
+    longitude = _coordinate(data, "longitude", 180) if home else None
+    address = data.get("address") if home else None
+    if home and (not isinstance(address, str) or not address.strip()):
+        raise ApiError(400, "address : adresse obligatoire pour une intervention à domicile")
+    if home and (latitude is None or longitude is None):
+        raise ApiError(400, "latitude, longitude : obligatoires pour une intervention à domicile")
+    scheduled = datetime.fromisoformat(data["scheduled_at"])
+    if scheduled not in sch.available_slots(scheduled.date(), service_ids):
+        raise ApiError(409, "créneau indisponible")
+    # Montant recalculé côté serveur : le client ne fixe pas son prix
+    total = u.quote_engine().quote(service_ids, booking_type)[0]
+    bid, tech_id = sch.confirm_booking(uid, vehicle_id, service_ids, total, booking_type,
+                                       address, latitude, longitude, scheduled, payment_mode, mileage=mileage)
+    return {"id": bid, "total_price_da": total, "technician_id": tech_id, "scheduled_at": scheduled}
+
+async def bookings(request):
+    uid = user_id_from(request)
+    if request.method == "GET":
+        return ok([b._asdict() for b in await db(u.user_bookings, uid, row=u.BookingDetail)])
+    data = await body(request)
+    try:
+        return ok(await db(_create_booking, uid, data), status=201)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ApiError(400, f"requête invalide : {e}")
+    except sch.SlotUnavailable:
+        raise ApiError(409, "créneau indisponible")
+
+async def health(request):
+    return ok({"ok": True})
+
+
+async def on_error(request, exc: ApiError):
+    return ok({"error": str(exc), **exc.extra}, status=exc.status)
+
+class GarageRouter:
+    """Route la requête vers la base du garage de l'en-tête X-Garage (contexte de la tâche)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        slug = Headers(scope=scope).get("x-garage") if scope["type"] == "http" else None
+        if not slug:
+            return await self.app(scope, receive, send)
+        try:
+            garage = tenants.known_garage(slug) or await db(tenants.get_garage, slug)
+        except ApiError as e:
+            response = await on_error(None, e)
+            return await response(scope, receive, send)
+        if garage is None:
+            return await ok({"error": f"garage inconnu : {slug}"}, status=404)(scope, receive, send)
+        with u.use_garage(garage):
+            await self.app(scope, receive, send)
+
+@asynccontextmanager
+async def lifespan(app):
+    global _secret
+    await db(u.ensure_db)
+    _secret = await db(_load_secret)
+    yield
+
+app = Starlette(
+    middleware=[Middleware(GarageRouter)],
+    routes=[
+        Route("/health", health),
+        Route("/auth", post_auth, methods=["POST"]),
+        Route("/services", get_services),
+        Route("/quote", post_quote, methods=["POST"]),
+        Route("/slots", get_slots),
+        Route("/vehicles", get_vehicles),
+        Route("/bookings", bookings, methods=["GET", "POST"]),
+    ],
+    exception_handlers={ApiError: on_error},
+    lifespan=lifespan,
+)
+
+
+def serve(host="127.0.0.1", port=8600, log_level="warning"):
+    import uvicorn
+    uvicorn.run(app, host=host, port=port, log_level=log_level)
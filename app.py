@@ -1,10 +1,19 @@
 import streamlit as st
-import pandas as pd
+import re
 import sqlite3
-import json
-from datetime import datetime, date, time
+import functools
+from datetime import date, time, timedelta
+from time import perf_counter
 
 import utils as u
+import instrumentation as inst
+import passwords
+import scheduling as sch
+import maintenance
+import notifications
+import snapshots
+import tenants
+import booking_state as bs
 
 # ---------------- Session ----------------
 def ensure_session():
@@ -13,7 +22,88 @@ def ensure_session():
     if "role" not in st.session_state:
         st.session_state.role = "Client"
 
+def session_data(key, loader):
+    """Données chargées une fois par session ; drop_session_data() après une écriture."""
+    cache = st.session_state.setdefault("data_cache", {})
+    inst.cache_access("session", key in cache)
+    if key not in cache:
+        cache[key] = loader()
+    return cache[key]
+
+def drop_session_data(*keys):
+    cache = st.session_state.get("data_cache", {})
+    for key in keys:
+        cache.pop(key, None)
+
+def flash(message):
+    # Rerun complet (les autres panneaux relisent la base) ; message affiché au passage suivant
+    st.session_state.flash = message
+    st.rerun()
+
+def show_flash():
+    message = st.session_state.pop("flash", None)
+    if message:
+        st.success(message)
+
+# ---------------- Affichage ----------------
+# Pages client : tableaux en Markdown (st.dataframe, st.table et st.map importent pandas)
+def md_table(columns, rows):
+    def cell(v):
+        return "—" if v is None else re.sub(r"([\\`*_\[\]<>|#])", r"\\\1", str(v))
+    lines = ["| " + " | ".join(columns) + " |", "|" + " --- |" * len(columns)]
+    lines += ["| " + " | ".join(cell(v) for v in row) + " |" for row in rows]
+    st.markdown("\n".join(lines))
+
+# ---------------- Garage ----------------
+def garage_selector():
+    """Garage de la session en réseau multi-garages ; les requêtes de l'exécution y sont routées."""
+    garages = tenants.list_garages()
+    garage = None
+    if garages:
+        by_slug = {g["slug"]: g for g in garages}
+        slug = st.sidebar.selectbox("Garage", list(by_slug), format_func=lambda s: by_slug[s]["name"], key="garage_slug")
+        garage = by_slug[slug]
+    previous = st.session_state.get("garage")
+    if (previous or {}).get("slug") != (garage or {}).get("slug"):
+        # Données de session (véhicules, rendez-vous…) propres à l'ancien garage
+        st.session_state.pop("data_cache", None)
+    st.session_state.garage = garage
+    u.set_garage(garage)
+    return garages
+
+# ---------------- Diagnostic ----------------
+def perf_mode():
+    # ?perf=1 dans l'URL : overlay des temps et page Performance du back-office
+    return st.query_params.get("perf") == "1"
+
+def perf_enabled():
+    return st.session_state.get("perf_overlay", False)
+
+def show_timing(name, seconds, queries):
+    with st.expander(f"⏱ {name} : {seconds * 1e3:.1f} ms — {len(queries)} requête(s)"):
+        st.code("\n".join(" ".join(q.split())[:200] for q in queries) or "aucune requête", language="sql")
+
+def panel(name):
+    """Fragment chronométré : ses widgets ne relancent que lui, donc que ses propres requêtes."""
+    def decorate(fn):
+        @st.fragment
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            # Relance du seul fragment : main() n'a pas reposé le garage pour ce contexte
+            u.set_garage(st.session_state.get("garage"))
+            t0 = perf_counter()
+            try:
+                with u.trace_queries() as queries:
+                    fn(*args, **kwargs)
+            finally:
+                inst.record_render(f"↳ {name}", perf_counter() - t0)
+            if perf_enabled():
+                show_timing(name, perf_counter() - t0, queries)
+        return run
+    return decorate
+
 # ---------------- UI : Authentification ----------------
+@inst.timed_render("Connexion")
 def ui_auth():
     st.subheader("Authentification")
     tab1, tab2 = st.tabs(["Connexion", "Créer un compte"])
@@ -22,12 +112,18 @@ def ui_auth():
         email = st.text_input("Email")
         pw = st.text_input("Mot de passe", type="password")
         if st.button("Se connecter", use_container_width=True):
-            user = u.authenticate(email, pw)
-            if user:
-                st.session_state.user = user
-                st.success(f"Bienvenue {user['name']} !")
+            try:
+                user = u.authenticate(email, pw, ip=st.context.ip_address)
+            except passwords.LoginRateLimited as e:
+                st.error(f"Trop de tentatives. Réessayez dans {int(e.retry_after) + 1} s.")
+            except passwords.PasswordBusy:
+                st.error("Service momentanément saturé, réessayez dans un instant.")
             else:
-                st.error("Identifiants invalides.")
+                if user:
+                    st.session_state.user = user
+                    st.success(f"Bienvenue {user['name']} !")
+                else:
+                    st.error("Identifiants invalides.")
 
     with tab2:
         name = st.text_input("Nom complet")
@@ -46,8 +142,11 @@ def ui_auth():
                     st.success("Compte créé. Vous pouvez vous connecter.")
                 except sqlite3.IntegrityError:
                     st.error("Un compte avec cet email existe déjà.")
+                except passwords.PasswordBusy:
+                    st.error("Service momentanément saturé, réessayez dans un instant.")
 
 # ---------------- UI : Véhicule ----------------
+@inst.timed_render("Mon véhicule")
 def ui_vehicle():
     st.subheader("Mon véhicule")
     if not st.session_state.user:
@@ -55,14 +154,34 @@ def ui_vehicle():
         return
 
     uid = st.session_state.user["id"]
-    dfv = u.get_user_vehicles(uid)
+    vehicles = session_data(("vehicles", uid), lambda: u.user_vehicles(uid))
 
-    if not dfv.empty:
-        st.dataframe(dfv.drop(columns=["user_id"]), use_container_width=True, hide_index=True)
+    if vehicles:
+        md_table(["N°", "Marque", "Modèle", "Immatriculation", "Kilométrage (km)"],
+                 [(v.id, v.make, v.model, v.plate, v.mileage) for v in vehicles])
+        vehicle_due_section(vehicles)
 
     st.markdown("### Ajouter / Mettre à jour")
-    if not dfv.empty:
-        modes = ["Nouveau"] + [f"#{r['id']} - {r['make']} {r['model']} ({r['plate']})" for _, r in dfv.iterrows()]
+    vehicle_form_panel(uid, vehicles)
+
+def vehicle_due_section(vehicles):
+    # Échéances précalculées (maintenance.run_nightly) : simple lecture par clé
+    due = maintenance.vehicle_due([v.id for v in vehicles])
+    st.markdown("### Prochains entretiens")
+    if not due:
+        st.caption("Estimation disponible après le prochain calcul nocturne.")
+        return
+    labels = {v.id: f"{v.make} {v.model} ({v.plate})" for v in vehicles}
+    today = date.today()
+    md_table(["Véhicule", "Entretien", "Échéance", "Dans (jours)", "Au plus tard à (km)", "Rythme (km/jour)",
+              "Dernier passage"],
+             [(labels.get(d.vehicle_id), d.category, d.due_date, d.days_left(today), d.due_km, d.km_per_day,
+               d.last_service_at and d.last_service_at[:10]) for d in due])
+
+@panel("Véhicule")
+def vehicle_form_panel(uid, vehicles):
+    if vehicles:
+        modes = ["Nouveau"] + [v.label for v in vehicles]
         mode = st.selectbox("Sélection", modes)
     else:
         mode = "Nouveau"
@@ -76,10 +195,14 @@ def ui_vehicle():
         vid = None
         if mode != "Nouveau":
             vid = int(mode.split()[0].replace("#",""))
-        u.upsert_vehicle(uid, make, model, plate, int(mileage), vid)
-        st.success("Véhicule enregistré.")
+        vid = u.upsert_vehicle(uid, make, model, plate, int(mileage), vid)
+        if vid:
+            maintenance.refresh([vid])
+        drop_session_data(("vehicles", uid))
+        flash("Véhicule enregistré.")
 
 # ---------------- UI : Réservation ----------------
+@inst.timed_render("Réserver")
 def ui_booking():
     st.subheader("Réserver un service")
     if not st.session_state.user:
@@ -87,17 +210,20 @@ def ui_booking():
         return
 
     uid = st.session_state.user["id"]
-    dfv = u.get_user_vehicles(uid)
-    if dfv.empty:
+    vehicles = session_data(("vehicles", uid), lambda: u.user_vehicles(uid))
+    if not vehicles:
         st.warning("Ajoutez d'abord votre véhicule dans l'onglet *Mon véhicule*.")
         return
 
-    vehicle_label = st.selectbox("Sélectionnez le véhicule", [f"#{r['id']} - {r['make']} {r['model']} ({r['plate']})" for _, r in dfv.iterrows()])
-    vehicle_id = int(vehicle_label.split()[0].replace("#",""))
+    by_label = {v.label: v for v in vehicles}
+    vehicle = by_label[st.selectbox("Sélectionnez le véhicule", list(by_label))]
+    vehicle_id = vehicle.id
+    current = vehicle.mileage or 0
+    mileage = st.number_input("Kilométrage actuel (km)", min_value=0, step=500, value=int(current),
+                              help="Sert à prévoir vos prochains entretiens.")
 
     st.markdown("#### Choix des services")
-    dfs = u.get_services(active_only=True)
-    service_map = {f"{r['name']} — {r['base_price_da']} DA": int(r["id"]) for _, r in dfs.iterrows()}
+    service_map = {s.label: s.id for s in u.service_rows(active_only=True)}
     selected_labels = st.multiselect("Sélectionnez un ou plusieurs services", list(service_map.keys()))
     selected_ids = [service_map[l] for l in selected_labels]
 
@@ -106,31 +232,78 @@ def ui_booking():
                             help="À domicile inclut des frais supplémentaires.")
 
     st.markdown("#### Date & heure")
-    d = st.date_input("Date", value=date.today())
-    t = st.time_input("Heure", value=time(10, 0))
-    scheduled_dt = datetime.combine(d, t)
+    booking_slot_panel(selected_ids)
 
-    address, lat, lon = None, None, None
     if booking_type == "domicile":
         st.markdown("#### Localisation (sur place)")
-        address = st.text_input("Adresse (libre)")
-        lat = st.number_input("Latitude", value=36.7538, format="%.6f")
-        lon = st.number_input("Longitude", value=3.0588, format="%.6f")
-        if lat and lon:
-            st.map(pd.DataFrame({"lat": [lat], "lon": [lon]}), latitude="lat", longitude="lon")
+        booking_location_panel()
 
     st.markdown("#### Paiement")
-    payment_mode = st.selectbox("Mode de paiement", ["sur_place"])
+    payment_mode = st.selectbox("Mode de paiement", u.PAYMENT_MODES)
 
-    total, base, surcharge = u.calc_quote(selected_ids, booking_type)
+    # Un kilométrage inchangé n'apprend rien : on ne l'ajoute pas à l'historique
+    booking_confirm_panel(uid, vehicle_id, selected_ids, booking_type, payment_mode,
+                          int(mileage) if mileage != current else None)
+
+# Les panneaux se partagent le créneau et l'adresse via session_state
+@panel("Créneaux")
+def booking_slot_panel(selected_ids):
+    d = st.date_input("Date", value=date.today())
+    slots = sch.available_slots(d, selected_ids)
+    if slots:
+        default = next((i for i, s in enumerate(slots) if s.time() >= time(10, 0)), 0)
+        scheduled_dt = st.selectbox("Heure", slots, index=default, format_func=lambda s: s.strftime("%H:%M"))
+    else:
+        st.warning("Aucun créneau disponible à cette date.")
+        scheduled_dt = None
+    st.session_state.bk_slot = scheduled_dt
+
+    duration = u.quote_duration(selected_ids)
+    if duration and scheduled_dt:
+        end = scheduled_dt + timedelta(minutes=duration)
+        st.caption(f"Durée estimée : {duration} min — fin prévue vers {end:%H:%M}")
+
+@panel("Localisation")
+def booking_location_panel():
+    st.text_input("Adresse (libre)", key="bk_address")
+    lat = st.number_input("Latitude", value=36.7538, format="%.6f", key="bk_lat")
+    lon = st.number_input("Longitude", value=3.0588, format="%.6f", key="bk_lon")
+    if lat and lon:
+        st.link_button("Vérifier sur la carte",
+                       f"https://www.openstreetmap.org/?mlat={lat:.6f}&mlon={lon:.6f}#map=17/{lat:.6f}/{lon:.6f}")
+
+@panel("Devis")
+def booking_confirm_panel(uid, vehicle_id, selected_ids, booking_type, payment_mode, mileage=None):
+    total, base, surcharge, _ = u.quote_engine().quote(selected_ids, booking_type)
     st.info(f"**Devis instantané : {total} DA** (services : {base} DA, surcharge : {surcharge} DA)")
 
-    if st.button("Confirmer la réservation", use_container_width=True, disabled=(len(selected_ids)==0)):
-        bid = u.create_booking(uid, vehicle_id, selected_ids, total, booking_type,
-                               address, lat, lon, scheduled_dt, payment_mode)
-        st.success(f"Réservation confirmée. Numéro #{bid}. Vous recevrez une confirmation (simulation).")
+    if st.button("Confirmer la réservation", use_container_width=True, disabled=len(selected_ids)==0):
+        scheduled_dt = st.session_state.get("bk_slot")
+        if scheduled_dt is None:
+            st.error("Choisissez un créneau disponible.")
+            return
+        address, lat, lon = None, None, None
+        if booking_type == "domicile":
+            address, lat, lon = (st.session_state.get(k) for k in ("bk_address", "bk_lat", "bk_lon"))
+            if not (address or "").strip():
+                st.error("Indiquez l'adresse de l'intervention.")
+                return
+        try:
+            bid, _ = sch.confirm_booking(uid, vehicle_id, selected_ids, total, booking_type,
+                                         address, lat, lon, scheduled_dt, payment_mode,
+                                         mileage=mileage)
+        except sch.SlotUnavailable:
+            st.error("Ce créneau vient d'être pris. Choisissez une autre heure.")
+        except ValueError:
+            st.error("Un des services choisis n'est plus proposé. Actualisez la sélection.")
+        else:
+            maintenance.refresh([vehicle_id])
+            drop_session_data(("vehicles", uid))
+            st.success(f"Réservation confirmée. Numéro #{bid}. Vous recevrez une confirmation par email"
+                       f"{' et SMS' if st.session_state.user.get('phone') else ''}.")
 
 # ---------------- UI : Mes réservations ----------------
+@inst.timed_render("Mes rendez-vous")
 def ui_my_bookings():
     st.subheader("Mes rendez-vous")
     if not st.session_state.user:
@@ -138,47 +311,52 @@ def ui_my_bookings():
         return
 
     uid = st.session_state.user["id"]
-    df = u.list_bookings(user_id=uid)
-    if df.empty:
+    # Base chaude par défaut ; l'historique archivé seulement sur demande
+    history = bool(u.archive_status()) and st.toggle("Inclure l'historique archivé")
+    bookings = u.user_bookings(uid, history=history)
+    if not bookings:
         st.info("Aucune réservation.")
         return
 
-    lookup = u.services_lookup()
-    def label_services(js):
-        try:
-            ids = json.loads(js)
-            return ", ".join([lookup.get(int(i), f'#{i}') for i in ids])
-        except Exception:
-            return js
-
-    df["services"] = df["service_ids"].apply(label_services)
-    df["quand"] = pd.to_datetime(df["scheduled_at"]).dt.strftime("%Y-%m-%d %H:%M")
-    show = df[["id","quand","booking_type","services","total_price_da","status","payment_mode","rating"]]
-    st.dataframe(show, use_container_width=True, hide_index=True)
+    md_table(["N°", "Quand", "Lieu", "Services", "Total (DA)", "Statut", "Paiement", "Note"],
+             [(b.id, b.when, b.booking_type, b.services, b.total_price_da, b.status, b.payment_mode, b.rating)
+              for b in bookings])
 
     st.markdown("#### Actions")
+    my_bookings_actions_panel(uid)
+
+@panel("Actions")
+def my_bookings_actions_panel(uid):
     col1, col2 = st.columns(2)
 
     with col1:
         cancel_id = st.number_input("Annuler réservation #", min_value=0, step=1, value=0)
         if st.button("Annuler", use_container_width=True) and cancel_id>0:
-            conn = u.get_conn()
-            conn.execute("UPDATE bookings SET status='annulé' WHERE id=? AND user_id=?", (int(cancel_id), uid))
-            conn.commit()
-            conn.close()
-            st.success("Réservation annulée.")
+            try:
+                bs.transition(int(cancel_id), bs.CANCELLED, user_id=uid)
+            except bs.BookingNotFound:
+                st.error("Réservation introuvable.")
+            except bs.InvalidTransition as e:
+                st.error(f"Impossible d'annuler une réservation au statut « {e.current} ».")
+            else:
+                sch.invalidate()
+                flash("Réservation annulée.")
 
     with col2:
         rate_id = st.number_input("Noter la prestation #", min_value=0, step=1, value=0)
         rating = st.slider("Note (1-5)", min_value=1, max_value=5, value=5)
         if st.button("Enregistrer la note", use_container_width=True) and rate_id>0:
-            conn = u.get_conn()
-            conn.execute("UPDATE bookings SET rating=? WHERE id=? AND user_id=?", (int(rating), int(rate_id), uid))
-            conn.commit()
-            conn.close()
-            st.success("Merci pour votre retour !")
+            try:
+                bs.rate(int(rate_id), uid, rating)
+            except bs.BookingNotFound:
+                st.error("Réservation introuvable.")
+            except bs.InvalidTransition:
+                st.error("Seule une prestation terminée peut être notée.")
+            else:
+                flash("Merci pour votre retour !")
 
 # ---------------- UI Admin : Services ----------------
+@inst.timed_render("Services & Tarifs")
 def ui_admin_services():
     st.subheader("Services & Tarifs")
     dfs = u.get_services(active_only=False)
@@ -193,11 +371,7 @@ def ui_admin_services():
         dur = st.number_input("Durée (min)", min_value=5, step=5, value=30)
         cat = st.text_input("Catégorie", value="Entretien")
         if st.button("Créer le service", use_container_width=True):
-            conn = u.get_conn()
-            conn.execute("INSERT INTO services(name, base_price_da, duration_min, category, active) VALUES(?,?,?,?,1)",
-                         (name, int(price), int(dur), cat))
-            conn.commit()
-            conn.close()
+            u.create_service(name, int(price), int(dur), cat)
             st.success("Service créé.")
 
     elif mode == "Modifier":
@@ -211,11 +385,7 @@ def ui_admin_services():
         dur = st.number_input("Durée (min)", min_value=5, step=5, value=int(row["duration_min"]))
         cat = st.text_input("Catégorie", value=row["category"])
         if st.button("Enregistrer les modifications", use_container_width=True):
-            conn = u.get_conn()
-            conn.execute("""UPDATE services SET name=?, base_price_da=?, duration_min=?, category=? WHERE id=?""",
-                         (name, int(price), int(dur), cat, int(sid)))
-            conn.commit()
-            conn.close()
+            u.update_service(int(sid), name, int(price), int(dur), cat)
             st.success("Modifications enregistrées.")
 
     else:
@@ -226,10 +396,7 @@ def ui_admin_services():
         active = int(dfs[dfs["id"]==sid]["active"].iloc[0])
         new_active = st.toggle("Actif", value=bool(active))
         if st.button("Mettre à jour l'état", use_container_width=True):
-            conn = u.get_conn()
-            conn.execute("UPDATE services SET active=? WHERE id=?", (1 if new_active else 0, int(sid)))
-            conn.commit()
-            conn.close()
+            u.set_service_active(int(sid), new_active)
             st.success("État mis à jour.")
 
     st.divider()
@@ -241,90 +408,335 @@ def ui_admin_services():
         st.success("Paramètres enregistrés.")
 
 # ---------------- UI Admin : Techniciens ----------------
+@inst.timed_render("Techniciens")
 def ui_admin_techs():
     st.subheader("Techniciens")
-    conn = u.get_conn()
-    dft = pd.read_sql_query("SELECT * FROM technicians", conn)
-    conn.close()
-    st.dataframe(dft, use_container_width=True, hide_index=True)
+    st.dataframe(u.get_technicians(), use_container_width=True, hide_index=True)
     st.markdown("### Ajouter un technicien")
     name = st.text_input("Nom complet du technicien")
     phone = st.text_input("Téléphone")
     if st.button("Ajouter", use_container_width=True):
-        conn = u.get_conn()
-        conn.execute("INSERT INTO technicians(name, phone, active) VALUES(?,?,1)", (name, phone))
-        conn.commit()
-        conn.close()
-        st.success("Technicien ajouté.")
+        u.create_technician(name, phone)
+        sch.invalidate()
+        flash("Technicien ajouté.")
 
 # ---------------- UI Admin : Rendez-vous ----------------
+ADMIN_PAGE_SIZE = 50
+
+def admin_bookings_table(df):
+    import pandas as pd
+    df["client"] = df["client_name"].fillna(df["user_id"].apply(lambda x: f"#{x}"))
+    df["véhicule"] = df["plate"].fillna(df["vehicle_id"].apply(lambda x: f"#{x}"))
+    df["quand"] = pd.to_datetime(df["scheduled_at"]).dt.strftime("%Y-%m-%d %H:%M")
+    return df[["id","client","véhicule","quand","booking_type","services","total_price_da","status","technician_id","rating"]]
+
+# Résultat de recherche → filtre de la liste des rendez-vous
+SEARCH_FILTERS = {"client": "user_id", "véhicule": "vehicle_id", "réservation": "booking_id"}
+
+def admin_search_filter():
+    q = st.text_input("Rechercher", type="search", live=True, key="bk_search",
+                      placeholder="Nom, email, téléphone, immatriculation, adresse, notes…")
+    if not q.strip():
+        return {}
+    hits = u.search(q)
+    if hits.empty:
+        st.caption("Aucun résultat.")
+        return {}
+    labels = {i: f"{r['kind'].capitalize()} — {r['label']}" for i, r in hits.iterrows()}
+    pick = st.selectbox(f"{len(hits)} résultat(s) — afficher les rendez-vous de", list(labels), format_func=labels.get)
+    hit = hits.loc[pick]
+    return {SEARCH_FILTERS[hit["kind"]]: int(hit["id"])}
+
+@inst.timed_render("Rendez-vous")
 def ui_admin_bookings():
     st.subheader("Rendez-vous (tous)")
-    df = u.list_bookings()
-    if df.empty:
+    dft = u.get_technicians(active_only=True)
+    tech_names = dict(zip(dft["id"], dft["name"]))
+    admin_bookings_panel(tech_names)
+    st.markdown("### Affecter un technicien / Mettre à jour le statut")
+    admin_booking_update_panel(tech_names)
+    with st.expander("Actions groupées"):
+        admin_batch_panel(tech_names)
+
+@panel("Liste")
+def admin_bookings_panel(tech_names):
+    found = admin_search_filter()
+    tech_options = [0] + list(tech_names)
+    f1, f2, f3, f4, f5 = st.columns(5)
+    f_status = f1.selectbox("Filtre statut", ["Tous","planifié","en_cours","terminé","annulé"])
+    f_type = f2.selectbox("Filtre lieu", ["Tous","atelier","domicile"])
+    f_tech = f3.selectbox("Filtre technicien", tech_options, format_func=lambda x: "Tous" if x == 0 else tech_names[x])
+    f_from = f4.date_input("Du", value=None)
+    f_to = f5.date_input("Au", value=None)
+    filters = dict(status=None if f_status == "Tous" else f_status,
+                   booking_type=None if f_type == "Tous" else f_type,
+                   technician_id=f_tech or None, date_from=f_from, date_to=f_to)
+    filters.update(found)
+
+    # Curseurs des pages déjà vues ; repartir de la première page si les filtres changent
+    if st.session_state.get("bk_filters") != filters:
+        st.session_state.bk_filters = filters
+        st.session_state.bk_cursors = [None]
+    cursors = st.session_state.bk_cursors
+
+    df, total = u.list_bookings_page(after=cursors[-1], page_size=ADMIN_PAGE_SIZE, **filters)
+    if total == 0:
         st.info("Aucun rendez-vous.")
         return
 
-    lookup = u.services_lookup()
-    df["services"] = df["service_ids"].apply(lambda js: ", ".join([lookup.get(int(i), f'#{i}') for i in json.loads(js)]))
-    df["client"] = df["user_id"].apply(lambda x: f"#{x}")
-    df["quand"] = pd.to_datetime(df["scheduled_at"]).dt.strftime("%Y-%m-%d %H:%M")
-    show = df[["id","client","vehicle_id","quand","booking_type","services","total_price_da","status","technician_id","rating"]]
-    st.dataframe(show, use_container_width=True, hide_index=True)
-
-    st.markdown("### Affecter un technicien / Mettre à jour le statut")
-    bid = st.number_input("ID Réservation", min_value=0, step=1, value=0)
-    status = st.selectbox("Statut", ["planifié","en_cours","terminé","annulé"])
-
-    conn = u.get_conn()
-    dft = pd.read_sql_query("SELECT id, name FROM technicians WHERE active=1", conn)
-    conn.close()
+    st.dataframe(admin_bookings_table(df), use_container_width=True, hide_index=True)
+
+    page = len(cursors)
+    pages = max(1, -(-total // ADMIN_PAGE_SIZE))
+    # Curseurs modifiés en callback : le clic relance le panneau sur la bonne page, sans st.rerun
+    last = (df["scheduled_at"].iloc[-1], int(df["id"].iloc[-1])) if not df.empty else None
+    p1, p2, p3 = st.columns([1, 2, 1])
+    p1.button("◀ Précédent", use_container_width=True, disabled=page == 1, on_click=cursors.pop)
+    p2.caption(f"Page {page} / {pages} — {total} rendez-vous")
+    p3.button("Suivant ▶", use_container_width=True, disabled=page >= pages or last is None,
+              on_click=cursors.append, args=(last,))
+
+@panel("Mise à jour")
+def admin_booking_update_panel(tech_names):
+    bid = int(st.number_input("ID Réservation", min_value=0, step=1, value=0))
+    current = bs.get(bid) if bid else None
+    if current is None:
+        if bid:
+            st.info(f"Réservation #{bid} introuvable.")
+        return
+    # Version vue à l'affichage de la fiche : l'enregistrement échoue si quelqu'un l'a modifiée depuis
+    seen = st.session_state.get("bk_seen")
+    if not seen or seen[0] != bid:
+        seen = st.session_state.bk_seen = (bid, current["version"])
+    st.caption(f"Statut actuel : {current['status']} — version {seen[1]}")
+
+    status = st.selectbox("Statut", (current["status"],) + bs.allowed(current["status"]))
+    options = [0] + list(tech_names)
+    tech = current["technician_id"] if current["technician_id"] in tech_names else 0
+    tech_id = st.selectbox("Technicien", options, index=options.index(tech), format_func=lambda x: tech_names.get(x, "—"))
+
+    if st.button("Enregistrer", use_container_width=True):
+        tech_id = None if tech_id == 0 else int(tech_id)
+        try:
+            if status == current["status"]:
+                bs.assign(bid, tech_id, expected_version=seen[1])
+            else:
+                bs.transition(bid, status, expected_version=seen[1], technician_id=tech_id)
+        except bs.StaleBooking:
+            st.session_state.pop("bk_seen", None)
+            st.error("Cette réservation a été modifiée entre-temps : vérifiez la fiche rechargée et recommencez.")
+        except bs.InvalidTransition as e:
+            st.error(f"Transition impossible : {e.current} → {e.target}.")
+        else:
+            st.session_state.pop("bk_seen", None)
+            sch.invalidate()
+            flash("Mise à jour effectuée.")
+
+BATCH_ACTIONS = {"Démarrer les rendez-vous planifiés": bs.IN_PROGRESS,
+                 "Clôturer les rendez-vous en cours": bs.DONE}
+
+@panel("Actions groupées")
+def admin_batch_panel(tech_names):
+    c1, c2, c3 = st.columns(3)
+    tech_id = c1.selectbox("Technicien ", list(tech_names), format_func=tech_names.get)
+    day = c2.date_input("Jour", value=date.today(), key="batch_day")
+    action = c3.selectbox("Action", list(BATCH_ACTIONS))
+    if st.button("Appliquer", use_container_width=True, disabled=tech_id is None):
+        ids = bs.batch_transition(BATCH_ACTIONS[action], technician_id=tech_id, day=day)
+        sch.invalidate(day)
+        flash(f"{len(ids)} rendez-vous mis à jour.")
+
+# ---------------- UI Admin : Tournées ----------------
+@inst.timed_render("Tournées")
+def ui_admin_routes():
+    import pandas as pd
+    import routing
+    st.subheader("Tournées à domicile")
+    d = st.date_input("Jour", value=date.today())
+    plan = routing.plan_day(d)
+    if plan.empty:
+        st.info("Aucune intervention à domicile ce jour.")
+        return
 
-    tech_options = [0] + dft["id"].tolist()
-    def _fmt(x):
-        if x == 0:
-            return "—"
-        return dft[dft["id"]==x]["name"].iloc[0]
+    dft = u.get_technicians()
+    names = dict(zip(dft["id"], dft["name"]))
+    plan["technicien"] = plan["technician_id"].map(lambda x: names.get(x, "—") if pd.notna(x) else "—")
 
-    tech_id = st.selectbox("Technicien", tech_options, format_func=_fmt)
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Interventions", len(plan))
+    c2.metric("Distance totale (km)", round(float(plan["leg_km"].sum()), 1))
+    c3.metric("Retard cumulé (min)", int(plan["late_min"].sum()))
 
-    if st.button("Enregistrer", use_container_width=True) and bid>0:
-        conn = u.get_conn()
-        conn.execute("UPDATE bookings SET status=?, technician_id=? WHERE id=?", (status, None if tech_id==0 else int(tech_id), int(bid)))
-        conn.commit()
-        conn.close()
-        st.success("Mise à jour effectuée.")
+    show = plan[["technicien","seq","booking_id","scheduled_at","arrival","leg_km","late_min"]]
+    st.dataframe(show, use_container_width=True, hide_index=True)
+    st.map(plan, latitude="latitude", longitude="longitude")
+
+# ---------------- UI Admin : Exports ----------------
+@inst.timed_render("Exports")
+def ui_admin_exports():
+    import export
+    st.subheader("Exports comptables")
+    scope = st.radio("Période", ["Mois", "Année"], horizontal=True)
+    c1, c2 = st.columns(2)
+    year = c1.number_input("Année", min_value=2000, max_value=2100, value=date.today().year, step=1)
+    month = c2.selectbox("Mois", list(range(1, 13)), index=date.today().month - 1) if scope == "Mois" else None
+    formats = ["csv", "parquet"] if export.parquet_available() else ["csv"]
+    fmt = st.radio("Format", formats, horizontal=True)
+
+    date_from, date_to = export.period(int(year), month)
+    name = f"reservations_{int(year)}{f'-{month:02d}' if month else ''}.{fmt}"
+    # Génération différée au clic, lue en base par paquets
+    st.download_button("Télécharger", data=lambda: export.export_to_tempfile(fmt, date_from, date_to),
+                       file_name=name, mime="text/csv" if fmt == "csv" else "application/octet-stream",
+                       use_container_width=True)
+
+# ---------------- UI Admin : Imports ----------------
+IMPORT_KINDS = {"Réservations historiques": "bookings", "Services": "services", "Techniciens": "technicians"}
+
+@inst.timed_render("Import")
+def ui_admin_import():
+    st.subheader("Import en masse")
+    kind = IMPORT_KINDS[st.radio("Données", list(IMPORT_KINDS), horizontal=True)]
+    if kind == "bookings":
+        st.caption("Colonnes : email, plate, scheduled_at, services (IDs ou noms séparés par « | »), "
+                   "puis booking_type, status, technician, total_price_da, rating, notes… en option.")
+    create_missing = kind == "bookings" and st.checkbox("Créer les clients et véhicules inconnus")
+    file = st.file_uploader("Fichier CSV ou JSON", type=["csv", "json"])
+    if file is None or not st.button("Importer", type="primary"):
+        return
+    import bulk_import
+    try:
+        report = bulk_import.import_file(kind, file, create_missing=create_missing)
+    except ValueError as e:
+        st.error(f"Fichier illisible : {e}")
+        return
+    sch.invalidate()
+    (st.success if report.inserted or report.updated else st.warning)(report.summary())
+    errors = report.errors
+    if len(errors):
+        st.dataframe(errors, use_container_width=True, hide_index=True)
+        st.download_button("Télécharger les rejets", errors.to_csv(index=False).encode("utf-8"),
+                           file_name=f"rejets_{kind}.csv", mime="text/csv")
 
 # ---------------- UI Admin : Statistiques ----------------
+def load_admin_stats():
+    # Copie d'analyse : les agrégats ne disputent rien aux réservations en cours
+    with snapshots.analytics():
+        return _admin_stats()
+
+def _admin_stats():
+    dfm = u.monthly_stats()
+    if dfm.empty:
+        return None
+    rating_nb = int(dfm["rating_nb"].sum())
+    return {
+        "nb": int(dfm["prestations"].sum()),
+        "ca": int(dfm["ca_da"].sum()),
+        "note": round(float(dfm["rating_sum"].sum()) / rating_nb, 2) if rating_nb else None,
+        "monthly": dfm.set_index("mois"),
+        "daily": u.daily_stats(date.today() - timedelta(days=30), date.today()).set_index("jour"),
+        "status": u.status_stats(),
+        "technicians": u.technician_stats(),
+        "services": u.service_stats(),
+    }
+
+@inst.timed_render("Statistiques")
 def ui_admin_stats():
     st.subheader("Statistiques")
-    df = u.list_bookings()
-    if df.empty:
+    s = load_admin_stats()
+    if s is None:
         st.info("Aucune donnée pour l'instant.")
         return
-    df["date"] = pd.to_datetime(df["scheduled_at"]).dt.date
-    df["mois"] = pd.to_datetime(df["scheduled_at"]).dt.to_period("M").astype(str)
-    ca = int(df["total_price_da"].sum())
-    nb = int(len(df))
-    sat = df["rating"].dropna()
-    note = round(float(sat.mean()), 2) if not sat.empty else None
+
+    snap = snapshots.status()
+    if snap:
+        st.caption(f"Copie d'analyse du {snap['taken_at'][:19].replace('T', ' ')} UTC (il y a {snap['age_s']} s, "
+                   f"limite {snapshots.max_age():.0f} s) — rafraîchie en {snap['seconds']:.2f} s, "
+                   f"{snap['pages']} pages, {snap['restarts']} reprise(s) ; {snap['count']} sauvegarde(s) conservée(s).")
+    archived = u.archive_status()
+    if archived:
+        st.caption(f"Historique complet, archives comprises — dernier archivage le {archived['at'][:10]} "
+                   f"(rendez-vous clos antérieurs au {archived['cutoff'][:10]}).")
 
     c1,c2,c3 = st.columns(3)
-    c1.metric("Prestations", nb)
-    c2.metric("CA total (DA)", ca)
-    c3.metric("Satisfaction moyenne", note if note else "—")
+    c1.metric("Prestations", s["nb"])
+    c2.metric("CA total (DA)", s["ca"])
+    c3.metric("Satisfaction moyenne", s["note"] if s["note"] else "—")
 
     st.markdown("#### Prestations / mois")
-    st.bar_chart(df.groupby("mois")["id"].count())
+    st.bar_chart(s["monthly"]["prestations"])
 
     st.markdown("#### CA / mois (DA)")
-    st.bar_chart(df.groupby("mois")["total_price_da"].sum())
+    st.bar_chart(s["monthly"]["ca_da"])
+
+    st.markdown("#### 30 derniers jours")
+    if not s["daily"].empty:
+        st.bar_chart(s["daily"]["prestations"])
+
+    c1, c2 = st.columns(2)
+    with c1:
+        st.markdown("#### Par statut")
+        st.dataframe(s["status"], use_container_width=True, hide_index=True)
+    with c2:
+        st.markdown("#### Par technicien")
+        st.dataframe(s["technicians"], use_container_width=True, hide_index=True)
+
+    st.markdown("#### Services les plus demandés")
+    st.dataframe(s["services"], use_container_width=True, hide_index=True)
+
+# ---------------- UI Admin : Réseau ----------------
+@inst.timed_render("Réseau")
+def ui_admin_network():
+    st.subheader("Réseau de garages")
+    t0 = perf_counter()
+    s = tenants.network_stats()
+    garages = s["garages"]
+    st.caption(f"{len(garages)} garage(s), bases interrogées en parallèle en {(perf_counter() - t0) * 1e3:.0f} ms.")
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Prestations", int(garages["prestations"].sum()))
+    c2.metric("CA total (DA)", int(garages["ca_da"].sum()))
+    c3.metric("Garages actifs", int((garages["prestations"] > 0).sum()))
+
+    st.markdown("#### Par garage")
+    st.dataframe(garages, use_container_width=True, hide_index=True)
+    if s["detail"].empty:
+        return
+    st.markdown("#### CA / mois (DA) par garage")
+    st.bar_chart(s["detail"].pivot_table(index="mois", columns="garage", values="ca_da", aggfunc="sum"))
+    st.markdown("#### Réseau : prestations / mois")
+    st.bar_chart(s["monthly"].set_index("mois")["prestations"])
+
+# ---------------- UI Admin : Performance ----------------
+def ui_admin_perf():
+    import pandas as pd
+    st.subheader("Performance")
+    log = f", journal : {inst.SLOW_QUERY_LOG}" if inst.SLOW_QUERY_LOG else ""
+    st.caption(f"Mesures du processus depuis {inst.uptime() / 60:.0f} min — "
+               f"requête lente au-delà de {inst.SLOW_QUERY_MS:.0f} ms{log}")
+    c1, c2 = st.columns([3, 1])
+    by = c1.radio("Trier les requêtes par", ["total_ms", "max_ms", "appels", "lignes"], horizontal=True)
+    if c2.button("Remettre à zéro", use_container_width=True):
+        inst.reset()
+        st.rerun()
+
+    st.markdown("#### Requêtes")
+    st.dataframe(pd.DataFrame(inst.top_queries(30, by)), use_container_width=True, hide_index=True)
+    st.markdown("#### Rendus les plus lents")
+    st.dataframe(pd.DataFrame(inst.slowest_renders(20)), use_container_width=True, hide_index=True)
+    st.markdown("#### Caches")
+    cat = u.cache_stats()
+    st.dataframe(pd.DataFrame(inst.cache_rates({"catalogue": (cat["hits"], cat["misses"])})),
+                 use_container_width=True, hide_index=True)
+    st.markdown("#### Notifications (outbox)")
+    st.dataframe(pd.DataFrame([notifications.metrics()]), use_container_width=True, hide_index=True)
+    st.markdown("#### Derniers événements")
+    st.dataframe(pd.DataFrame(inst.recent_events()), use_container_width=True, hide_index=True)
 
 # ---------------- Main ----------------
 def main():
     st.set_page_config(page_title="LuxeVidange – Réservation vidange haut de gamme", page_icon="🛠️", layout="wide")
     ensure_session()
-    u.init_db()
+    u.ensure_db()
 
     st.sidebar.title("LuxeVidange")
     st.sidebar.caption("Service de vidange haut de gamme")
@@ -332,6 +744,13 @@ def main():
 
     role = st.sidebar.radio("Espace", ["Client", "Admin"], horizontal=True)
     st.session_state.role = role
+    garages = garage_selector()
+    for garage in garages or [None]:
+        with u.use_garage(garage):
+            u.ensure_db()
+            notifications.start_worker()
+            snapshots.start_refresher()
+    u.ensure_db()
 
     if st.session_state.user:
         st.sidebar.success(f"Connecté : {st.session_state.user['name']}")
@@ -339,6 +758,22 @@ def main():
             st.session_state.user = None
             st.rerun()
 
+    show_flash()
+    t0 = perf_counter()
+    with inst.run_scope() as run:
+        render_page(role)
+
+    if perf_mode():
+        st.sidebar.divider()
+        st.sidebar.toggle("Temps d'exécution", key="perf_overlay")
+        if perf_enabled():
+            import pandas as pd
+            queries = run.rows("queries")
+            with st.sidebar.expander(f"⏱ Exécution complète : {(perf_counter() - t0) * 1e3:.1f} ms — "
+                                     f"{sum(q['appels'] for q in queries)} requête(s)"):
+                st.dataframe(pd.DataFrame(queries), hide_index=True)
+
+def render_page(role):
     if role == "Client":
         page = st.sidebar.selectbox("Navigation", ["Accueil / Connexion", "Mon véhicule", "Réserver", "Mes rendez-vous"])
         if page == "Accueil / Connexion":
@@ -354,15 +789,31 @@ def main():
 
     else:  # Admin
         st.title("Back-office Partenaire")
-        page = st.sidebar.selectbox("Navigation", ["Services & Tarifs", "Rendez-vous", "Techniciens", "Statistiques"])
+        garage = u.current_garage()
+        if garage:
+            st.caption(f"Garage : {garage['name']} — services, techniciens, paramètres et rendez-vous de ce seul garage.")
+        pages = ["Services & Tarifs", "Rendez-vous", "Tournées", "Techniciens", "Statistiques", "Exports", "Import"]
+        if garage:
+            pages.append("Réseau")
+        page = st.sidebar.selectbox("Navigation", pages + ["Performance"] if perf_mode() else pages)
         if page == "Services & Tarifs":
             ui_admin_services()
         elif page == "Rendez-vous":
             ui_admin_bookings()
+        elif page == "Tournées":
+            ui_admin_routes()
         elif page == "Techniciens":
             ui_admin_techs()
-        else:
+        elif page == "Statistiques":
             ui_admin_stats()
+        elif page == "Exports":
+            ui_admin_exports()
+        elif page == "Import":
+            ui_admin_import()
+        elif page == "Réseau":
+            ui_admin_network()
+        else:
+            ui_admin_perf()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1 @@
+"""Bancs d'essai de performance (``python -m bench.<module>`` depuis la racine du dépôt)."""
@@ -0,0 +1,170 @@
+"""Charge sur l'API JSON : requêtes par seconde et latences extrêmes par point d'entrée.
+
+    python -m bench.api --connections 32 --seconds 20
+    python -m bench.api --db vidange.db --email client@exemple.dz --password ...   # base de l'interface
+
+Le serveur tourne dans un processus séparé (python cli.py api), comme en production.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+import utils as u
+from bench.seed import BENCH_PASSWORD, seed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Répartition des appels (poids relatifs)
+MIX = {"services": 30, "quote": 25, "slots": 20, "vehicles": 10, "bookings": 10, "create": 5}
+
+
+class Client:
+    """Connexion HTTP/1.1 persistante, sans dépendance."""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, payload=None, token=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        data = json.dumps(payload).encode() if payload is not None else b""
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(data)}"]
+        if payload is not None:
+            head.append("Content-Type: application/json")
+        if token:
+            head.append(f"Authorization: Bearer {token}")
+        self.writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+        await self.writer.drain()
+        lines = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        status = int(lines[0].split()[1])
+        length = next(int(l.split(":", 1)[1]) for l in lines if l.lower().startswith("content-length:"))
+        body = await self.reader.readexactly(length)
+        return status, json.loads(body) if body else None
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+
+
+async def login(host, port, emails, password):
+    client = Client(host, port)
+    tokens = []
+    for email in emails:
+        status, data = await client.request("POST", "/auth", {"email": email, "password": password})
+        if status != 200:
+            raise SystemExit(f"connexion refusée pour {email} : {status} {data}")
+        tokens.append(data["token"])
+    vehicles = {}
+    for token in tokens:
+        _, rows = await client.request("GET", "/vehicles", token=token)
+        vehicles[token] = [r["id"] for r in rows]
+    await client.close()
+    return [(t, v) for t, v in vehicles.items() if v]
+
+
+async def worker(host, port, users, service_ids, stop, latencies, statuses, rng):
+    client = Client(host, port)
+    names, weights = list(MIX), list(MIX.values())
+    while time.perf_counter() < stop:
+        kind = rng.choices(names, weights)[0]
+        token, vehicles = rng.choice(users)
+        ids = rng.sample(service_ids, rng.randint(1, min(3, len(service_ids))))
+        day = (date.today() + timedelta(days=rng.randint(1, 30))).isoformat()
+        t0 = time.perf_counter()
+        if kind == "services":
+            status, _ = await client.request("GET", "/services")
+        elif kind == "quote":
+            status, _ = await client.request("POST", "/quote", {"service_ids": ids, "booking_type": rng.choice(["atelier", "domicile"])})
+        elif kind == "slots":
+            status, _ = await client.request("GET", f"/slots?date={day}&service_ids={','.join(map(str, ids))}")
+        elif kind == "vehicles":
+            status, _ = await client.request("GET", "/vehicles", token=token)
+        elif kind == "bookings":
+            status, _ = await client.request("GET", "/bookings", token=token)
+        else:
+            hour = rng.randint(8, 16)
+            status, _ = await client.request("POST", "/bookings", {
+                "vehicle_id": rng.choice(vehicles), "service_ids": ids,
+                "scheduled_at": f"{day}T{hour:02d}:{rng.choice(['00', '15', '30', '45'])}"}, token=token)
+        latencies[kind].append(time.perf_counter() - t0)
+        statuses[kind][status] += 1
+    await client.close()
+
+
+async def run(host, port, users, service_ids, connections, seconds):
+    latencies, statuses = defaultdict(list), defaultdict(lambda: defaultdict(int))
+    stop = time.perf_counter() + seconds
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(host, port, users, service_ids, stop, latencies, statuses, random.Random(k))
+                           for k in range(connections)))
+    return time.perf_counter() - t0, latencies, statuses
+
+
+def _pct(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] * 1e3
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--db", help="base à utiliser (défaut : base temporaire remplie par bench.seed)")
+    p.add_argument("--email", nargs="+", help="comptes existants (défaut : comptes de bench.seed)")
+    p.add_argument("--password", default=BENCH_PASSWORD)
+    p.add_argument("--users", type=int, default=8, help="comptes connectés, jetons partagés entre connexions")
+    p.add_argument("--connections", type=int, default=32)
+    p.add_argument("--seconds", type=float, default=15.0)
+    p.add_argument("--port", type=int, default=8655)
+    args = p.parse_args(argv)
+
+    u.DB_PATH = args.db or os.path.join(tempfile.mkdtemp(), "bench_api.db")
+    u.init_db()
+    if not args.db:
+        seed(users=2_000, bookings=20_000, log=lambda m: None)
+    emails = args.email or [r[0] for r in u.get_conn().execute(
+        "SELECT email FROM users WHERE email LIKE '%@bench.local' ORDER BY id LIMIT ?", (args.users,))]
+    service_ids = u.get_services(active_only=True)["id"].astype(int).tolist()
+
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "cli.py"), "--db", u.DB_PATH,
+                               "api", "--port", str(args.port)], cwd=ROOT)
+    try:
+        deadline = time.time() + 20
+        while True:
+            try:
+                asyncio.run(Client("127.0.0.1", args.port).request("GET", "/health"))
+                break
+            except OSError:
+                if time.time() > deadline or server.poll() is not None:
+                    raise SystemExit("le serveur API n'a pas démarré")
+                time.sleep(0.2)
+        users = asyncio.run(login("127.0.0.1", args.port, emails, args.password))
+        elapsed, latencies, statuses = asyncio.run(
+            run("127.0.0.1", args.port, users, service_ids, args.connections, args.seconds))
+    finally:
+        server.terminate()
+        server.wait()
+
+    total = sum(len(v) for v in latencies.values())
+    every = sorted(x for v in latencies.values() for x in v)
+    print(f"{args.connections} connexions, {elapsed:.1f} s : {total / elapsed:,.0f} requêtes/s, "
+          f"p50 {_pct(every, 0.5):.1f} ms, p95 {_pct(every, 0.95):.1f} ms, p99 {_pct(every, 0.99):.1f} ms")
+    for kind in MIX:
+        lat = sorted(latencies.get(kind, []))
+        if not lat:
+            continue
+        codes = ", ".join(f"{s}×{n}" for s, n in sorted(statuses[kind].items()))
+        print(f"  {kind:9s} {len(lat) / elapsed:7.0f}/s  p50 {statistics.median(lat) * 1e3:6.1f} ms  "
+              f"p95 {_pct(lat, 0.95):6.1f} ms  p99 {_pct(lat, 0.99):6.1f} ms  [{codes}]")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Latence des chemins chauds avant et après archivage des réservations closes.
+
+    python -m bench.archive --users 20000 --bookings 1000000 --years 5 --horizon 365
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+import numpy as np
+
+import scheduling as sch
+import utils as u
+from bench.seed import seed
+
+
+def _ms(fn, reps):
+    times = []
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1e3)
+    return statistics.median(times)
+
+
+def measure(users, reps, history=False):
+    rng = np.random.default_rng(0)
+    picks = iter(rng.integers(1, users + 1, reps * 4).tolist())
+    today = date.today()
+    out = {
+        "mes rendez-vous (client)": _ms(lambda: u.list_bookings(next(picks)), reps),
+        "liste admin, page 1 + total": _ms(lambda: u.list_bookings_page(page_size=50), reps),
+        "liste admin, terminé": _ms(lambda: u.list_bookings_page(status="terminé", page_size=50), reps),
+        "planning du jour": _ms(lambda: sch.DaySchedule.load(u.get_conn(), today), reps),
+    }
+    if history:
+        out["mes rendez-vous + historique"] = _ms(lambda: u.list_bookings(next(picks), history=True), reps)
+    return out
+
+
+def _size(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p)) / 1e6
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--db", help="base à utiliser (défaut : base temporaire remplie par bench.seed)")
+    p.add_argument("--users", type=int, default=10_000)
+    p.add_argument("--bookings", type=int, default=300_000)
+    p.add_argument("--years", type=int, default=5)
+    p.add_argument("--horizon", type=int, default=365)
+    p.add_argument("--reps", type=int, default=50)
+    args = p.parse_args(argv)
+
+    u.DB_PATH = args.db or os.path.join(tempfile.mkdtemp(), "bench_archive.db")
+    u.init_db()
+    if not args.db:
+        seed(users=args.users, bookings=args.bookings, years=args.years, log=lambda m: None)
+    users = u.get_conn().execute("SELECT MAX(id) FROM users").fetchone()[0]
+
+    before = measure(users, args.reps)
+    hot_before = u.get_conn().execute("SELECT COUNT(*) FROM bookings").fetchone()[0]
+    result = u.archive_bookings(args.horizon)
+    u.get_conn().execute("PRAGMA optimize")
+    after = measure(users, args.reps, history=True)
+    hot_after = u.get_conn().execute("SELECT COUNT(*) FROM bookings").fetchone()[0]
+
+    print(f"archivage : {result['moved']} réservations en {result['batches']} lots, {result['seconds']} s ; "
+          f"base chaude {hot_before} → {hot_after} lignes ({_size(u.DB_PATH):.0f} Mo, "
+          f"archive {_size(u.archive_path()):.0f} Mo)")
+    print(f"{'':32s} {'avant':>9s} {'après':>9s}")
+    for name, ms in after.items():
+        print(f"{name:32s} {before.get(name, float('nan')):7.2f} ms {ms:7.2f} ms")
+    drift = u.check_stats()
+    print("agrégats : " + ("cohérents" if not drift else f"écarts {drift}"))
+    return 1 if drift else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
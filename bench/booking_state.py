@@ -0,0 +1,130 @@
+"""Mises à jour concurrentes des réservations : aucune écriture perdue, aucune transition interdite.
+
+    python -m bench.booking_state --threads 8 --bookings 20 --seconds 5
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, time as dtime
+
+import booking_state as bs
+import utils as u
+
+
+def setup(n_bookings, technicians=2):
+    u.init_db()
+    u.create_user("Bench", "stress@bench.local", "0555", "motdepasse")
+    u.upsert_vehicle(1, "Bench", "Stress", "0000", 0)
+    for t in range(technicians):
+        u.create_technician(f"Technicien {t + 1}", None)
+    day = date.today()
+    return [u.create_booking(1, 1, [1], 1000, "atelier", None, None, None,
+                             datetime.combine(day, dtime(8 + i % 9, 0)), technician_id=1 + i % technicians)
+            for i in range(n_bookings)]
+
+
+def _reopen(bid, version):
+    # Hors cycle de vie normal : remet en jeu une réservation terminée (même CAS que booking_state)
+    with u.transaction() as conn:
+        row = conn.execute(f"""UPDATE bookings SET status=?, version=version+1
+                               WHERE id=? AND version=? AND status IN ({",".join("?" * len(bs.TERMINAL))})
+                               RETURNING version""", (bs.PLANNED, bid, version, *bs.TERMINAL)).fetchone()
+    if row is None:
+        raise bs.StaleBooking(bid, version, None)
+    return row[0]
+
+
+def stress(ids, n_threads, seconds, batch_every=50):
+    """Chaque thread lit une réservation puis tente une transition conditionnée par la version lue."""
+    stop = time.perf_counter() + seconds
+    lock = threading.Lock()
+    outcomes = Counter()
+    versions = defaultdict(list)        # booking_id -> versions produites par les écritures unitaires
+    batched = Counter()                 # booking_id -> passages dans une transition groupée
+
+    def worker(k):
+        rng = random.Random(k)
+        local_out, local_versions, local_batched = Counter(), [], Counter()
+        i = 0
+        while time.perf_counter() < stop:
+            i += 1
+            if i % batch_every == 0:
+                target = rng.choice([bs.IN_PROGRESS, bs.DONE])
+                for b in bs.batch_transition(target, technician_id=rng.choice([1, 2]), day=date.today()):
+                    local_batched[b] += 1
+                local_out["groupées"] += 1
+                continue
+            bid = rng.choice(ids)
+            cur = bs.get(bid)
+            choices = bs.allowed(cur["status"])
+            try:
+                if not choices:
+                    version = _reopen(bid, cur["version"])
+                elif rng.random() < 0.5:
+                    version = bs.assign(bid, rng.choice([1, 2, None]), expected_version=cur["version"])
+                else:
+                    version = bs.transition(bid, rng.choice(choices), expected_version=cur["version"])
+            except bs.StaleBooking:
+                local_out["périmées"] += 1
+            except bs.InvalidTransition:
+                local_out["interdites"] += 1
+            else:
+                local_out["réussies"] += 1
+                local_versions.append((bid, version))
+        with lock:
+            outcomes.update(local_out)
+            batched.update(local_batched)
+            for bid, v in local_versions:
+                versions[bid].append(v)
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(n_threads)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return outcomes, versions, batched, time.perf_counter() - t0
+
+
+def check(ids, versions, batched):
+    """Anomalies : versions produites deux fois, écritures perdues, agrégats divergents."""
+    problems = []
+    conn = u.get_conn()
+    for bid in ids:
+        seen = versions.get(bid, [])
+        if len(seen) != len(set(seen)):
+            problems.append(f"#{bid} : deux écritures ont produit la même version")
+        final = conn.execute("SELECT version FROM bookings WHERE id=?", (bid,)).fetchone()[0]
+        if final != len(seen) + batched.get(bid, 0):
+            problems.append(f"#{bid} : version {final} pour {len(seen) + batched.get(bid, 0)} écritures réussies")
+    if u.check_stats():
+        problems.append(f"agrégats divergents : {u.check_stats()}")
+    return problems
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--threads", type=int, default=8)
+    p.add_argument("--bookings", type=int, default=20, help="peu de réservations = beaucoup de conflits")
+    p.add_argument("--seconds", type=float, default=5.0)
+    args = p.parse_args(argv)
+
+    u.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_booking_state.db")
+    ids = setup(args.bookings)
+    outcomes, versions, batched, elapsed = stress(ids, args.threads, args.seconds)
+    total = sum(outcomes.values())
+    print(f"{args.threads} thread(s), {args.bookings} réservation(s) : {total / elapsed:.0f} opérations/s")
+    print(", ".join(f"{k} {v}" for k, v in sorted(outcomes.items())))
+    problems = check(ids, versions, batched)
+    for line in problems:
+        print("ÉCHEC :", line)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Parcours client (connexion, véhicule, devis, réservation) : démarrage, temps par exécution, mémoire.
+
+    python -m bench.client --reruns 20
+
+Le parcours tourne dans un processus neuf (AppTest, même moteur que le serveur
+Streamlit) ; on y relève ensuite si pandas ou NumPy ont été importés.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Page de navigation -> nom de son rendu (instrumentation.timed_render)
+PAGES = {"Accueil / Connexion": "Connexion", "Mon véhicule": "Mon véhicule", "Réserver": "Réserver",
+         "Mes rendez-vous": "Mes rendez-vous"}
+
+
+def session_memory(user, sessions=5) -> float:
+    """Mémoire retenue par session connectée après Mon véhicule puis Réserver (moyenne, octets)."""
+    import gc
+    import tracemalloc
+    from streamlit.testing.v1 import AppTest
+
+    kept = []
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for _ in range(sessions):
+        at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+        at.session_state["user"] = user
+        at.run()
+        for page in ("Mon véhicule", "Réserver"):
+            next(s for s in at.sidebar.selectbox if s.label == "Navigation").set_value(page).run()
+        kept.append(at)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return used / sessions
+
+
+def child(db, email, password, reruns):
+    """Exécuté dans le processus neuf : rien d'autre que Streamlit et l'application n'y est chargé."""
+    import resource
+    from streamlit.testing.v1 import AppTest
+
+    import instrumentation as inst
+    import utils as u
+
+    u.DB_PATH = db
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    t0 = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - t0
+    next(t for t in at.text_input if t.label == "Email").input(email)
+    next(t for t in at.text_input if t.label == "Mot de passe").input(password)
+    next(b for b in at.button if b.label == "Se connecter").click().run()
+
+    timings = {}
+    for page, render in PAGES.items():
+        next(s for s in at.sidebar.selectbox if s.label == "Navigation").set_value(page).run()
+        if page == "Réserver":
+            services = at.multiselect[0]
+            services.select(services.options[0]).run()
+        runs = []
+        inst.reset()
+        for _ in range(reruns):
+            t0 = time.perf_counter()
+            at.run()
+            runs.append((time.perf_counter() - t0) * 1e3)
+        page_ms = next(r["moyenne_ms"] for r in inst.slowest_renders(100) if r["nom"] == render)
+        timings[page] = (statistics.median(runs), page_ms)
+        if page == "Réserver":
+            next(b for b in at.button if b.label == "Confirmer la réservation").click().run()
+            booked = any("Réservation confirmée" in s.value for s in at.success)
+    errors = [e.message for e in at.exception]
+    session = session_memory(at.session_state["user"])
+    return {"premier_rendu_ms": first * 1e3, "pages_ms": timings, "reservation": booked, "erreurs": errors,
+            "session_octets": session,
+            "rss_mo": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "pandas": "pandas" in sys.modules, "numpy": "numpy" in sys.modules}
+
+
+def import_time(runs=5):
+    code = ("import sys, time; t = time.perf_counter(); import app; "
+            "print(time.perf_counter() - t, 'pandas' in sys.modules, 'numpy' in sys.modules)")
+    out = []
+    for _ in range(runs):
+        r = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+        seconds, pandas, numpy = r.stdout.split()
+        out.append(float(seconds))
+    return statistics.median(out) * 1e3, pandas == "True", numpy == "True"
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--reruns", type=int, default=10, help="exécutions mesurées par page")
+    p.add_argument("--child", nargs=3, metavar=("DB", "EMAIL", "PASSWORD"), help=argparse.SUPPRESS)
+    args = p.parse_args(argv)
+    if args.child:
+        print(json.dumps(child(*args.child, args.reruns)))
+        return 0
+
+    import utils as u
+    from bench.seed import BENCH_PASSWORD, seed
+
+    u.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_client.db")
+    u.init_db()
+    seed(users=2_000, bookings=20_000, log=lambda m: None)
+    email = u.get_conn().execute("SELECT email FROM users u JOIN vehicles v ON v.user_id = u.id "
+                                 "WHERE email LIKE '%@bench.local' ORDER BY u.id LIMIT 1").fetchone()[0]
+
+    ms, pandas, numpy = import_time()
+    print(f"import app : {ms:.0f} ms (pandas chargé : {'oui' if pandas else 'non'}, "
+          f"NumPy : {'oui' if numpy else 'non'})")
+    # Journal des notifications à côté de la base temporaire (u.data_dir() du processus enfant)
+    r = subprocess.run([sys.executable, "-m", "bench.client", "--reruns", str(args.reruns),
+                        "--child", u.DB_PATH, email, BENCH_PASSWORD],
+                       cwd=ROOT, capture_output=True, text=True, check=True)
+    res = json.loads(r.stdout.strip().splitlines()[-1])
+    print(f"premier rendu : {res['premier_rendu_ms']:.0f} ms ; réservation confirmée : "
+          f"{'oui' if res['reservation'] else 'non'} ; erreurs : {res['erreurs'] or 'aucune'}")
+    print(f"  {'page':22s} {'exécution':>10s} {'dont rendu':>11s}   (ms, médiane / moyenne sur {args.reruns})")
+    for page, (run, render) in res["pages_ms"].items():
+        print(f"  {page:22s} {run:10.1f} {render:11.2f}")
+    print(f"mémoire par session : {res['session_octets'] / 1024:.0f} Kio ; RSS max du processus : {res['rss_mo']:.0f} Mo")
+    print(f"après le parcours client : pandas {'importé' if res['pandas'] else 'jamais importé'}, "
+          f"NumPy {'importé' if res['numpy'] else 'jamais importé'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""Latences p50/p95/p99 des chemins chauds de utils.py, en parallèle.
+
+    python -m bench.hot_paths --db vidange_bench.db --threads 1 8 --out run.json --compare base.json
+"""
+import argparse
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import app
+import passwords as pw
+import scheduling as sch
+import utils as u
+from bench.seed import BENCH_PASSWORD
+
+
+class Sampler:
+    """Tire des clients, véhicules et services existants pour paramétrer les appels."""
+
+    def __init__(self, seed=0):
+        conn = u.get_conn()
+        self.max_user = conn.execute("SELECT MAX(id) FROM users").fetchone()[0]
+        self.service_ids = [s.id for s in u.service_rows()]
+        self._local = threading.local()
+        self._seed = seed
+
+    @property
+    def rng(self):
+        rng = getattr(self._local, "rng", None)
+        if rng is None:
+            rng = self._local.rng = random.Random(self._seed + threading.get_ident())
+        return rng
+
+    def user(self):
+        return self.rng.randint(1, self.max_user)
+
+    def vehicle(self):
+        while True:
+            uid = self.user()
+            row = u.get_conn().execute("SELECT id FROM vehicles WHERE user_id=? LIMIT 1", (uid,)).fetchone()
+            if row:
+                return uid, row[0]
+
+    def services(self):
+        return self.rng.sample(self.service_ids, self.rng.randint(1, min(3, len(self.service_ids))))
+
+
+def operations(s: Sampler):
+    """Nom → (appel, itérations par thread relatives : 1.0 = --iterations)."""
+    def create_booking():
+        uid, vid = s.vehicle()
+        ids = s.services()
+        total = u.calc_quote(ids, "atelier")[0]
+        when = datetime.now().replace(second=0, microsecond=0) + timedelta(days=s.rng.randint(1, 60))
+        u.create_booking(uid, vid, ids, total, "atelier", None, None, None, when)
+
+    def admin_bookings():
+        df, _ = u.list_bookings_page(page_size=app.ADMIN_PAGE_SIZE)
+        app.admin_bookings_table(df)
+
+    return {
+        "authenticate": (lambda: u.authenticate(f"user{s.user()}@bench.local", BENCH_PASSWORD), 0.2),
+        "user_vehicles": (lambda: u.user_vehicles(s.user()), 1.0),
+        "calc_quote": (lambda: u.calc_quote(s.services(), s.rng.choice(["atelier", "domicile"])), 1.0),
+        "available_slots": (lambda: sch.available_slots(datetime.now().date() + timedelta(days=s.rng.randint(1, 30)),
+                                                        s.services()), 1.0),
+        "create_booking": (create_booking, 0.5),
+        "user_bookings": (lambda: u.user_bookings(s.user()), 1.0),
+        "list_bookings()": (lambda: u.list_bookings(), 0.02),
+        "ui_admin_bookings (page)": (admin_bookings, 0.5),
+        "ui_admin_stats": (app.load_admin_stats, 0.2),
+    }
+
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+def measure(fn, n_threads, iterations):
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def worker():
+        local = []
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:  # noqa: BLE001 - on compte l'échec, la mesure continue
+                with lock:
+                    errors.append(repr(e))
+                continue
+            local.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(n_threads)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    lat = sorted(latencies)
+    if not lat:
+        return {"n": 0, "errors": len(errors), "first_error": errors[0] if errors else None}
+    return {
+        "n": len(lat),
+        "errors": len(errors),
+        "p50_ms": round(_percentile(lat, 0.50) * 1e3, 3),
+        "p95_ms": round(_percentile(lat, 0.95) * 1e3, 3),
+        "p99_ms": round(_percentile(lat, 0.99) * 1e3, 3),
+        "mean_ms": round(statistics.fmean(lat) * 1e3, 3),
+        "max_ms": round(lat[-1] * 1e3, 3),
+        "ops_per_s": round(len(lat) / wall, 1),
+    }
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def _volumes():
+    conn = u.get_conn()
+    return {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+            for t in ("users", "vehicles", "services", "technicians", "bookings")}
+
+def compare(current, baseline):
+    base = {(r["threads"], r["op"]): r for r in baseline["runs"]}
+    print(f"\nComparaison avec {baseline['meta'].get('git_rev')} ({baseline['meta'].get('started_at')}) :")
+    for r in current["runs"]:
+        b = base.get((r["threads"], r["op"]))
+        if not b or not b.get("n") or not r.get("n"):
+            continue
+        print(f"  [{r['threads']:>2}] {r['op']:<26} p50 {b['p50_ms']:>9.2f} → {r['p50_ms']:>9.2f} ms "
+              f"({r['p50_ms'] / b['p50_ms']:.2f}x)   p95 {b['p95_ms']:>9.2f} → {r['p95_ms']:>9.2f} ms")
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--db", default="vidange_bench.db")
+    p.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    p.add_argument("--iterations", type=int, default=200, help="appels par thread et par opération (pondérés)")
+    p.add_argument("--only", nargs="*", help="sous-ensemble d'opérations")
+    p.add_argument("--out", help="fichier JSON de résultats")
+    p.add_argument("--compare", help="JSON d'une exécution précédente")
+    args = p.parse_args(argv)
+
+    u.DB_PATH = args.db
+    u.init_db()
+    # Régression de plan (index perdu, requête réécrite) : mesures sans objet
+    issues = u.audit_query_plans()
+    if issues:
+        for name, steps in issues.items():
+            print(f"plan dégradé : {name} : {' ; '.join(steps)}")
+        return 1
+    pw.email_limiter = pw.TokenBucketLimiter(10 ** 9, 10 ** 9)
+    s = Sampler()
+    ops = operations(s)
+    if args.only:
+        ops = {k: v for k, v in ops.items() if k in args.only}
+
+    result = {"meta": {"started_at": datetime.now().isoformat(timespec="seconds"), "git_rev": _git_rev(),
+                       "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                       "volumes": _volumes(), "iterations": args.iterations},
+              "runs": []}
+    for n in args.threads:
+        for name, (fn, weight) in ops.items():
+            fn()  # échauffement (caches, plans)
+            r = measure(fn, n, max(1, int(args.iterations * weight)))
+            r.update(threads=n, op=name)
+            result["runs"].append(r)
+            if r["n"]:
+                print(f"[{n:>2}] {name:<26} p50 {r['p50_ms']:>9.2f}  p95 {r['p95_ms']:>9.2f}  "
+                      f"p99 {r['p99_ms']:>9.2f} ms  {r['ops_per_s']:>8.1f}/s  erreurs {r['errors']}")
+            else:
+                print(f"[{n:>2}] {name:<26} échec : {r['first_error']}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""Import en masse de réservations historiques : débit en lignes par seconde.
+
+    python -m bench.importer --db vidange_import.db --rows 200000 --min-rate 50000
+"""
+import argparse
+import io
+import sys
+
+import numpy as np
+import pandas as pd
+
+import bulk_import
+import utils as u
+from bench.seed import seed
+
+
+def history_csv(n, seed_=0) -> str:
+    """CSV de réservations passées sur les clients et véhicules existants."""
+    rng = np.random.default_rng(seed_)
+    conn = u.get_conn()
+    vehicles = pd.read_sql_query("SELECT u.email, v.plate FROM vehicles v JOIN users u ON u.id = v.user_id", conn)
+    services = u.get_services(active_only=False)
+    techs = [r[0] for r in conn.execute("SELECT name FROM technicians")]
+    pick = rng.integers(0, len(vehicles), n)
+    minutes = rng.integers(0, 3 * 365 * 24 * 60, n)
+    df = pd.DataFrame({
+        "email": vehicles["email"].to_numpy()[pick],
+        "plate": vehicles["plate"].to_numpy()[pick],
+        "scheduled_at": (pd.Timestamp("2022-01-01 08:00") + pd.to_timedelta(minutes, unit="min")).strftime("%Y-%m-%d %H:%M"),
+        # Moitié par ID, moitié par nom : les deux chemins de résolution sont mesurés
+        "services": np.where(rng.random(n) < 0.5,
+                             services["id"].astype(str).to_numpy()[rng.integers(0, len(services), n)],
+                             services["name"].to_numpy()[rng.integers(0, len(services), n)] + "|"
+                             + services["id"].astype(str).to_numpy()[rng.integers(0, len(services), n)]),
+        "booking_type": np.where(rng.random(n) < 0.2, "domicile", "atelier"),
+        "technician": np.array(techs + [""])[rng.integers(0, len(techs) + 1, n)],
+        "rating": np.where(rng.random(n) < 0.4, rng.integers(1, 6, n).astype(str), ""),
+    })
+    return df.to_csv(index=False)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--db", default="vidange_import.db")
+    p.add_argument("--users", type=int, default=5_000)
+    p.add_argument("--rows", type=int, default=200_000)
+    p.add_argument("--min-rate", type=float, default=50_000, help="débit minimal (lignes/s)")
+    args = p.parse_args(argv)
+
+    u.DB_PATH = args.db
+    u.init_db()
+    missing = args.users - u.get_conn().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    if missing > 0:
+        seed(users=missing, bookings=0, log=lambda *a: None)
+
+    csv = history_csv(args.rows)
+    df = bulk_import.read_table(io.StringIO(csv))
+    report = bulk_import.import_bookings(df, offline=True)
+    print(report.summary())
+    rate = report.inserted / report.seconds
+    if report.rejected or u.check_stats():
+        print("ÉCHEC : lignes rejetées ou agrégats incohérents")
+        return 1
+    if rate < args.min_rate:
+        print(f"ÉCHEC : {rate:,.0f} lignes/s < {args.min_rate:,.0f}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Calcul nocturne des échéances d'entretien sur une flotte synthétique.
+
+    python -m bench.maintenance --vehicles 1000000 --readings 3 --bookings 1000000 --max-seconds 60
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+import maintenance
+import utils as u
+from bench.seed import seed
+
+
+def add_readings(per_vehicle, days=720, seed_=0):
+    """Relevés irréguliers sur `days` jours, rythme propre à chaque véhicule (10 à 120 km/jour)."""
+    rng = np.random.default_rng(seed_)
+    conn = u.get_conn()
+    ids = np.array([r[0] for r in conn.execute("SELECT id FROM vehicles ORDER BY id")])
+    counts = rng.integers(1, 2 * per_vehicle, len(ids))
+    vid = np.repeat(ids, counts)
+    rate = np.repeat(rng.uniform(10, 120, len(ids)), counts)
+    start_km = np.repeat(rng.integers(1_000, 200_000, len(ids)), counts)
+    age = rng.integers(0, days, len(vid))
+    km = (start_km + rate * (days - age) * rng.normal(1, 0.03, len(vid))).astype(int)
+    now = datetime.utcnow().replace(microsecond=0)
+    when = np.datetime_as_string(np.datetime64(now, "s") - age.astype("timedelta64[D]"), unit="s").tolist()
+    with u.bulk_load(), u.transaction() as conn:
+        conn.executemany("INSERT INTO mileage_readings(vehicle_id, mileage, read_at, source) VALUES(?,?,?,'vehicule')",
+                         zip(vid.tolist(), km.tolist(), when))
+    return len(vid)
+
+
+def disagreements(conn, sample=5_000) -> list:
+    """Lignes où compute() (NumPy) et compute_rows() (pages client) divergent, sur les premiers véhicules."""
+    ids = [r[0] for r in conn.execute("SELECT DISTINCT vehicle_id FROM mileage_readings ORDER BY vehicle_id LIMIT ?",
+                                      (sample,))]
+    now = datetime.utcnow()
+    due = maintenance.compute(conn, now, ids).sort_values(["vehicle_id", "category"])
+    fast = [maintenance.Due(*r) for r in zip(*(due[c].tolist() for c in maintenance.Due._fields))]
+    # Pas de service connu : NaN côté pandas, None côté Python
+    fast = [d._replace(last_service_at=None) if d.last_service_at != d.last_service_at else d for d in fast]
+    rows = maintenance.compute_rows(conn, ids, now)
+    if len(fast) != len(rows):
+        return [("lignes", len(fast), len(rows))]
+    return [(a, b) for a, b in zip(fast, rows) if a != b]
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--db", help="base existante à réutiliser (sinon base temporaire)")
+    p.add_argument("--vehicles", type=int, default=100_000)
+    p.add_argument("--readings", type=int, default=3, help="relevés moyens par véhicule")
+    p.add_argument("--bookings", type=int, default=100_000)
+    p.add_argument("--max-seconds", type=float, default=60.0)
+    args = p.parse_args(argv)
+
+    u.DB_PATH = args.db or os.path.join(tempfile.mkdtemp(), "bench_maintenance.db")
+    u.init_db()
+    if not u.get_conn().execute("SELECT COUNT(*) FROM mileage_readings").fetchone()[0]:
+        t0 = time.perf_counter()
+        seed(users=int(args.vehicles / 1.3), vehicles_per_user=1.3, bookings=args.bookings, years=2, log=lambda m: None)
+        print(f"flotte : {u.get_conn().execute('SELECT COUNT(*) FROM vehicles').fetchone()[0]} véhicules, "
+              f"{args.bookings} réservations, {add_readings(args.readings)} relevés "
+              f"({time.perf_counter() - t0:.0f} s)")
+
+    t0 = time.perf_counter()
+    conn = u.get_conn()
+    due = maintenance.compute(conn)
+    t_compute = time.perf_counter() - t0
+    result = maintenance.run_nightly()
+    total = time.perf_counter() - t0 - t_compute
+    print(f"calcul seul : {t_compute:.1f} s ; calcul + écriture : {total:.1f} s "
+          f"({result['echeances']} échéances, {result['vehicules']} véhicules, "
+          f"médiane {result['km_par_jour_median']} km/jour)")
+
+    diff = disagreements(conn)
+    print(f"compute() / compute_rows() : {'identiques' if not diff else f'{len(diff)} divergence(s), ex. {diff[0]}'}")
+
+    one = int(due["vehicle_id"].iloc[len(due) // 2])
+    t0 = time.perf_counter()
+    for _ in range(1000):
+        maintenance.vehicle_due([one])
+    print(f"lecture d'un véhicule : {(time.perf_counter() - t0):.2f} ms en moyenne")
+    return 0 if total <= args.max_seconds and not diff else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
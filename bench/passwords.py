@@ -0,0 +1,77 @@
+"""Connexions par seconde au coût KDF courant.
+
+    python -m bench.passwords --threads 1 4 8 16 --seconds 3
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import passwords as pw
+import utils as u
+
+
+def run_logins(n_threads, seconds, users):
+    """Appelle authenticate() en boucle depuis n_threads threads ; renvoie (débit, latences)."""
+    stop = time.perf_counter() + seconds
+    latencies, busy = [], [0]
+    lock = threading.Lock()
+
+    def worker(k):
+        local, i = [], 0
+        while time.perf_counter() < stop:
+            email = users[(k + i * n_threads) % len(users)]
+            t0 = time.perf_counter()
+            try:
+                assert u.authenticate(email, "motdepasse")
+            except pw.PasswordBusy:
+                with lock:
+                    busy[0] += 1
+                time.sleep(0.01)
+                continue
+            local.append(time.perf_counter() - t0)
+            i += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(n_threads)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return len(latencies) / (time.perf_counter() - t0), sorted(latencies), busy[0]
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--threads", type=int, nargs="+", default=[1, 4, 8, 16])
+    p.add_argument("--seconds", type=float, default=3.0)
+    p.add_argument("--users", type=int, default=50)
+    args = p.parse_args(argv)
+
+    u.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_passwords.db")
+    u.init_db()
+    # Pas de limitation pendant la mesure
+    pw.email_limiter = pw.TokenBucketLimiter(10 ** 9, 10 ** 9)
+    users = [f"user{i}@bench.local" for i in range(args.users)]
+    for email in users:
+        u.create_user("Bench", email, None, "motdepasse")
+
+    t0 = time.perf_counter()
+    pw.hash_password("motdepasse")
+    print(f"scrypt N={pw.SCRYPT_N} r={pw.SCRYPT_R} p={pw.SCRYPT_P} : "
+          f"{(time.perf_counter() - t0) * 1e3:.1f} ms par hachage, {pw.KDF_WORKERS} workers")
+    for n in args.threads:
+        rate, lat, busy = run_logins(n, args.seconds, users)
+        p95 = lat[int(0.95 * (len(lat) - 1))] if lat else float("nan")
+        print(f"{n:3d} thread(s) : {rate:7.1f} connexions/s, "
+              f"p50 {statistics.median(lat) * 1e3:.1f} ms, p95 {p95 * 1e3:.1f} ms, refus (file pleine) {busy}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""Planification de tournées : temps de calcul pour N arrêts à domicile.
+
+    python -m bench.routing --stops 500 --technicians 1 --budget 1.0
+"""
+import argparse
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import routing
+
+
+def random_stops(n, seed=0, center=routing.DEFAULT_DEPOT):
+    rng = np.random.default_rng(seed)
+    hours = rng.integers(8, 17, n)
+    minutes = rng.choice([0, 15, 30, 45], n)
+    return pd.DataFrame({
+        "booking_id": np.arange(1, n + 1),
+        "latitude": center[0] + rng.normal(0, 0.05, n),
+        "longitude": center[1] + rng.normal(0, 0.07, n),
+        "scheduled_at": [f"2026-03-02T{h:02d}:{m:02d}:00" for h, m in zip(hours, minutes)],
+        "duration_min": rng.choice([20, 45, 60, 80], n),
+        "technician_id": pd.array([pd.NA] * n, dtype="Int64"),
+    })
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--stops", type=int, default=500)
+    p.add_argument("--technicians", type=int, default=1)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--budget", type=float, default=1.0, help="temps max (s) par planification")
+    args = p.parse_args(argv)
+
+    stops = random_stops(args.stops)
+    techs = list(range(1, args.technicians + 1))
+    routing.plan_routes(stops.head(10), techs)  # échauffement
+
+    times, plan = [], None
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        plan = routing.plan_routes(stops, techs)
+        times.append(time.perf_counter() - t0)
+
+    worst = max(times)
+    print(f"{args.stops} arrêts, {args.technicians} technicien(s) : "
+          f"médiane {statistics.median(times) * 1e3:.1f} ms, max {worst * 1e3:.1f} ms")
+    print(f"distance totale {plan['leg_km'].sum():.1f} km, retard cumulé {int(plan['late_min'].sum())} min")
+    if worst > args.budget:
+        print(f"ÉCHEC : au-delà du budget de {args.budget:.2f} s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""Latence de la recherche admin (index FTS5) sur une base volumineuse.
+
+    python -m bench.search --users 300000 --bookings 1000000 --max-ms 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import utils as u
+from bench.seed import seed
+
+
+def queries(n, users, rng):
+    """Saisies réalistes : début de nom, email, immatriculation, adresse, mots combinés."""
+    ids = rng.integers(1, users, n)
+    kinds = [lambda i: f"Client {i}", lambda i: f"user{i}@", lambda i: f"{i:06d}"[:4],
+             lambda i: f"{i:06d}-116", lambda i: "adresse", lambda i: f"cli {str(i)[:2]}", lambda i: "marque mod"]
+    return [kinds[k % len(kinds)](int(i)) for k, i in enumerate(ids)]
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--db", help="base existante à réutiliser (sinon base temporaire)")
+    p.add_argument("--users", type=int, default=30_000)
+    p.add_argument("--bookings", type=int, default=100_000)
+    p.add_argument("--queries", type=int, default=2_000)
+    p.add_argument("--max-ms", type=float, default=20.0, help="seuil au 95e centile")
+    args = p.parse_args(argv)
+
+    u.DB_PATH = args.db or os.path.join(tempfile.mkdtemp(), "bench_search.db")
+    u.init_db()
+    conn = u.get_conn()
+    if conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] < args.users:
+        t0 = time.perf_counter()
+        seed(users=args.users, bookings=args.bookings, log=lambda m: None)
+        print(f"base remplie en {time.perf_counter() - t0:.0f} s")
+    rows = conn.execute("SELECT COUNT(*) FROM search_index").fetchone()[0]
+    users = conn.execute("SELECT MAX(id) FROM users").fetchone()[0]
+
+    rng = np.random.default_rng(0)
+    latencies, found = [], 0
+    for q in queries(args.queries, users, rng):
+        t0 = time.perf_counter()
+        found += len(u.search(q))
+        latencies.append((time.perf_counter() - t0) * 1e3)
+    latencies.sort()
+    p95 = latencies[int(0.95 * (len(latencies) - 1))]
+    print(f"{rows} entrées indexées, {len(latencies)} recherches, {found / len(latencies):.1f} résultats en moyenne")
+    print(f"p50 {statistics.median(latencies):.2f} ms, p95 {p95:.2f} ms, max {latencies[-1]:.2f} ms")
+    return 0 if p95 <= args.max_ms else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
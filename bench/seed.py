@@ -0,0 +1,139 @@
+"""Remplit une base avec un volume de production synthétique.
+
+    python -m bench.seed --db vidange_bench.db --users 100000 --bookings 2000000
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import bulk_import
+import passwords as pw
+import utils as u
+
+BENCH_PASSWORD = "motdepasse"
+STATUSES = np.array(["planifié", "en_cours", "terminé", "annulé"])
+
+
+def _batches(n, size):
+    for start in range(0, n, size):
+        yield start, min(n, start + size)
+
+
+def seed(users=10_000, vehicles_per_user=1.3, services=20, technicians=15, bookings=200_000,
+         years=3, batch=50_000, seed=0, log=print):
+    """Ajoute les volumes demandés à la base courante (garage courant, u.DB_PATH sinon) ; renvoie les compteurs insérés."""
+    rng = np.random.default_rng(seed)
+    u.init_db()
+    now = datetime.utcnow().replace(microsecond=0)
+    # Un seul hachage pour tous les comptes : scrypt n'est pas le sujet ici
+    pw_hash = pw.hash_password(BENCH_PASSWORD)
+
+    t0 = time.perf_counter()
+    with u.bulk_load(), u.transaction() as conn:
+        n_services = conn.execute("SELECT COUNT(*) FROM services").fetchone()[0]
+        extra = max(0, services - n_services)
+        conn.executemany(
+            "INSERT INTO services(name, base_price_da, duration_min, category, active) VALUES(?,?,?,?,1)",
+            [(f"Service {i}", int(p), int(d), "Bench")
+             for i, p, d in zip(range(extra), rng.integers(10, 200, extra) * 100, rng.choice([15, 20, 30, 45, 60], extra))])
+        u._bump_cache_version(conn)
+        conn.executemany("INSERT INTO technicians(name, phone, active) VALUES(?,?,1)",
+                         [(f"Technicien {i}", None) for i in range(technicians)])
+
+        first_user = (conn.execute("SELECT MAX(id) FROM users").fetchone()[0] or 0) + 1
+        for a, b in _batches(users, batch):
+            conn.executemany(
+                "INSERT INTO users(id, name, email, phone, password_hash, created_at) VALUES(?,?,?,?,?,?)",
+                ((first_user + i, f"Client {first_user + i}", f"user{first_user + i}@bench.local", None,
+                  pw_hash, now.isoformat()) for i in range(a, b)))
+        log(f"utilisateurs : {users} en {time.perf_counter() - t0:.1f} s")
+
+        # Véhicules : 1 ou plus par client, IDs contigus par client
+        counts = np.maximum(1, rng.poisson(vehicles_per_user - 1, users) + 1)
+        owners = np.repeat(np.arange(first_user, first_user + users), counts)
+        first_vehicle = (conn.execute("SELECT MAX(id) FROM vehicles").fetchone()[0] or 0) + 1
+        for a, b in _batches(len(owners), batch):
+            conn.executemany(
+                "INSERT INTO vehicles(id, user_id, make, model, plate, mileage) VALUES(?,?,?,?,?,?)",
+                ((first_vehicle + i, int(owners[i]), "Marque", "Modèle", f"{first_vehicle + i:06d}-116-16",
+                  int(rng.integers(1_000, 250_000))) for i in range(a, b)))
+        vehicle_start = first_vehicle + np.concatenate([[0], np.cumsum(counts)[:-1]])
+        log(f"véhicules : {len(owners)} en {time.perf_counter() - t0:.1f} s")
+
+        cat = conn.execute("SELECT id, base_price_da, COALESCE(duration_min, 45) FROM services WHERE active=1").fetchall()
+        svc_ids = np.array([c[0] for c in cat])
+        svc_price = {c[0]: c[1] for c in cat}
+        svc_dur = {c[0]: c[2] for c in cat}
+        tech_ids = np.array([r[0] for r in conn.execute("SELECT id FROM technicians WHERE active=1")])
+        surcharge = int(u.get_config("domicile_surcharge_da", "3000"))
+
+        first_booking = bulk_import._next_id(conn, "bookings")      # IDs déjà archivés exclus
+        horizon = years * 365 * 24 * 60
+        for a, b in _batches(bookings, batch):
+            n = b - a
+            user_idx = rng.integers(0, users, n)
+            vehicle = vehicle_start[user_idx] + (rng.integers(0, 1 << 30, n) % counts[user_idx])
+            offset = rng.integers(-horizon + 60 * 24 * 30, 60 * 24 * 30, n) // 15 * 15
+            domicile = rng.random(n) < 0.3
+            past = offset < 0
+            status = np.where(past, rng.choice(STATUSES[2:], n, p=[0.88, 0.12]),
+                              rng.choice(STATUSES[:2], n, p=[0.95, 0.05]))
+            tech = np.where(rng.random(n) < 0.9, rng.choice(tech_ids, n), 0) if len(tech_ids) else np.zeros(n, int)
+            rating = np.where((status == "terminé") & (rng.random(n) < 0.4), rng.integers(3, 6, n), 0)
+            k = np.minimum(rng.integers(1, 4, n), len(svc_ids))
+            # 1 à 3 services distincts par réservation
+            picks = svc_ids[np.argsort(rng.random((n, len(svc_ids))), axis=1)[:, :3]].tolist()
+            lat = 36.75 + rng.normal(0, 0.05, n)
+            lon = 3.06 + rng.normal(0, 0.07, n)
+            lead = rng.integers(0, 30, n)
+            rows, links = [], []
+            for i in range(n):
+                bid = first_booking + a + i
+                sids = picks[i][:k[i]]
+                when = now + timedelta(minutes=int(offset[i]))
+                home = bool(domicile[i])
+                rows.append((bid, int(first_user + user_idx[i]), int(vehicle[i]), json.dumps(sids),
+                             sum(svc_price[s] for s in sids) + (surcharge if home else 0),
+                             "domicile" if home else "atelier",
+                             "Adresse bench" if home else None,
+                             float(lat[i]) if home else None, float(lon[i]) if home else None,
+                             when.isoformat(), str(status[i]), int(tech[i]) or None,
+                             int(rating[i]) or None, (when - timedelta(days=int(lead[i]))).isoformat()))
+                links.extend((bid, s, svc_price[s], svc_dur[s]) for s in sids)
+            conn.executemany("""INSERT INTO bookings(id, user_id, vehicle_id, service_ids, total_price_da, booking_type,
+                                    address, latitude, longitude, scheduled_at, status, technician_id, rating, created_at)
+                                VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", rows)
+            conn.executemany("""INSERT INTO booking_services(booking_id, service_id, price_at_booking_da, duration_min)
+                                VALUES(?,?,?,?)""", links)
+            log(f"réservations : {b}/{bookings} en {time.perf_counter() - t0:.1f} s")
+    conn.execute("ANALYZE")
+    log(f"terminé en {time.perf_counter() - t0:.1f} s (agrégats recalculés)")
+    return {"users": users, "vehicles": int(len(owners)), "services": extra,
+            "technicians": technicians, "bookings": bookings}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--db", default="vidange_bench.db")
+    p.add_argument("--users", type=int, default=10_000)
+    p.add_argument("--vehicles-per-user", type=float, default=1.3)
+    p.add_argument("--services", type=int, default=20)
+    p.add_argument("--technicians", type=int, default=15)
+    p.add_argument("--bookings", type=int, default=200_000)
+    p.add_argument("--years", type=int, default=3)
+    p.add_argument("--batch", type=int, default=50_000)
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args(argv)
+
+    u.DB_PATH = args.db
+    seed(args.users, args.vehicles_per_user, args.services, args.technicians, args.bookings,
+         args.years, args.batch, args.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
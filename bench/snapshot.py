@@ -0,0 +1,103 @@
+"""Réservations pendant de longs exports : lecture sur la base vive ou sur la copie d'analyse.
+
+    python -m bench.snapshot --users 20000 --bookings 500000 --seconds 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import export
+import snapshots
+import utils as u
+from bench.seed import seed
+
+
+def _wal_mb(path):
+    return os.path.getsize(path + "-wal") / 1e6 if os.path.exists(path + "-wal") else 0.0
+
+
+def scenario(seconds, offset):
+    """Un thread exporte tout en boucle, un autre réserve toutes les 5 ms."""
+    stop = time.perf_counter() + seconds
+    latencies, exports = [], []
+
+    def scan():
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            with open(os.devnull, "w") as f:
+                export.export_csv(f)
+            exports.append(time.perf_counter() - t0)
+
+    def book():
+        uid, vid = u.get_conn().execute("SELECT user_id, id FROM vehicles ORDER BY id LIMIT 1").fetchone()
+        when = datetime(2035, 1, 1, 8) + timedelta(days=offset)
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            u.create_booking(uid, vid, [1], 12000, "atelier", None, None, None, when + timedelta(minutes=len(latencies)))
+            latencies.append((time.perf_counter() - t0) * 1e3)
+            time.sleep(0.005)
+
+    threads = [threading.Thread(target=scan), threading.Thread(target=book)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    return {"réservations": len(latencies), "p50": statistics.median(latencies),
+            "p95": latencies[int(0.95 * (len(latencies) - 1))], "max": latencies[-1],
+            "exports": len(exports), "wal": _wal_mb(u.DB_PATH)}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--db", help="base existante à réutiliser (sinon base temporaire)")
+    p.add_argument("--users", type=int, default=10_000)
+    p.add_argument("--bookings", type=int, default=200_000)
+    p.add_argument("--seconds", type=float, default=10.0)
+    args = p.parse_args(argv)
+
+    u.DB_PATH = args.db or os.path.join(tempfile.mkdtemp(), "bench_snapshot.db")
+    u.init_db()
+    if not args.db:
+        seed(users=args.users, bookings=args.bookings, log=lambda m: None)
+
+    # Coût d'une copie pendant que des réservations arrivent
+    stop = threading.Event()
+    def trickle():
+        uid, vid = u.get_conn().execute("SELECT user_id, id FROM vehicles ORDER BY id LIMIT 1").fetchone()
+        n = 0
+        while not stop.is_set():
+            u.create_booking(uid, vid, [1], 12000, "atelier", None, None, None,
+                             datetime(2034, 1, 1, 8) + timedelta(minutes=n))
+            n += 1
+            time.sleep(0.01)
+    writer = threading.Thread(target=trickle)
+    writer.start()
+    info = snapshots.refresh()
+    stop.set()
+    writer.join()
+    print(f"copie : {info['pages']} pages en {info['seconds']:.2f} s, {info['restarts']} reprise(s) "
+          f"sous écritures ({os.path.getsize(snapshots.list_snapshots()[-1][1]) / 1e6:.0f} Mo)")
+
+    u.get_conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    u.set_config("snapshot_max_age_s", "0")
+    live = scenario(args.seconds, 0)
+    u.get_conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    u.set_config("snapshot_max_age_s", str(int(args.seconds * 10)))
+    snapshots.refresh()
+    snap = scenario(args.seconds, 1)
+
+    print(f"{'exports lus sur':18s} {'réserv.':>8s} {'p50 ms':>8s} {'p95 ms':>8s} {'max ms':>8s} {'exports':>8s} {'WAL Mo':>8s}")
+    for label, r in (("base vive", live), ("copie d'analyse", snap)):
+        print(f"{label:18s} {r['réservations']:8d} {r['p50']:8.2f} {r['p95']:8.2f} {r['max']:8.1f} "
+              f"{r['exports']:8d} {r['wal']:8.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
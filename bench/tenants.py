@@ -0,0 +1,103 @@
+"""Réservations pendant une longue écriture d'un autre garage : base partagée ou base par garage.
+
+    python -m bench.tenants --garages 4 --seconds 10
+
+Un garage recalcule ses agrégats en boucle (transaction longue, comme un import
+ou un archivage) pendant que les autres prennent des réservations.
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import tenants
+import utils as u
+from bench.seed import seed
+
+
+def writer(garage, stop, latencies, failures, k):
+    """Réservations une par une, comme des clients qui confirment en même temps."""
+    with u.use_garage(garage):
+        conn = u.get_conn()
+        uid, vid = conn.execute("SELECT user_id, id FROM vehicles ORDER BY id LIMIT 1 OFFSET ?", (k,)).fetchone()
+        when = datetime(2030, 1, 1, 8) + timedelta(days=k)
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            try:
+                u.create_booking(uid, vid, [1, 2], 16000, "atelier", None, None, None,
+                                 when + timedelta(minutes=len(latencies) + len(failures)))
+            except sqlite3.OperationalError:      # verrou non obtenu dans busy_timeout
+                failures.append(time.perf_counter() - t0)
+                continue
+            latencies.append(time.perf_counter() - t0)
+            time.sleep(0.01)
+
+
+def blocker(garage, stop):
+    with u.use_garage(garage):
+        while time.perf_counter() < stop:
+            u.rebuild_stats()
+
+
+def contended(busy, targets, seconds):
+    latencies, failures = [], []
+    stop = time.perf_counter() + seconds
+    threads = [threading.Thread(target=blocker, args=(busy, stop))]
+    threads += [threading.Thread(target=writer, args=(g, stop, latencies, failures, k)) for k, g in enumerate(targets)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    done, failed = len(latencies), len(failures)
+    latencies = sorted(latencies + failures) or [0.0]
+    return done, failed, [x * 1e3 for x in (
+        statistics.median(latencies), latencies[int(0.95 * (len(latencies) - 1))], latencies[-1])]
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--garages", type=int, default=8)
+    p.add_argument("--users", type=int, default=2_000, help="clients par garage")
+    p.add_argument("--bookings", type=int, default=50_000, help="historique par garage")
+    p.add_argument("--seconds", type=float, default=5.0)
+    args = p.parse_args(argv)
+
+    u.DB_PATH = os.path.join(tempfile.mkdtemp(), "bench_tenants.db")
+    u.ensure_db()
+    t0 = time.perf_counter()
+    seed(users=args.users, bookings=args.bookings, log=lambda m: None)
+    garages = [None]
+    for k in range(1, args.garages):
+        garage = tenants.create_garage(f"g{k}", f"Garage {k}")
+        with u.use_garage(garage):
+            seed(users=args.users, bookings=args.bookings, log=lambda m: None)
+        garages.append(garage)
+    garages[0] = tenants.get_garage(tenants.MAIN_SLUG)
+    print(f"{args.garages} garages × {args.bookings} réservations en {time.perf_counter() - t0:.0f} s")
+
+    writers = args.garages - 1
+    for label, targets in (("base partagée", garages[:1] * writers), ("base par garage", garages[1:])):
+        done, failed, (p50, p95, worst) = contended(garages[0], targets, args.seconds)
+        print(f"{label:16s} {writers} écrivain(s) : {done:5d} réservations, {failed} refusée(s) (base verrouillée), "
+              f"p50 {p50:6.1f} ms, p95 {p95:7.1f} ms, max {worst:7.1f} ms")
+
+    t0 = time.perf_counter()
+    for garage in garages:
+        with u.use_garage(garage):
+            u.monthly_stats()
+    sequential = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    report = tenants.network_stats(garages)
+    parallel = time.perf_counter() - t0
+    print(f"rapport réseau : {sequential * 1e3:.0f} ms base par base, {parallel * 1e3:.0f} ms en parallèle "
+          f"({int(report['garages']['prestations'].sum())} prestations)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""Cycle de vie d'une réservation : transitions autorisées et mises à jour conditionnelles.
+
+planifié → en_cours → terminé, et planifié / en_cours → annulé. Chaque
+écriture est un UPDATE unique conditionné par le statut courant (et par la
+version lue par l'appelant s'il la fournit), dans une transaction BEGIN
+IMMEDIATE : aucun verrou applicatif, et une écriture concurrente se traduit
+par StaleBooking plutôt que par un écrasement silencieux.
+"""
+from datetime import timedelta
+
+import utils as u
+
+PLANNED, IN_PROGRESS, DONE, CANCELLED = "planifié", "en_cours", "terminé", "annulé"
+STATUSES = (PLANNED, IN_PROGRESS, DONE, CANCELLED)
+TRANSITIONS = {
+    PLANNED: (IN_PROGRESS, CANCELLED),
+    IN_PROGRESS: (DONE, CANCELLED),
+    DONE: (),
+    CANCELLED: (),
+}
+TERMINAL = tuple(s for s, nxt in TRANSITIONS.items() if not nxt)
+
+
+class TransitionError(Exception):
+    pass
+
+
+class BookingNotFound(TransitionError):
+    def __init__(self, booking_id):
+        super().__init__(f"réservation #{booking_id} introuvable")
+        self.booking_id = booking_id
+
+
+class InvalidTransition(TransitionError):
+    def __init__(self, booking_id, current, target):
+        super().__init__(f"réservation #{booking_id} : {current} → {target} interdit")
+        self.booking_id, self.current, self.target = booking_id, current, target
+
+
+class StaleBooking(TransitionError):
+    """La réservation a été modifiée depuis que l'appelant l'a lue."""
+
+    def __init__(self, booking_id, expected, current):
+        super().__init__(f"réservation #{booking_id} modifiée entre-temps (version {expected} → {current})")
+        self.booking_id, self.expected, self.current = booking_id, expected, current
+
+
+def allowed(current) -> tuple:
+    return TRANSITIONS.get(current, ())
+
+def sources(target) -> tuple:
+    return tuple(s for s, nxt in TRANSITIONS.items() if target in nxt)
+
+def _event(status) -> str:
+    return "annulation" if status == CANCELLED else "statut"
+
+def _marks(values) -> str:
+    return ",".join("?" * len(values))
+
+
+def get(booking_id):
+    row = u.get_conn().execute("SELECT status, version, technician_id, user_id FROM bookings WHERE id=?",
+                               (int(booking_id),)).fetchone()
+    if row is None:
+        return None
+    return {"status": row[0], "version": row[1], "technician_id": row[2], "user_id": row[3]}
+
+def _fail(conn, booking_id, target, expected_version, user_id):
+    # Lu dans la même transaction que l'UPDATE refusé : le diagnostic est exact
+    row = conn.execute("SELECT status, version, user_id FROM bookings WHERE id=?", (booking_id,)).fetchone()
+    if row is None or (user_id is not None and row[2] != user_id):
+        raise BookingNotFound(booking_id)
+    if expected_version is not None and row[1] != expected_version:
+        raise StaleBooking(booking_id, expected_version, row[1])
+    raise InvalidTransition(booking_id, row[0], target)
+
+def _cas(booking_id, sets, params, statuses, target, expected_version, user_id, event=None):
+    booking_id = int(booking_id)
+    where, wparams = ["id=?", f"status IN ({_marks(statuses)})"], [booking_id, *statuses]
+    if expected_version is not None:
+        where.append("version=?")
+        wparams.append(int(expected_version))
+    if user_id is not None:
+        where.append("user_id=?")
+        wparams.append(user_id)
+    with u.transaction() as conn:
+        row = conn.execute(f"UPDATE bookings SET {', '.join(sets)}, version=version+1 "
+                           f"WHERE {' AND '.join(where)} RETURNING version", (*params, *wparams)).fetchone()
+        if row is None:
+            _fail(conn, booking_id, target, expected_version, user_id)
+        if event:
+            u.enqueue_notification(conn, event, booking_id)
+        return row[0]
+
+
+_KEEP = object()
+
+def transition(booking_id, target, expected_version=None, technician_id=_KEEP, user_id=None) -> int:
+    """Change le statut (et éventuellement le technicien) ; renvoie la nouvelle version.
+
+    ``expected_version`` : version lue par l'appelant ; ``user_id`` : limite la
+    modification au client propriétaire.
+    """
+    if not sources(target):
+        raise ValueError(f"statut cible inconnu ou initial : {target}")
+    sets, params = ["status=?"], [target]
+    if technician_id is not _KEEP:
+        sets.append("technician_id=?")
+        params.append(technician_id)
+    return _cas(booking_id, sets, params, sources(target), target, expected_version, user_id, _event(target))
+
+def assign(booking_id, technician_id, expected_version=None) -> int:
+    """Change le technicien sans changer le statut (réservation non terminée)."""
+    active = tuple(s for s in STATUSES if s not in TERMINAL)
+    return _cas(booking_id, ["technician_id=?"], [technician_id], active, "réaffectation", expected_version, None)
+
+def rate(booking_id, user_id, rating) -> int:
+    """Note du client, seulement une fois la prestation terminée."""
+    if not 1 <= int(rating) <= 5:
+        raise ValueError("note hors 1-5")
+    return _cas(booking_id, ["rating=?"], [int(rating)], (DONE,), "note", None, user_id)
+
+def batch_transition(target, technician_id=None, day=None, booking_ids=None) -> list:
+    """Transition groupée en un seul UPDATE (ex. démarrer les rendez-vous du jour d'un technicien).
+
+    Seules les réservations dont le statut permet la transition sont touchées ;
+    renvoie leurs IDs.
+    """
+    if technician_id is None and day is None and not booking_ids:
+        raise ValueError("au moins un filtre (technicien, jour ou IDs) est requis")
+    src = sources(target)
+    if not src:
+        raise ValueError(f"statut cible inconnu ou initial : {target}")
+    where, params = [f"status IN ({_marks(src)})"], list(src)
+    if technician_id is not None:
+        where.append("technician_id=?")
+        params.append(int(technician_id))
+    if day is not None:
+        where.append("scheduled_at >= ? AND scheduled_at < ?")
+        params += [day.isoformat(), (day + timedelta(days=1)).isoformat()]
+    if booking_ids:
+        ids = [int(b) for b in booking_ids]
+        where.append(f"id IN ({_marks(ids)})")
+        params += ids
+    with u.transaction() as conn:
+        ids = [r[0] for r in conn.execute(
+            f"UPDATE bookings SET status=?, version=version+1 WHERE {' AND '.join(where)} RETURNING id",
+            (target, *params)).fetchall()]
+        u.enqueue_notifications(conn, _event(target), ids)
+    return sorted(ids)
@@ -0,0 +1,334 @@
+import re
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import utils as u
+
+# Réservations insérées par transaction
+IMPORT_BATCH_ROWS = 50_000
+# Séparateur des services dans une cellule CSV (IDs ou noms) ; en JSON, une liste convient aussi
+SERVICE_SEPARATOR = "|"
+# Compte créé par import : aucune connexion possible tant qu'un mot de passe n'est pas défini
+DISABLED_PASSWORD = "!"
+
+STATUSES = ("planifié", "en_cours", "terminé", "annulé")
+BOOKING_TYPES = ("atelier", "domicile")
+
+
+class ImportReport:
+    """Bilan d'un import : compteurs et erreurs par enregistrement (numérotés à partir de 1)."""
+
+    def __init__(self, kind, total):
+        self.kind = kind
+        self.total = total
+        self.inserted = 0
+        self.updated = 0
+        self.created_users = 0
+        self.created_vehicles = 0
+        self.seconds = 0.0
+        self._errors = []
+
+    def flag(self, mask, column, message):
+        rows = np.flatnonzero(np.asarray(mask, dtype=bool))
+        self._errors.extend((int(r) + 1, column, message) for r in rows)
+        return rows
+
+    @property
+    def errors(self) -> pd.DataFrame:
+        return pd.DataFrame(self._errors, columns=["enregistrement", "colonne", "erreur"]).sort_values(
+            "enregistrement", kind="stable")
+
+    @property
+    def rejected(self) -> int:
+        return len({r for r, _, _ in self._errors})
+
+    def summary(self) -> str:
+        rate = f", {self.inserted / self.seconds:,.0f}/s" if self.seconds and self.inserted else ""
+        extra = ""
+        if self.created_users or self.created_vehicles:
+            extra = f", {self.created_users} client(s) et {self.created_vehicles} véhicule(s) créés"
+        return (f"{self.kind} : {self.inserted} ajouté(s), {self.updated} mis à jour, "
+                f"{self.rejected} rejeté(s) sur {self.total}{extra} en {self.seconds:.2f} s{rate}")
+
+
+# ---------------- Lecture & normalisation ----------------
+def read_table(source, fmt=None) -> pd.DataFrame:
+    """CSV ou JSON (liste d'objets) depuis un chemin ou un fichier ouvert (ex. st.file_uploader)."""
+    name = str(getattr(source, "name", source)).lower()
+    fmt = fmt or ("json" if name.endswith(".json") else "csv")
+    if fmt == "json":
+        df = pd.read_json(source, orient="records", dtype=False)
+    else:
+        df = pd.read_csv(source, dtype=str, skipinitialspace=True)
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    return df.reset_index(drop=True)
+
+def _text(df, col, default=None) -> pd.Series:
+    if col not in df:
+        return pd.Series(default, index=df.index, dtype="string")
+    s = df[col].astype("string").str.strip().replace("", pd.NA)
+    return s.fillna(default) if default is not None else s
+
+def _number(df, col, default=np.nan) -> pd.Series:
+    if col not in df:
+        return pd.Series(default, index=df.index, dtype="float64")
+    s = pd.to_numeric(df[col], errors="coerce")
+    return s.fillna(default) if not pd.isna(default) else s
+
+def _resolve(tokens: pd.Series, ids, names: dict) -> pd.Series:
+    """ID numérique connu, sinon nom (insensible à la casse) ; NA si introuvable."""
+    num = pd.to_numeric(tokens, errors="coerce")
+    by_id = num.where(num.isin(list(ids)))
+    by_name = tokens.str.lower().map(names)
+    return by_id.fillna(by_name).astype("Int64")
+
+def _plate_key(plate: str) -> str:
+    # "12345-116-16", "12345 116 16" et "12345116 16" désignent le même véhicule
+    return re.sub(r"[\W_]+", "", str(plate)).upper()
+
+def _none(values) -> list:
+    # Série pandas → liste Python avec None pour les valeurs manquantes (sqlite3)
+    s = pd.Series(values).astype(object)
+    return s.where(s.notna(), None).tolist()
+
+
+# ---------------- Services & techniciens ----------------
+def import_services(df: pd.DataFrame) -> ImportReport:
+    t0 = time.perf_counter()
+    report = ImportReport("services", len(df))
+    name = _text(df, "name")
+    price = _number(df, "base_price_da")
+    duration = _number(df, "duration_min", 45)
+    category = _text(df, "category", "Entretien")
+    active = _number(df, "active", 1)
+
+    bad = pd.Series(False, index=df.index)
+    bad.iloc[report.flag(name.isna(), "name", "nom manquant")] = True
+    bad.iloc[report.flag(price.isna() | (price < 0), "base_price_da", "tarif invalide")] = True
+    bad.iloc[report.flag(duration.isna() | (duration <= 0), "duration_min", "durée invalide")] = True
+    key = name.str.lower()
+    dup = key.duplicated(keep="last") & ~bad
+    bad.iloc[report.flag(dup, "name", "doublon dans le fichier (dernière ligne retenue)")] = True
+
+    ok = ~bad
+    existing = {n.lower(): i for i, n in u.get_conn().execute("SELECT id, name FROM services")}
+    rows = list(zip(name[ok].tolist(), price[ok].astype(int).tolist(), duration[ok].astype(int).tolist(),
+                    category[ok].tolist(), (active[ok] != 0).astype(int).tolist(), key[ok].map(existing).tolist()))
+    with u.catalog_transaction() as conn:
+        conn.executemany("UPDATE services SET name=?, base_price_da=?, duration_min=?, category=?, active=? WHERE id=?",
+                         [r[:5] + (int(r[5]),) for r in rows if pd.notna(r[5])])
+        conn.executemany("INSERT INTO services(name, base_price_da, duration_min, category, active) VALUES(?,?,?,?,?)",
+                         [r[:5] for r in rows if pd.isna(r[5])])
+    report.updated = sum(1 for r in rows if pd.notna(r[5]))
+    report.inserted = len(rows) - report.updated
+    report.seconds = time.perf_counter() - t0
+    return report
+
+def import_technicians(df: pd.DataFrame) -> ImportReport:
+    t0 = time.perf_counter()
+    report = ImportReport("techniciens", len(df))
+    name = _text(df, "name")
+    phone = _text(df, "phone")
+    active = _number(df, "active", 1)
+
+    bad = pd.Series(False, index=df.index)
+    bad.iloc[report.flag(name.isna(), "name", "nom manquant")] = True
+    key = name.str.lower()
+    bad.iloc[report.flag(key.duplicated(keep="last") & ~bad, "name", "doublon dans le fichier (dernière ligne retenue)")] = True
+
+    ok = ~bad
+    existing = {n.lower(): i for i, n in u.get_conn().execute("SELECT id, name FROM technicians")}
+    ids = key[ok].map(existing)
+    rows = list(zip(name[ok].tolist(), _none(phone[ok]), (active[ok] != 0).astype(int).tolist(), ids.tolist()))
+    with u.catalog_transaction() as conn:
+        conn.executemany("UPDATE technicians SET name=?, phone=?, active=? WHERE id=?",
+                         [r[:3] + (int(r[3]),) for r in rows if pd.notna(r[3])])
+        conn.executemany("INSERT INTO technicians(name, phone, active) VALUES(?,?,?)",
+                         [r[:3] for r in rows if pd.isna(r[3])])
+    report.updated = int(ids.notna().sum())
+    report.inserted = len(rows) - report.updated
+    report.seconds = time.perf_counter() - t0
+    return report
+
+
+# ---------------- Réservations historiques ----------------
+def _next_id(conn, table) -> int:
+    # sqlite_sequence garde le plus grand ID jamais attribué, y compris ceux partis en archive
+    return conn.execute(f"""SELECT MAX(COALESCE((SELECT MAX(id) FROM main.{table}), 0),
+                                     COALESCE((SELECT seq FROM main.sqlite_sequence WHERE name=?), 0)) + 1""",
+                        (table,)).fetchone()[0]
+
+def import_bookings(df: pd.DataFrame, create_missing=False, batch=IMPORT_BATCH_ROWS, offline=False) -> ImportReport:
+    """Importe des réservations ; clients et véhicules sont retrouvés par email et immatriculation.
+
+    Colonnes obligatoires : email, plate, scheduled_at, services. Facultatives :
+    booking_type, status, technician, total_price_da, address, latitude,
+    longitude, payment_mode, rating, notes, created_at ; avec ``create_missing``,
+    name, phone, make, model et mileage servent à créer clients et véhicules absents.
+    Un kilométrage renseigné est aussi versé à l'historique des relevés.
+    ``offline`` (reprise hors service) autorise la reconstruction différée des index.
+    """
+    t0 = time.perf_counter()
+    df = df.reset_index(drop=True)
+    report = ImportReport("réservations", len(df))
+    bad = pd.Series(False, index=df.index)
+
+    email = _text(df, "email").str.lower()
+    plate_raw = _text(df, "plate")
+    plate = plate_raw.str.replace(r"[\W_]+", "", regex=True).str.upper()
+    bad.iloc[report.flag(email.isna(), "email", "email manquant")] = True
+    bad.iloc[report.flag(plate.fillna("") == "", "plate", "immatriculation manquante")] = True
+
+    scheduled = pd.to_datetime(df.get("scheduled_at"), errors="coerce", format="ISO8601") \
+        if "scheduled_at" in df else pd.Series(pd.NaT, index=df.index)
+    bad.iloc[report.flag(scheduled.isna(), "scheduled_at", "date invalide")] = True
+    created = pd.to_datetime(df["created_at"], errors="coerce", format="ISO8601") if "created_at" in df else scheduled
+    created = created.fillna(scheduled)
+
+    btype = _text(df, "booking_type", "atelier").str.lower()
+    bad.iloc[report.flag(~btype.isin(BOOKING_TYPES), "booking_type", "type inconnu")] = True
+    now = pd.Timestamp(datetime.now())
+    status = _text(df, "status").str.lower()
+    status = status.fillna(pd.Series(np.where(scheduled < now, "terminé", "planifié"), index=df.index, dtype="string"))
+    bad.iloc[report.flag(~status.isin(STATUSES), "status", "statut inconnu")] = True
+    payment = _text(df, "payment_mode", "sur_place").str.lower()
+    bad.iloc[report.flag(~payment.isin(u.PAYMENT_MODES), "payment_mode", "mode de paiement inconnu")] = True
+    rating = _number(df, "rating")
+    bad.iloc[report.flag(rating.notna() & ~rating.between(1, 5), "rating", "note hors 1-5")] = True
+    lat, lon = _number(df, "latitude"), _number(df, "longitude")
+
+    # Services : une ligne par (enregistrement, service), résolus en bloc
+    cat = u.get_services(active_only=False)
+    raw = df["services"] if "services" in df else pd.Series(pd.NA, index=df.index)
+    if raw.map(lambda v: isinstance(v, list)).any():
+        tokens = raw.map(lambda v: v if isinstance(v, list) else str(v).split(SERVICE_SEPARATOR) if pd.notna(v) else [])
+    else:
+        tokens = raw.astype("string").str.split(SERVICE_SEPARATOR)
+    ex = tokens.explode().astype("string").str.strip().replace("", pd.NA).dropna()
+    sid = _resolve(ex, cat["id"], dict(zip(cat["name"].str.lower(), cat["id"])))
+    unknown = sid.isna().groupby(level=0).any().reindex(df.index, fill_value=False)
+    bad.iloc[report.flag(unknown, "services", "service inconnu")] = True
+    pairs = pd.DataFrame({"row": sid.index, "service_id": sid.to_numpy()}).dropna().drop_duplicates()
+    empty = ~df.index.isin(pairs["row"])
+    bad.iloc[report.flag(empty & ~unknown.to_numpy(), "services", "aucun service")] = True
+    price_of = dict(zip(cat["id"], cat["base_price_da"]))
+    duration_of = dict(zip(cat["id"], cat["duration_min"].fillna(45).astype(int)))
+    pairs["price"] = pairs["service_id"].map(price_of).astype(int)
+    pairs["duration"] = pairs["service_id"].map(duration_of).astype(int)
+
+    surcharge = int(u.get_config("domicile_surcharge_da", "3000"))
+    computed = pairs.groupby("row")["price"].sum().reindex(df.index, fill_value=0) + np.where(btype == "domicile", surcharge, 0)
+    total = _number(df, "total_price_da").fillna(computed)
+    bad.iloc[report.flag(total < 0, "total_price_da", "montant invalide")] = True
+
+    conn = u.get_conn()
+    techs = u.get_technicians()
+    tech_raw = _text(df, "technician")
+    tech = _resolve(tech_raw, techs["id"], dict(zip(techs["name"].str.lower(), techs["id"])))
+    bad.iloc[report.flag(tech_raw.notna() & tech.isna(), "technician", "technicien inconnu")] = True
+
+    # Clients (annuaire) et véhicules (garage) : dictionnaires en mémoire plutôt qu'une requête par ligne
+    users = dict((e.lower(), i) for i, e in u.directory_conn().execute("SELECT id, email FROM users"))
+    user_id = email.map(users).astype("Int64")
+    vehicles = {}
+    for i, uid, p in conn.execute("SELECT id, user_id, plate FROM vehicles ORDER BY id DESC"):
+        vehicles[(uid, _plate_key(p))] = i
+    if not create_missing:
+        bad.iloc[report.flag(user_id.isna() & email.notna(), "email", "client inconnu")] = True
+
+    ok = ~bad
+    if create_missing:
+        new_emails = email[ok & user_id.isna()].drop_duplicates()
+        if len(new_emails):
+            first = new_emails.index
+            names = _text(df, "name").reindex(first).fillna(new_emails)
+            with u.directory_transaction() as conn:
+                start = _next_id(conn, "users")
+                ids = range(start, start + len(new_emails))
+                conn.executemany(
+                    "INSERT INTO users(id, name, email, phone, password_hash, created_at) VALUES(?,?,?,?,?,?)",
+                    zip(ids, names.tolist(), new_emails.tolist(), _none(_text(df, "phone").reindex(first)),
+                        [DISABLED_PASSWORD] * len(new_emails), [datetime.utcnow().isoformat()] * len(new_emails)))
+            users.update(zip(new_emails.tolist(), ids))
+            user_id = email.map(users).astype("Int64")
+            report.created_users = len(new_emails)
+    with u.transaction() as conn:
+        u.ensure_members(conn, user_id[ok].dropna().unique().tolist())
+
+    vkey = pd.Series(list(zip(user_id.fillna(-1).astype(int).tolist(), plate.fillna("").tolist())), index=df.index)
+    vehicle_id = vkey.map(vehicles).astype("Int64")
+    missing_v = ok & vehicle_id.isna()
+    if create_missing and missing_v.any():
+        first = vkey[missing_v].drop_duplicates().index
+        with u.transaction() as conn:
+            start = _next_id(conn, "vehicles")
+            ids = range(start, start + len(first))
+            conn.executemany(
+                "INSERT INTO vehicles(id, user_id, make, model, plate, mileage) VALUES(?,?,?,?,?,?)",
+                zip(ids, user_id[first].astype(int).tolist(), _text(df, "make", "—")[first].tolist(),
+                    _text(df, "model", "—")[first].tolist(), plate_raw[first].tolist(),
+                    _none(_number(df, "mileage")[first].astype("Int64"))))
+        vehicles.update(zip(vkey[first].tolist(), ids))
+        vehicle_id = vkey.map(vehicles).astype("Int64")
+        report.created_vehicles = len(first)
+    unknown_v = report.flag(ok & vehicle_id.isna(), "plate", "véhicule inconnu pour ce client")
+    ok &= ~df.index.isin(unknown_v)
+
+    # Lignes prêtes à insérer, dans l'ordre du fichier ; services triés par enregistrement
+    rows = df.index[ok]
+    position = pd.Series(np.arange(len(rows)), index=rows)
+    pairs = pairs[pairs["row"].isin(rows)]
+    pairs = pairs.assign(pos=pairs["row"].map(position)).sort_values("pos", kind="stable")
+    pos = pairs["pos"].to_numpy()
+    sids = pairs["service_id"].astype(int).tolist()
+    bounds = np.searchsorted(pos, np.arange(len(rows) + 1)).tolist()
+    service_ids = ["[" + ", ".join(map(str, sids[a:b])) + "]" for a, b in zip(bounds[:-1], bounds[1:])]
+    iso = lambda s: np.datetime_as_string(s[rows].to_numpy(dtype="datetime64[s]"), unit="s").tolist()
+    records = list(zip(
+        user_id[rows].astype(int).tolist(), vehicle_id[rows].astype(int).tolist(), service_ids,
+        total[rows].astype(int).tolist(), btype[rows].tolist(), _none(_text(df, "address")[rows]),
+        _none(lat[rows]), _none(lon[rows]), iso(scheduled), status[rows].tolist(), _none(tech[rows]),
+        payment[rows].tolist(), _none(rating[rows].astype("Int64")),
+        _none(_text(df, "notes")[rows]), iso(created),
+    ))
+    links = list(zip(pos.tolist(), sids, pairs["price"].tolist(), pairs["duration"].tolist()))
+    km = _none(_number(df, "mileage")[rows].round().astype("Int64"))
+
+    # Reprise hors service d'un historique plus gros que la base : index reconstruits en fin de chargement
+    existing = u.get_conn().execute("SELECT COUNT(*) FROM bookings").fetchone()[0]
+    defer = ("bookings", "booking_services") if offline and len(records) > existing else ()
+    with u.bulk_load(defer_indexes=defer):
+        for start in range(0, len(records), batch):
+            chunk = records[start:start + batch]
+            with u.transaction() as conn:
+                first_id = _next_id(conn, "bookings")
+                conn.executemany("""INSERT INTO bookings(id, user_id, vehicle_id, service_ids, total_price_da, booking_type,
+                                        address, latitude, longitude, scheduled_at, status, technician_id,
+                                        payment_mode, rating, notes, created_at)
+                                    VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+                                 ((first_id + i,) + r for i, r in enumerate(chunk)))
+                offset = first_id - start
+                conn.executemany("""INSERT INTO booking_services(booking_id, service_id, price_at_booking_da, duration_min)
+                                    VALUES(?,?,?,?)""",
+                                 ((offset + p, s, price, d)
+                                  for p, s, price, d in links[bounds[start]:bounds[min(start + batch, len(records))]]))
+                conn.executemany("""INSERT INTO mileage_readings(vehicle_id, mileage, read_at, source, booking_id)
+                                    VALUES(?,?,?,'import',?)""",
+                                 ((r[1], k, r[8], first_id + i)
+                                  for i, (r, k) in enumerate(zip(chunk, km[start:start + batch])) if k))
+            report.inserted += len(chunk)
+
+    report.seconds = time.perf_counter() - t0
+    return report
+
+
+def import_file(kind, source, fmt=None, create_missing=False, offline=False) -> ImportReport:
+    df = read_table(source, fmt)
+    if kind == "services":
+        return import_services(df)
+    if kind == "technicians":
+        return import_technicians(df)
+    return import_bookings(df, create_missing=create_missing, offline=offline)
@@ -0,0 +1,261 @@
+"""Commandes d'administration hors interface.
+
+    python cli.py stats-check
+    python cli.py stats-rebuild
+    python cli.py query-plans            # requêtes chaudes sans parcours complet ni tri temporaire
+    python cli.py export --year 2026 --month 3 --format parquet --out mars.parquet
+    python cli.py import bookings historique.csv --create-missing --errors rejets.csv
+    python cli.py outbox --drain
+    python cli.py maintenance            # chaque nuit (cron)
+    python cli.py api --port 8600
+    python cli.py archive --horizon 365    # chaque nuit (cron)
+    python cli.py garage-add oran "LuxeVidange Oran"
+    python cli.py --garage all maintenance # une commande pour chaque garage du réseau
+    python cli.py report
+    python cli.py --garage all snapshot  # copie d'analyse + sauvegarde (cron)
+"""
+import argparse
+import sys
+import time
+
+import bulk_import
+import export
+import maintenance
+import notifications
+import snapshots
+import tenants
+import utils as u
+
+
+# ---------------- Statistiques ----------------
+def cmd_stats_check(args):
+    diff = u.check_stats()
+    if not diff:
+        print("Agrégats cohérents avec les réservations.")
+        return 0
+    for table, n in diff.items():
+        print(f"{table} : {n} ligne(s) divergente(s)")
+    return 1
+
+def cmd_stats_rebuild(args):
+    u.rebuild_stats()
+    print("Agrégats recalculés.")
+    return 0
+
+def cmd_query_plans(args):
+    issues = u.audit_query_plans()
+    if not issues:
+        print(f"{len(u.HOT_QUERIES)} requête(s) chaude(s) servies par index.")
+        return 0
+    for name, steps in issues.items():
+        print(f"{name} : {' ; '.join(steps)}")
+    return 1
+
+
+# ---------------- Exports ----------------
+def cmd_export(args):
+    if args.year:
+        date_from, date_to = export.period(args.year, args.month)
+    else:
+        date_from = date_to = None
+    out = args.out or f"reservations_{args.year or 'tout'}{f'-{args.month:02d}' if args.month else ''}.{args.format}"
+    t0 = time.perf_counter()
+    rows = export.export_bookings(out, args.format, date_from, date_to, args.chunk)
+    print(f"{rows} réservation(s) → {out} en {time.perf_counter() - t0:.1f} s")
+    return 0
+
+
+# ---------------- Imports ----------------
+def cmd_import(args):
+    try:
+        report = bulk_import.import_file(args.kind, args.file, args.format, args.create_missing,
+                                         offline=args.offline)
+    except ValueError as e:
+        print(f"Fichier illisible : {e}")
+        return 2
+    print(report.summary())
+    errors = report.errors
+    if len(errors) and args.errors:
+        errors.to_csv(args.errors, index=False)
+        print(f"{len(errors)} erreur(s) → {args.errors}")
+    elif len(errors):
+        print(errors.head(20).to_string(index=False))
+    return 1 if len(errors) else 0
+
+
+# ---------------- Notifications ----------------
+def cmd_outbox(args):
+    if args.retry_failed:
+        print(f"{notifications.retry_failed()} message(s) remis en file")
+    if args.drain:
+        total = 0
+        while True:
+            sent, failed = notifications.drain_once()
+            total += sent
+            if sent + failed == 0:
+                break
+        print(f"{total} message(s) envoyé(s)")
+    for key, value in notifications.metrics().items():
+        print(f"{key} : {value}")
+    return 0
+
+
+# ---------------- Entretien ----------------
+def cmd_maintenance(args):
+    for key, value in maintenance.run_nightly().items():
+        print(f"{key} : {value}")
+    return 0
+
+
+# ---------------- Archives ----------------
+def cmd_archive(args):
+    result = u.archive_bookings(args.horizon, args.batch, max_rows=args.max_rows)
+    print(f"{result['moved']} réservation(s) antérieure(s) au {result['cutoff'][:10]} archivée(s) "
+          f"en {result['batches']} lot(s), {result['seconds']} s → {u.archive_path()}")
+    return 0
+
+
+# ---------------- Copies & sauvegardes ----------------
+def cmd_snapshot(args):
+    if args.restore:
+        try:
+            snapshots.restore(args.restore, args.out)
+        except ValueError as e:
+            print(e)
+            return 2
+        print(f"{args.restore} → {args.out}")
+        return 0
+    if not args.list:
+        def progress(done, total):
+            print(f"\r{done}/{total} pages", end="", flush=True)
+        info = snapshots.refresh(progress=progress)
+        print(f"\rcopie en {info['seconds']} s, {info['pages']} pages, {info['restarts']} reprise(s)")
+    for taken, path in snapshots.list_snapshots():
+        print(f"{taken:%Y-%m-%d %H:%M:%S} UTC  {path}")
+    return 0
+
+
+# ---------------- Garages ----------------
+def cmd_garages(args):
+    garages = tenants.list_garages(active_only=False)
+    if not garages:
+        print(f"Mono-garage : une seule base ({u.DB_PATH}).")
+    for g in garages:
+        print(f"{g['slug']:16s} {g['name']:30s} {g['db_path']}{'' if g['active'] else ' (inactif)'}")
+    return 0
+
+def cmd_garage_add(args):
+    try:
+        garage = tenants.create_garage(args.slug, args.name, args.db_path)
+    except ValueError as e:
+        print(e)
+        return 2
+    print(f"Garage {garage['slug']} créé → {garage['db_path']}")
+    return 0
+
+def cmd_report(args):
+    t0 = time.perf_counter()
+    report = tenants.network_stats()
+    print(report["garages"].to_string(index=False))
+    print(f"{len(report['garages'])} garage(s) en {time.perf_counter() - t0:.2f} s")
+    return 0
+
+
+# ---------------- API ----------------
+def cmd_api(args):
+    import api
+    api.serve(args.host, args.port)
+    return 0
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Administration LuxeVidange")
+    p.add_argument("--db", default=u.DB_PATH, help="annuaire / base principale (défaut : %(default)s)")
+    p.add_argument("--garage", help="identifiant du garage visé, ou all pour chaque garage du réseau")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    sp = sub.add_parser("stats-check", help="vérifier les agrégats incrémentaux")
+    sp.set_defaults(func=cmd_stats_check)
+    sp = sub.add_parser("stats-rebuild", help="recalculer les agrégats depuis les réservations")
+    sp.set_defaults(func=cmd_stats_rebuild)
+    sp = sub.add_parser("query-plans", help="EXPLAIN QUERY PLAN des requêtes chaudes (échec si index manquant)")
+    sp.set_defaults(func=cmd_query_plans)
+
+    sp = sub.add_parser("export", help="exporter les réservations (CSV ou Parquet) sans tout charger en mémoire")
+    sp.add_argument("--year", type=int)
+    sp.add_argument("--month", type=int, choices=range(1, 13), metavar="1-12")
+    sp.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    sp.add_argument("--chunk", type=int, default=export.EXPORT_CHUNK_ROWS, help="lignes par paquet")
+    sp.add_argument("--out", help="fichier de sortie")
+    sp.set_defaults(func=cmd_export)
+
+    sp = sub.add_parser("import", help="importer services, techniciens ou réservations historiques")
+    sp.add_argument("kind", choices=["services", "technicians", "bookings"])
+    sp.add_argument("file", help="fichier CSV ou JSON")
+    sp.add_argument("--format", choices=["csv", "json"], help="déduit de l'extension par défaut")
+    sp.add_argument("--create-missing", action="store_true", help="créer clients et véhicules inconnus")
+    sp.add_argument("--errors", help="écrire les lignes rejetées dans ce CSV")
+    sp.add_argument("--offline", action="store_true",
+                    help="application arrêtée : index reconstruits en fin de chargement")
+    sp.set_defaults(func=cmd_import)
+
+    sp = sub.add_parser("outbox", help="état de la file de notifications")
+    sp.add_argument("--drain", action="store_true", help="envoyer tout ce qui est dû, puis quitter")
+    sp.add_argument("--retry-failed", action="store_true", help="remettre en file les messages abandonnés")
+    sp.set_defaults(func=cmd_outbox)
+
+    sp = sub.add_parser("maintenance", help="recalculer les prochaines échéances d'entretien (tâche nocturne)")
+    sp.set_defaults(func=cmd_maintenance)
+
+    sp = sub.add_parser("archive", help="déplacer les réservations closes anciennes vers la base d'archive")
+    sp.add_argument("--horizon", type=int, help=f"âge minimal en jours (défaut : config archive_horizon_days "
+                                                 f"ou {u.ARCHIVE_HORIZON_DAYS})")
+    sp.add_argument("--batch", type=int, default=u.ARCHIVE_BATCH, help="réservations par transaction")
+    sp.add_argument("--max-rows", type=int, help="s'arrêter après ce nombre (reprise au prochain lancement)")
+    sp.set_defaults(func=cmd_archive)
+
+    sp = sub.add_parser("snapshot", help="rafraîchir la copie d'analyse (sauvegarde horodatée, avec rétention)")
+    sp.add_argument("--list", action="store_true", help="lister les sauvegardes sans en créer")
+    sp.add_argument("--restore", metavar="FICHIER", help="recopier cette sauvegarde vers --out")
+    sp.add_argument("--out", help="base restaurée (ne doit pas exister)")
+    sp.set_defaults(func=cmd_snapshot)
+
+    sp = sub.add_parser("garages", help="lister les garages du réseau")
+    sp.set_defaults(func=cmd_garages, network=True)
+    sp = sub.add_parser("garage-add", help="enregistrer un garage partenaire et créer sa base")
+    sp.add_argument("slug", help="identifiant court (minuscules, chiffres, tirets)")
+    sp.add_argument("name", help="nom affiché, aussi enseigne du garage")
+    sp.add_argument("--db-path", help=f"fichier SQLite (défaut : {tenants.GARAGES_DIR}/<slug>.db)")
+    sp.set_defaults(func=cmd_garage_add, network=True)
+    sp = sub.add_parser("report", help="activité consolidée de tous les garages")
+    sp.set_defaults(func=cmd_report, network=True)
+
+    sp = sub.add_parser("api", help="servir l'API JSON (application mobile, garages partenaires)")
+    sp.add_argument("--host", default="127.0.0.1")
+    sp.add_argument("--port", type=int, default=8600)
+    sp.set_defaults(func=cmd_api, network=True)     # garage choisi par requête (X-Garage)
+
+    args = p.parse_args(argv)
+    if args.command == "snapshot" and args.restore and not args.out:
+        p.error("--restore demande --out")
+    u.DB_PATH = args.db
+    u.ensure_db()
+    if getattr(args, "network", False):
+        return args.func(args)
+    try:
+        garages = tenants.resolve(args.garage)
+    except ValueError as e:
+        print(e)
+        return 2
+    code = 0
+    for garage in garages:
+        with u.use_garage(garage):
+            if len(garages) > 1:
+                print(f"== {garage['slug']}")
+            u.ensure_db()
+            code = max(code, args.func(args))
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
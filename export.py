@@ -0,0 +1,133 @@
+import csv
+import io
+import os
+import tempfile
+from datetime import date, timedelta
+
+import pandas as pd
+
+import snapshots
+import utils as u
+
+# Lignes lues par paquet : la mémoire reste bornée quel que soit le volume
+EXPORT_CHUNK_ROWS = 20_000
+
+# Colonnes exportées et leur type (fixé pour que tous les paquets Parquet aient le même schéma)
+EXPORT_COLUMNS = {
+    "id": "Int64",
+    "scheduled_at": "string",
+    "created_at": "string",
+    "status": "string",
+    "booking_type": "string",
+    "payment_mode": "string",
+    "total_price_da": "Int64",
+    "rating": "Int64",
+    "address": "string",
+    "latitude": "float64",
+    "longitude": "float64",
+    "notes": "string",
+    "client_id": "Int64",
+    "client": "string",
+    "email": "string",
+    "phone": "string",
+    "vehicle_id": "Int64",
+    "make": "string",
+    "model": "string",
+    "plate": "string",
+    "technician_id": "Int64",
+    "technicien": "string",
+    "services": "string",
+    "duration_min": "Int64",
+}
+
+_EXPORT_QUERY = """
+    SELECT b.id, b.scheduled_at, b.created_at, b.status, b.booking_type, b.payment_mode,
+           b.total_price_da, b.rating, b.address, b.latitude, b.longitude, b.notes,
+           us.id AS client_id, us.name AS client, us.email, us.phone,
+           v.id AS vehicle_id, v.make, v.model, v.plate,
+           b.technician_id, t.name AS technicien,
+           (SELECT GROUP_CONCAT(s.name, ' + ') FROM {schema}.booking_services bs JOIN services s ON s.id = bs.service_id
+            WHERE bs.booking_id = b.id) AS services,
+           (SELECT SUM(bs.duration_min) FROM {schema}.booking_services bs WHERE bs.booking_id = b.id) AS duration_min
+    FROM {schema}.bookings b
+    JOIN users us ON us.id = b.user_id
+    JOIN vehicles v ON v.id = b.vehicle_id
+    LEFT JOIN technicians t ON t.id = b.technician_id
+    WHERE b.scheduled_at >= ? AND b.scheduled_at < ?
+    ORDER BY b.scheduled_at, b.id"""
+
+
+def period(year, month=None):
+    """Bornes [début, fin] d'une année ou d'un mois."""
+    if month is None:
+        return date(year, 1, 1), date(year, 12, 31)
+    end = date(year + (month == 12), month % 12 + 1, 1) - timedelta(days=1)
+    return date(year, month, 1), end
+
+def iter_bookings(date_from=None, date_to=None, chunksize=EXPORT_CHUNK_ROWS):
+    """Réservations jointes (clients, véhicules, services, techniciens), par DataFrames de ``chunksize`` lignes.
+
+    Archives d'abord, puis base chaude : chaque partie est triée par date. Lecture
+    sur la copie d'analyse (snapshots), pas sur la base des réservations.
+    """
+    start = date_from.isoformat() if date_from else ""
+    end = (date_to + timedelta(days=1)).isoformat() if date_to else "9999"
+    # Connexion explicite plutôt qu'analytics() : un générateur suspendu ne doit pas
+    # laisser la base courante du contexte appelant pointée sur la copie
+    with snapshots.lease() as snap:
+        conn = u.get_pool(snap, readonly=True).connection() if snap else u.get_conn()
+        schemas = ["archive", "main"] if u.history_tables(conn)[0] != "bookings" else ["main"]
+        for schema in schemas:
+            for chunk in pd.read_sql_query(_EXPORT_QUERY.format(schema=schema), conn, params=(start, end),
+                                           chunksize=chunksize):
+                yield chunk.astype(EXPORT_COLUMNS)
+
+def export_csv(out, date_from=None, date_to=None, chunksize=EXPORT_CHUNK_ROWS) -> int:
+    """Écrit le CSV paquet par paquet dans ``out`` (chemin ou fichier texte) ; renvoie le nombre de lignes."""
+    if isinstance(out, (str, os.PathLike)):
+        with open(out, "w", encoding="utf-8", newline="") as f:
+            return export_csv(f, date_from, date_to, chunksize)
+    out.write(",".join(EXPORT_COLUMNS) + "\n")
+    rows = 0
+    for chunk in iter_bookings(date_from, date_to, chunksize):
+        chunk.to_csv(out, header=False, index=False, quoting=csv.QUOTE_MINIMAL)
+        rows += len(chunk)
+    return rows
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def export_parquet(path, date_from=None, date_to=None, chunksize=EXPORT_CHUNK_ROWS) -> int:
+    """Écrit un groupe de lignes Parquet par paquet (nécessite pyarrow) ; ``path`` peut être un fichier binaire."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.Schema.from_pandas(pd.DataFrame({c: pd.Series(dtype=t) for c, t in EXPORT_COLUMNS.items()}),
+                                   preserve_index=False)
+    rows = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in iter_bookings(date_from, date_to, chunksize):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            rows += len(chunk)
+    return rows
+
+def export_bookings(path, fmt="csv", date_from=None, date_to=None, chunksize=EXPORT_CHUNK_ROWS) -> int:
+    if fmt == "parquet":
+        return export_parquet(path, date_from, date_to, chunksize)
+    return export_csv(path, date_from, date_to, chunksize)
+
+def export_to_tempfile(fmt="csv", date_from=None, date_to=None):
+    """Export dans un fichier temporaire anonyme (binaire), rembobiné et prêt à être lu."""
+    f = tempfile.TemporaryFile()
+    if fmt == "parquet":
+        export_parquet(f, date_from, date_to)
+    else:
+        text = io.TextIOWrapper(f, encoding="utf-8", newline="", write_through=True)
+        export_csv(text, date_from, date_to)
+        text.detach()
+    f.seek(0)
+    return f
@@ -0,0 +1,251 @@
+"""Mesure des requêtes SQL et des rendus de pages, par exécution et par processus.
+
+Les connexions du pool sont créées avec TimedConnection : chaque requête est
+chronométrée (exécution + lecture des lignes) et agrégée par texte SQL
+normalisé. Les rendus de pages passent par @timed_render. Tout reste en
+mémoire, borné ; seules les requêtes lentes peuvent être écrites dans un
+fichier (VIDANGE_SLOW_QUERY_LOG, seuil VIDANGE_SLOW_QUERY_MS).
+"""
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# Derniers événements conservés (requêtes lentes et rendus)
+RING_SIZE = 2000
+# Nombre maximal de requêtes distinctes suivies (au-delà : regroupées sous "(autres)")
+MAX_QUERIES = 500
+# Requête « lente » : au ring buffer et au fichier de log s'il est configuré
+SLOW_QUERY_MS = float(os.environ.get("VIDANGE_SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.environ.get("VIDANGE_SLOW_QUERY_LOG")
+
+
+class Stat:
+    __slots__ = ("count", "total", "max", "rows")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+    def add(self, seconds, rows=0, count=1, elapsed=None):
+        self.count += count
+        self.total += seconds
+        self.rows += rows
+        elapsed = seconds if elapsed is None else elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+
+class Registry:
+    """Agrégats par requête normalisée et par page ; un par processus, un par exécution."""
+
+    def __init__(self):
+        self.queries = {}
+        self.renders = {}
+        self.started = time.time()
+
+    def _stat(self, table, key):
+        stat = table.get(key)
+        if stat is None:
+            if table is self.queries and len(table) >= MAX_QUERIES:
+                key = "(autres)"
+            stat = table.setdefault(key, Stat())
+        return stat
+
+    def rows(self, kind):
+        table = self.queries if kind == "queries" else self.renders
+        return [{"nom": k, "appels": s.count, "total_ms": round(s.total * 1e3, 2),
+                 "moyenne_ms": round(s.total * 1e3 / s.count, 2) if s.count else 0.0,
+                 "max_ms": round(s.max * 1e3, 2), "lignes": s.rows}
+                for k, s in list(table.items())]
+
+
+_process = Registry()
+_events = deque(maxlen=RING_SIZE)
+_caches = {}    # nom -> [succès, échecs]
+_lock = threading.Lock()
+_local = threading.local()
+
+
+# ---------------- Normalisation ----------------
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+@functools.lru_cache(maxsize=2048)
+def normalize(sql: str) -> str:
+    """Texte SQL sans littéraux ni espaces superflus : une entrée par forme de requête."""
+    sql = " ".join(sql.split())
+    sql = _LITERALS.sub("?", sql)
+    return _IN_LISTS.sub("(?, …)", sql)
+
+
+# ---------------- Enregistrement ----------------
+def _registries():
+    run = getattr(_local, "run", None)
+    return (_process, run) if run is not None else (_process,)
+
+def record_query(sql, seconds, rows=0, count=1, elapsed=None):
+    """``elapsed`` : durée cumulée de l'appel quand ``seconds`` n'en est qu'une partie (lecture des lignes)."""
+    key = normalize(sql)
+    elapsed = seconds if elapsed is None else elapsed
+    with _lock:
+        for reg in _registries():
+            reg._stat(reg.queries, key).add(seconds, rows, count, elapsed)
+    # Journalisée une fois, au moment où l'appel franchit le seuil
+    if elapsed * 1e3 >= SLOW_QUERY_MS > (elapsed - seconds) * 1e3:
+        _slow(key, elapsed, rows)
+
+def record_render(name, seconds):
+    with _lock:
+        for reg in _registries():
+            reg._stat(reg.renders, name).add(seconds)
+        _events.append((time.time(), "rendu", name, seconds * 1e3, None))
+
+def _slow(key, seconds, rows):
+    now = time.time()
+    with _lock:
+        _events.append((now, "requête lente", key, seconds * 1e3, rows))
+    if SLOW_QUERY_LOG:
+        line = f"{datetime.fromtimestamp(now).isoformat(timespec='milliseconds')}\t{seconds * 1e3:.1f} ms\t{rows} ligne(s)\t{key}\n"
+        with _lock, open(SLOW_QUERY_LOG, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def cache_access(name, hit):
+    with _lock:
+        counts = _caches.setdefault(name, [0, 0])
+        counts[0 if hit else 1] += 1
+
+
+# ---------------- Connexion chronométrée ----------------
+class TimedCursor(sqlite3.Cursor):
+    """Curseur dont execute / fetch* sont chronométrés ; lignes comptées à la lecture."""
+
+    _sql = None
+
+    def execute(self, sql, parameters=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._sql = sql
+            self._elapsed = time.perf_counter() - t0
+            record_query(sql, self._elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._sql = None
+            record_query(sql, time.perf_counter() - t0, max(self.rowcount, 0))
+
+    def _fetched(self, rows, t0):
+        # Lecture comptée dans le temps de la requête (max inclus) ; l'appel, lui, l'est déjà
+        if self._sql is None:
+            return rows
+        dt = time.perf_counter() - t0
+        self._elapsed += dt
+        record_query(self._sql, dt, len(rows), count=0, elapsed=self._elapsed)
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        return self._fetched(super().fetchall(), t0)
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        return self._fetched(super().fetchmany(self.arraysize if size is None else size), t0)
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._fetched([row] if row is not None else [], t0)
+        return row
+
+    def __next__(self):
+        # Itération directe (for r in conn.execute(...)) : lignes comptées, sans chronométrage ligne à ligne
+        row = super().__next__()
+        if self._sql is not None:
+            record_query(self._sql, 0.0, 1, count=0, elapsed=0.0)
+        return row
+
+
+class TimedConnection(sqlite3.Connection):
+    # Connection.execute appelle l'exécution C directement : on repasse par le curseur
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# ---------------- Exécutions & rendus ----------------
+@contextmanager
+def run_scope():
+    """Agrégats propres à une exécution du script (en plus de ceux du processus)."""
+    previous = getattr(_local, "run", None)
+    run = _local.run = Registry()
+    try:
+        yield run
+    finally:
+        _local.run = previous
+
+def timed_render(name):
+    """Décorateur : durée de rendu d'une page (ui_*), comptée même si elle se termine par st.rerun()."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_render(name, time.perf_counter() - t0)
+        return wrapper
+    return decorate
+
+
+# ---------------- Lecture ----------------
+def top_queries(n=20, by="total_ms"):
+    with _lock:
+        rows = _process.rows("queries")
+    return sorted(rows, key=lambda r: r[by], reverse=True)[:n]
+
+def slowest_renders(n=20, by="max_ms"):
+    with _lock:
+        rows = _process.rows("renders")
+    return sorted(rows, key=lambda r: r[by], reverse=True)[:n]
+
+def cache_rates(extra=None):
+    """Taux de succès des caches suivis ; ``extra`` : {nom: (succès, échecs)} tenus ailleurs."""
+    with _lock:
+        counts = {name: tuple(c) for name, c in _caches.items()}
+    counts.update(extra or {})
+    return [{"cache": name, "succès": h, "échecs": m, "taux": round(h / (h + m), 4) if h + m else None}
+            for name, (h, m) in sorted(counts.items())]
+
+def recent_events(n=100):
+    with _lock:
+        events = list(_events)[-n:]
+    return [{"quand": datetime.fromtimestamp(t).strftime("%H:%M:%S"), "type": kind, "nom": name,
+             "ms": round(ms, 1), "lignes": rows} for t, kind, name, ms, rows in reversed(events)]
+
+def uptime() -> float:
+    return time.time() - _process.started
+
+def reset():
+    global _process
+    with _lock:
+        _process = Registry()
+        _events.clear()
+        _caches.clear()
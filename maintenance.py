@@ -0,0 +1,262 @@
+import math
+import statistics
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import utils as u
+
+# Intervalles par catégorie de service : (km, jours), le premier atteint l'emporte.
+# Surchargeables dans la table config : maintenance_<catégorie>_km / maintenance_<catégorie>_jours
+DEFAULT_INTERVALS = {
+    "Vidange": (10_000, 365),
+    "Filtres": (20_000, 730),
+    "Diagnostic": (30_000, 730),
+}
+DEFAULT_KM_PER_DAY = 40.0          # ≈ 15 000 km/an, faute de mieux
+FIT_WINDOW_DAYS = 730              # relevés plus anciens ignorés pour la pente
+MIN_SPAN_DAYS = 7                  # écart minimal entre relevés pour estimer une pente
+MAX_KM_PER_DAY = 1_000.0
+WRITE_BATCH = 200_000
+
+UNIX_EPOCH_JD = 2440587.5
+
+
+class Due(namedtuple("Due", "vehicle_id category due_date due_km km_per_day last_service_at")):
+    __slots__ = ()
+
+    def days_left(self, today=None) -> int:
+        return (date.fromisoformat(self.due_date) - (today or date.today())).days
+
+
+def intervals() -> dict:
+    out = {}
+    for cat, (km, days) in DEFAULT_INTERVALS.items():
+        key = f"maintenance_{cat.lower()}"
+        out[cat] = (float(u.get_config(f"{key}_km", km)), float(u.get_config(f"{key}_jours", days)))
+    return out
+
+def _julian(when) -> float:
+    return UNIX_EPOCH_JD + (when - datetime(1970, 1, 1)).total_seconds() / 86400
+
+def _iso_dates(jd) -> list:
+    import numpy as np
+    days = np.floor(np.asarray(jd, dtype=float) - UNIX_EPOCH_JD).astype("int64")
+    return np.datetime_as_string(days.astype("datetime64[D]")).tolist()
+
+
+# ---------------- Ajustement ----------------
+def fit_rates(vehicle_id, t, km, now, fallback=None):
+    """Pente km/jour de chaque véhicule par moindres carrés, pour toute la flotte en un passage.
+
+    vehicle_id, t (jours juliens) et km sont des tableaux de relevés dans un
+    ordre quelconque. Renvoie un DataFrame indexé par véhicule : km_per_day,
+    dernier relevé (t_last, km_last), premier relevé (t_first, km_first) et
+    fitted (pente propre au véhicule, sinon médiane de la flotte).
+    """
+    import numpy as np
+    import pandas as pd
+    vid = np.asarray(vehicle_id, dtype="int64")
+    t = np.asarray(t, dtype=float)
+    km = np.asarray(km, dtype=float)
+    order = np.lexsort((t, vid))
+    vid, t, km = vid[order], t[order], km[order]
+    if not len(vid):
+        return pd.DataFrame(columns=["km_per_day", "t_last", "km_last", "t_first", "km_first", "fitted"])
+
+    starts = np.flatnonzero(np.r_[True, vid[1:] != vid[:-1]])
+    ends = np.r_[starts[1:], len(vid)] - 1
+    group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(vid)]))
+
+    # Temps centrés sur le dernier relevé : sommes petites, pas de perte de précision
+    w = (t >= now - FIT_WINDOW_DAYS).astype(float)
+    x = t - t[ends][group]
+    sums = [np.add.reduceat(v, starts) for v in (w, w * x, w * km, w * x * x, w * x * km)]
+    n, sx, sy, sxx, sxy = sums
+    den = n * sxx - sx * sx
+    span = np.maximum.reduceat(np.where(w > 0, t, -np.inf), starts) - np.minimum.reduceat(np.where(w > 0, t, np.inf), starts)
+    ok = (n >= 2) & (span >= MIN_SPAN_DAYS) & (den > 0)
+    slope = np.divide(n * sxy - sx * sy, den, out=np.zeros_like(den), where=ok)
+    ok &= (slope > 0) & (slope <= MAX_KM_PER_DAY)
+
+    if fallback is None:
+        fallback = float(np.median(slope[ok])) if ok.any() else DEFAULT_KM_PER_DAY
+    return pd.DataFrame({
+        "km_per_day": np.where(ok, slope, fallback),
+        "t_last": t[ends], "km_last": km[ends],
+        "t_first": t[starts], "km_first": km[starts],
+        "fitted": ok,
+    }, index=pd.Index(vid[starts], name="vehicle_id"))
+
+
+# ---------------- Échéances ----------------
+def _project(base_t, base_km, t_last, km_last, rate, every_km, every_days, minimum=min):
+    """(km, jour julien) de l'échéance ; scalaires (compute_rows) ou tableaux NumPy (compute, minimum=np.minimum)."""
+    due_km = base_km + every_km
+    return due_km, minimum(base_t + every_days, t_last + (due_km - km_last) / rate)
+
+def _filter(column, vehicle_ids):
+    if vehicle_ids is None:
+        return "", ()
+    ids = [int(v) for v in vehicle_ids]
+    return f" AND {column} IN ({','.join('?' * len(ids))})", tuple(ids)
+
+def _fetch(conn, cats, vehicle_ids=None):
+    """(relevés [(véhicule, jour julien, km)], derniers services [(véhicule, catégorie, jour julien, date, km)])."""
+    where, params = _filter("vehicle_id", vehicle_ids)
+    readings = conn.execute(
+        f"SELECT vehicle_id, julianday(read_at), mileage FROM mileage_readings WHERE 1=1{where}", params
+    ).fetchall()
+    # Dernier service terminé par (véhicule, catégorie), archives comprises, et kilométrage relevé ce jour-là
+    bookings, booking_services = u.history_tables(conn)
+    where, extra = _filter("b.vehicle_id", vehicle_ids)
+    services = conn.execute(f"""
+        WITH last AS (
+            SELECT b.vehicle_id, s.category, MAX(b.scheduled_at) AS last_at, b.id AS booking_id
+            FROM {bookings} b
+            JOIN {booking_services} bs ON bs.booking_id = b.id
+            JOIN services s ON s.id = bs.service_id
+            WHERE b.status = 'terminé' AND s.category IN ({','.join('?' * len(cats))}){where}
+            GROUP BY b.vehicle_id, s.category
+        )
+        SELECT l.vehicle_id, l.category, julianday(l.last_at), l.last_at,
+               (SELECT MAX(m.mileage) FROM mileage_readings m WHERE m.booking_id = l.booking_id)
+        FROM last l""", tuple(cats) + extra).fetchall()
+    return readings, services
+
+def _load(conn, cats, vehicle_ids=None):
+    import numpy as np
+    import pandas as pd
+    readings, services = _fetch(conn, cats, vehicle_ids)
+    return (np.array(readings, dtype=float).reshape(-1, 3),
+            pd.DataFrame(services, columns=["vehicle_id", "category", "t_service", "last_service_at", "km_service"]))
+
+def compute(conn, now=None, vehicle_ids=None, fallback=None) -> "pd.DataFrame":
+    """Prochaine échéance de chaque (véhicule, catégorie) ; vehicle_ids=None pour toute la flotte.
+
+    Base : dernier service terminé de la catégorie, à défaut le premier relevé
+    connu. L'échéance est la plus proche entre base + intervalle en jours et la
+    date où la droite ajustée atteint le kilométrage de base + intervalle en km.
+    """
+    import numpy as np
+    import pandas as pd
+    now_jd = _julian(now or datetime.utcnow())
+    table = intervals()
+    readings, services = _load(conn, list(table), vehicle_ids)
+    fit = fit_rates(readings[:, 0], readings[:, 1], readings[:, 2], now_jd, fallback)
+    ids = fit.index.to_numpy()
+    rate = fit["km_per_day"].to_numpy()
+    t_last, km_last = fit["t_last"].to_numpy(), fit["km_last"].to_numpy()
+
+    frames = []
+    for cat, (every_km, every_days) in (table.items() if len(ids) else ()):
+        base_t, base_km = fit["t_first"].to_numpy().copy(), fit["km_first"].to_numpy().copy()
+        last_at = np.full(len(ids), None, dtype=object)
+        svc = services[services["category"] == cat]
+        pos = np.searchsorted(ids, svc["vehicle_id"].to_numpy())
+        known = (pos < len(ids)) & (ids[np.minimum(pos, len(ids) - 1)] == svc["vehicle_id"].to_numpy())
+        pos, svc = pos[known], svc[known]
+        base_t[pos] = svc["t_service"].to_numpy()
+        # Sans relevé le jour du service : kilométrage interpolé sur la droite
+        estimated = km_last[pos] - rate[pos] * (t_last[pos] - base_t[pos])
+        base_km[pos] = np.maximum(0, svc["km_service"].fillna(pd.Series(estimated, index=svc.index)).to_numpy(dtype=float))
+        last_at[pos] = svc["last_service_at"].to_numpy()
+
+        due_km, due_t = _project(base_t, base_km, t_last, km_last, rate, every_km, every_days, np.minimum)
+        frames.append(pd.DataFrame({
+            "vehicle_id": ids, "category": cat, "due_t": due_t, "due_km": np.round(due_km).astype("int64"),
+            "km_per_day": np.round(rate, 1), "last_service_at": last_at,
+        }))
+    out = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+        columns=["vehicle_id", "category", "due_t", "due_km", "km_per_day", "last_service_at"])
+    out["due_date"] = _iso_dates(out.pop("due_t"))
+    return out
+
+def compute_rows(conn, vehicle_ids, now=None, fallback=None) -> list:
+    """Même calcul que compute() pour quelques véhicules, en Python pur (pages client, sans NumPy).
+
+    Renvoie des lignes Due triées par (véhicule, catégorie). L'accord avec
+    compute() est vérifié par ``python -m bench.maintenance`` (échec sinon).
+    """
+    now_jd = _julian(now or datetime.utcnow())
+    table = intervals()
+    readings, services = _fetch(conn, list(table), vehicle_ids)
+    by_vehicle = {}
+    for vid, t, km in sorted(readings, key=lambda r: (r[0], r[1])):
+        by_vehicle.setdefault(int(vid), []).append((t, float(km)))
+    last = {(int(vid), cat): (t, at, km) for vid, cat, t, at, km in services}
+
+    fits = {}
+    for vid, rows in by_vehicle.items():
+        t_last, km_last = rows[-1]
+        # Temps centrés sur le dernier relevé, fenêtre FIT_WINDOW_DAYS (comme fit_rates)
+        window = [(t, km) for t, km in rows if t >= now_jd - FIT_WINDOW_DAYS]
+        n = len(window)
+        sx = sum(t - t_last for t, _ in window)
+        sy = sum(km for _, km in window)
+        sxx = sum((t - t_last) * (t - t_last) for t, _ in window)
+        sxy = sum((t - t_last) * km for t, km in window)
+        den = n * sxx - sx * sx
+        span = window[-1][0] - window[0][0] if window else -math.inf
+        slope = (n * sxy - sx * sy) / den if n >= 2 and span >= MIN_SPAN_DAYS and den > 0 else None
+        fits[vid] = (slope if slope is not None and 0 < slope <= MAX_KM_PER_DAY else None, rows)
+    if fallback is None:
+        fitted = [s for s, _ in fits.values() if s is not None]
+        fallback = statistics.median(fitted) if fitted else DEFAULT_KM_PER_DAY
+
+    out = []
+    for vid, (slope, rows) in sorted(fits.items()):
+        rate = fallback if slope is None else slope
+        (t_first, km_first), (t_last, km_last) = rows[0], rows[-1]
+        for cat, (every_km, every_days) in sorted(table.items()):
+            base_t, base_km, last_at = t_first, km_first, None
+            if (vid, cat) in last:
+                base_t, last_at, km = last[(vid, cat)]
+                # Sans relevé le jour du service : kilométrage interpolé sur la droite
+                base_km = max(0.0, km_last - rate * (t_last - base_t) if km is None else float(km))
+            due_km, due_t = _project(base_t, base_km, t_last, km_last, rate, every_km, every_days)
+            due_date = (date(1970, 1, 1) + timedelta(days=math.floor(due_t - UNIX_EPOCH_JD))).isoformat()
+            # round(x * 10) / 10 comme np.round(x, 1) (round(x, 1) arrondit la valeur exacte, pas x * 10)
+            out.append(Due(vid, cat, due_date, round(due_km), round(rate * 10) / 10, last_at))
+    return out
+
+def store(conn, rows, vehicle_ids=None, now=None):
+    """Remplace les échéances ; ``rows`` : n-uplets dans l'ordre de Due, triés par (véhicule, catégorie)."""
+    computed_at = (now or datetime.utcnow()).isoformat(timespec="seconds")
+    where, params = _filter("vehicle_id", vehicle_ids)
+    conn.execute(f"DELETE FROM maintenance_due WHERE 1=1{where}", params)
+    # Insertion dans l'ordre de la clé primaire : ajouts en fin de B-tree
+    rows = list(rows)
+    for start in range(0, len(rows), WRITE_BATCH):
+        conn.executemany("""INSERT INTO maintenance_due(vehicle_id, category, due_date, due_km, km_per_day,
+                                last_service_at, computed_at) VALUES(?,?,?,?,?,?,?)""",
+                         (tuple(r) + (computed_at,) for r in rows[start:start + WRITE_BATCH]))
+
+def run_nightly(now=None) -> dict:
+    """Recalcule toutes les échéances (tâche planifiée : ``python cli.py maintenance``)."""
+    t0 = datetime.utcnow()
+    conn = u.get_conn()
+    due = compute(conn, now).sort_values(["vehicle_id", "category"])
+    fleet = float(due["km_per_day"].median()) if not due.empty else DEFAULT_KM_PER_DAY
+    with u.transaction() as conn:
+        store(conn, zip(*(due[c].tolist() for c in Due._fields)), now=now)
+        conn.execute("""INSERT INTO config(key,value) VALUES('maintenance_fleet_km_per_day', ?)
+                        ON CONFLICT(key) DO UPDATE SET value=excluded.value""", (str(fleet),))
+    return {"vehicules": int(due["vehicle_id"].nunique()) if not due.empty else 0, "echeances": len(due),
+            "km_par_jour_median": round(fleet, 1), "secondes": (datetime.utcnow() - t0).total_seconds()}
+
+def refresh(vehicle_ids, now=None):
+    """Recalcule quelques véhicules (après une saisie) avec la médiane flotte de la dernière nuit."""
+    ids = [int(v) for v in vehicle_ids]
+    if not ids:
+        return
+    row = u.get_conn().execute("SELECT value FROM config WHERE key='maintenance_fleet_km_per_day'").fetchone()
+    fallback = float(row[0]) if row else DEFAULT_KM_PER_DAY
+    with u.transaction() as conn:
+        store(conn, compute_rows(conn, ids, now, fallback), ids, now)
+
+
+# ---------------- Consultation ----------------
+def vehicle_due(vehicle_ids) -> list:
+    where, params = _filter("vehicle_id", vehicle_ids)
+    return u.fetch(Due, f"""SELECT vehicle_id, category, due_date, due_km, km_per_day, last_service_at
+                            FROM maintenance_due WHERE 1=1{where} ORDER BY vehicle_id, due_date""", params)
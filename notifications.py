@@ -0,0 +1,231 @@
+"""Envoi asynchrone des notifications écrites dans la table outbox.
+
+Les écritures (réservation, changement de statut, annulation) insèrent leurs
+messages dans la même transaction ; un thread par processus les envoie par
+lots, hors du parcours de réservation. Livraison « au moins une fois » : un
+message réservé par un processus arrêté en plein envoi repart à l'expiration
+de son bail (CLAIM_LEASE).
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import utils as u
+
+OUTBOX_BATCH = 50
+POLL_INTERVAL = 0.5         # s entre deux relèves quand la file est vide
+CLAIM_LEASE = 60.0          # s avant qu'un message réservé mais non acquitté soit repris
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 5.0          # s, doublé à chaque échec
+BACKOFF_MAX = 3600.0
+RETENTION_DAYS = 30         # messages envoyés conservés (métriques, audit)
+# Destination du simulateur d'envoi : fichier JSON lines (défaut : notifications.jsonl à côté
+# de l'annuaire, voir u.data_dir()), "-" pour la sortie standard
+NOTIFY_FILE = os.environ.get("VIDANGE_NOTIFY_FILE")
+
+TEMPLATES = {
+    "confirmation": "Bonjour {nom}, votre rendez-vous #{booking_id} du {date} est confirmé ({total_da} DA).",
+    "statut": "Bonjour {nom}, votre rendez-vous #{booking_id} du {date} est désormais « {statut} ».",
+    "annulation": "Bonjour {nom}, votre rendez-vous #{booking_id} du {date} a été annulé.",
+}
+
+
+def render(message) -> str:
+    data = dict(message["payload"], date=message["payload"]["date"].replace("T", " ")[:16])
+    return TEMPLATES.get(message["event"], "{booking_id}").format(**data)
+
+
+# ---------------- Expéditeurs ----------------
+class Sender:
+    """Expéditeur d'un canal : send() lève une exception pour demander un nouvel essai."""
+
+    def send(self, message):
+        raise NotImplementedError
+
+    def send_batch(self, messages):
+        # Par défaut un envoi par message ; une passerelle groupée peut surcharger
+        errors = []
+        for m in messages:
+            try:
+                self.send(m)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+
+class FileSender(Sender):
+    """Simulateur : une ligne JSON par message (fichier ou sortie standard).
+
+    Le fichier contient emails et téléphones des clients : créé en 0600.
+    """
+
+    def __init__(self, path=NOTIFY_FILE):
+        self._path = path
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return self._path or os.path.join(u.data_dir(), "notifications.jsonl")
+
+    def send_batch(self, messages):
+        lines = "".join(json.dumps({"channel": m["channel"], "to": m["recipient"], "event": m["event"],
+                                    "text": render(m)}, ensure_ascii=False) + "\n" for m in messages)
+        with self._lock:
+            if self.path == "-":
+                sys.stdout.write(lines)
+                sys.stdout.flush()
+            else:
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                with open(fd, "a", encoding="utf-8") as f:
+                    f.write(lines)
+        return [None] * len(messages)
+
+
+_senders = {}
+_default_sender = FileSender()
+
+def register_sender(channel, sender):
+    """Branche un expéditeur réel (passerelle SMS, SMTP…) pour un canal."""
+    _senders[channel] = sender
+
+def sender_for(channel) -> Sender:
+    return _senders.get(channel, _default_sender)
+
+
+# ---------------- Relève ----------------
+def _backoff(attempts) -> float:
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(1.0, 1.2)
+
+def _claim(pool, batch, now):
+    # Réservation atomique : deux processus ne prennent jamais le même message
+    with pool.transaction() as conn:
+        rows = conn.execute("""
+            UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?
+            WHERE id IN (SELECT id FROM outbox WHERE status='pending' AND next_attempt_at <= ?
+                         ORDER BY next_attempt_at, id LIMIT ?)
+            RETURNING id, event, booking_id, channel, recipient, payload, attempts, created_at""",
+            (now + CLAIM_LEASE, now, batch)).fetchall()
+    cols = ("id", "event", "booking_id", "channel", "recipient", "payload", "attempts", "created_at")
+    return [dict(zip(cols, r), payload=json.loads(r[5])) for r in rows]
+
+def drain_once(pool=None, batch=OUTBOX_BATCH) -> tuple:
+    """Envoie un lot de messages dus ; renvoie (envoyés, en échec)."""
+    pool = pool or u.get_pool()
+    messages = _claim(pool, batch, time.time())
+    if not messages:
+        return 0, 0
+    by_channel = {}
+    for m in messages:
+        by_channel.setdefault(m["channel"], []).append(m)
+
+    sent, retry, failed = [], [], []
+    for channel, group in by_channel.items():
+        try:
+            errors = sender_for(channel).send_batch(group)
+        except Exception as e:
+            errors = [e] * len(group)
+        now = time.time()
+        for m, err in zip(group, errors):
+            if err is None:
+                sent.append((now, m["id"]))
+            elif m["attempts"] >= MAX_ATTEMPTS:
+                failed.append((repr(err)[:500], m["id"]))
+            else:
+                retry.append((now + _backoff(m["attempts"]), repr(err)[:500], m["id"]))
+
+    with pool.transaction() as conn:
+        conn.executemany("UPDATE outbox SET status='sent', sent_at=?, last_error=NULL WHERE id=?", sent)
+        conn.executemany("UPDATE outbox SET next_attempt_at=?, last_error=? WHERE id=?", retry)
+        conn.executemany("UPDATE outbox SET status='failed', last_error=? WHERE id=?", failed)
+    return len(sent), len(retry) + len(failed)
+
+def purge(pool=None, days=RETENTION_DAYS) -> int:
+    pool = pool or u.get_pool()
+    with pool.transaction() as conn:
+        return conn.execute("DELETE FROM outbox WHERE status='sent' AND sent_at < ?",
+                            (time.time() - days * 86400,)).rowcount
+
+def retry_failed(pool=None) -> int:
+    """Remet en file les messages abandonnés (après correction d'une passerelle, par exemple)."""
+    pool = pool or u.get_pool()
+    with pool.transaction() as conn:
+        return conn.execute("UPDATE outbox SET status='pending', attempts=0, next_attempt_at=? WHERE status='failed'",
+                            (time.time(),)).rowcount
+
+
+class OutboxWorker(threading.Thread):
+    """Relève la file en continu ; enchaîne les lots tant qu'il reste des messages dus."""
+
+    def __init__(self, path, batch=OUTBOX_BATCH, poll=POLL_INTERVAL):
+        super().__init__(name=f"outbox:{path}", daemon=True)
+        self.pool = u.get_pool(path)
+        self.batch = batch
+        self.poll = poll
+        self.stopping = threading.Event()
+        self.errors = 0
+
+    def run(self):
+        last_purge = 0.0
+        while not self.stopping.is_set():
+            try:
+                sent, failed = drain_once(self.pool, self.batch)
+                if time.monotonic() - last_purge > 3600:
+                    purge(self.pool)
+                    last_purge = time.monotonic()
+            except Exception:
+                # Base verrouillée, disque plein… : on réessaie au tour suivant
+                self.errors += 1
+                sent = failed = 0
+            if sent + failed < self.batch:
+                self.stopping.wait(self.poll)
+
+    def stop(self, timeout=5.0):
+        self.stopping.set()
+        self.join(timeout)
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+def start_worker(path=None) -> OutboxWorker:
+    """Un seul thread d'envoi par processus et par base (idempotent)."""
+    path = path or u.current_path()
+    with _workers_lock:
+        worker = _workers.get(path)
+        if worker is None or not worker.is_alive():
+            worker = _workers[path] = OutboxWorker(path)
+            worker.start()
+        return worker
+
+def stop_workers():
+    with _workers_lock:
+        workers = list(_workers.values())
+        _workers.clear()
+    for w in workers:
+        w.stop()
+
+
+# ---------------- Métriques ----------------
+def metrics(conn=None, window=500) -> dict:
+    """Profondeur de la file et latence de livraison (création → envoi) des derniers messages."""
+    import numpy as np
+    conn = conn or u.get_conn()
+    now = time.time()
+    pending, due, oldest = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(next_attempt_at <= ?), 0), MIN(created_at) FROM outbox WHERE status='pending'",
+        (now,)).fetchone()
+    failed = conn.execute("SELECT COUNT(*) FROM outbox WHERE status='failed'").fetchone()[0]
+    sent_hour = conn.execute("SELECT COUNT(*) FROM outbox WHERE status='sent' AND sent_at >= ?",
+                             (now - 3600,)).fetchone()[0]
+    lat = np.array([r[0] for r in conn.execute(
+        "SELECT sent_at - created_at FROM outbox WHERE status='sent' ORDER BY sent_at DESC LIMIT ?", (window,))])
+    p50, p95 = (np.percentile(lat, [50, 95]).round(3).tolist() if lat.size else (None, None))
+    return {"en_attente": pending, "dus": int(due), "en_echec": failed, "envoyes_1h": sent_hour,
+            "plus_ancien_s": round(now - oldest, 1) if oldest else None,
+            "latence_p50_s": p50, "latence_p95_s": p95,
+            "latence_max_s": round(float(lat.max()), 3) if lat.size else None}
@@ -0,0 +1,145 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+# Coût scrypt : ~16 Mo et quelques dizaines de ms par hachage
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+# Calculs KDF simultanés, attente max en file, délai de réponse
+KDF_WORKERS = 4
+KDF_QUEUE = 32
+KDF_TIMEOUT = 10.0
+
+# Seaux à jetons : (capacité, jetons rendus par seconde)
+EMAIL_BUCKET = (5, 1 / 60)
+IP_BUCKET = (20, 1 / 6)
+
+
+class LoginRateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"réessayer dans {retry_after:.0f} s")
+        self.retry_after = retry_after
+
+
+class PasswordBusy(Exception):
+    """File de calcul KDF pleine ou calcul non rendu dans KDF_TIMEOUT : trop de connexions simultanées."""
+
+
+# ---------------- Hachage ----------------
+def _b64(raw: bytes) -> str:
+    return base64.b64encode(raw).decode("ascii")
+
+def _scrypt(pw: str, salt: bytes, n, r, p) -> bytes:
+    return hashlib.scrypt(pw.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + (1 << 20), dklen=KEY_BYTES)
+
+def legacy_sha256(pw: str) -> str:
+    # Ancien format : SHA-256 hexadécimal sans sel
+    return hashlib.sha256(pw.encode("utf-8")).hexdigest()
+
+def hash_password(pw: str) -> str:
+    salt = os.urandom(SALT_BYTES)
+    key = _scrypt(pw, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(key)}"
+
+def verify_password(pw: str, stored: str) -> bool:
+    if stored.startswith("scrypt$"):
+        _, n, r, p, salt, key = stored.split("$")
+        candidate = _scrypt(pw, base64.b64decode(salt), int(n), int(r), int(p))
+        return hmac.compare_digest(candidate, base64.b64decode(key))
+    return hmac.compare_digest(legacy_sha256(pw), stored)
+
+def needs_rehash(stored: str) -> bool:
+    return not stored.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+_dummy = None
+
+def dummy_hash() -> str:
+    """Hachage de référence pour un email inconnu (même durée de vérification)."""
+    global _dummy
+    if _dummy is None:
+        _dummy = hash_password(os.urandom(16).hex())
+    return _dummy
+
+
+# ---------------- Exécution bornée ----------------
+# scrypt relâche le GIL : les autres sessions continuent pendant le calcul,
+# et la file bornée évite qu'une rafale de connexions sature le serveur.
+_executor = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix="kdf")
+_slots = threading.BoundedSemaphore(KDF_WORKERS + KDF_QUEUE)
+
+def _run_bounded(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise PasswordBusy()
+    try:
+        future = _executor.submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=KDF_TIMEOUT)
+    except FutureTimeout:
+        # Toujours en file derrière d'autres calculs : même réponse qu'une file pleine
+        raise PasswordBusy() from None
+
+def hash_password_bounded(pw: str) -> str:
+    return _run_bounded(hash_password, pw)
+
+def verify_password_bounded(pw: str, stored: str) -> bool:
+    return _run_bounded(verify_password, pw, stored)
+
+
+# ---------------- Limitation des tentatives ----------------
+class TokenBucketLimiter:
+    """Un seau à jetons par clé, en mémoire ; les clés les plus anciennes sont évincées."""
+
+    def __init__(self, capacity, refill_per_s, max_keys=100_000):
+        self.capacity = capacity
+        self.refill_per_s = refill_per_s
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key) -> float:
+        """Consomme un jeton ; renvoie 0 si autorisé, sinon l'attente en secondes."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - last) * self.refill_per_s)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.refill_per_s
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+email_limiter = TokenBucketLimiter(*EMAIL_BUCKET)
+ip_limiter = TokenBucketLimiter(*IP_BUCKET)
+
+def check_login_rate(email: str, ip=None):
+    wait = email_limiter.take(email.strip().lower())
+    if ip:
+        wait = max(wait, ip_limiter.take(ip))
+    if wait:
+        raise LoginRateLimited(wait)
+
+def login_succeeded(email: str):
+    email_limiter.reset(email.strip().lower())
@@ -0,0 +1,184 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import utils as u
+import scheduling as sch
+
+# Paramètres par défaut (surchargeables dans la table config)
+DEFAULT_DEPOT = (36.7538, 3.0588)    # atelier
+DEFAULT_SPEED_KMH = 30.0             # vitesse moyenne en ville
+LATE_TOLERANCE_MIN = 15              # retard toléré avant pénalité
+LATE_PENALTY = 10.0                  # poids d'une minute de retard face à une minute de trajet
+
+EARTH_RADIUS_KM = 6371.0088
+TWO_OPT_CANDIDATES = 5
+
+
+# ---------------- Distances ----------------
+def haversine_matrix(lat, lon) -> np.ndarray:
+    """Matrice n × n des distances orthodromiques en km."""
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+# ---------------- Heuristiques ----------------
+# Dans une tournée, le nœud 0 est l'atelier ; ready[k] est l'heure de
+# rendez-vous (minutes depuis minuit) et service[k] la durée d'intervention.
+def _arrivals(order, T, ready, service, start):
+    """Heures d'arrivée le long de la tournée, sans boucle Python.
+
+    Le départ d_p = max(d_{p-1} + trajet_p, ready_p) + service_p se réécrit
+    d_p = C_p + max(start, max_{q<=p}(ready_q - C_{q-1} - trajet_q)), avec C
+    la somme cumulée des trajets et services : un maximum cumulé suffit.
+    """
+    order = np.asarray(order)
+    travel = T[np.concatenate([[0], order[:-1]]), order]
+    r, s = ready[order], service[order]
+    c = np.cumsum(travel + s)
+    c_prev = c - travel - s
+    e = np.maximum(start, np.maximum.accumulate(r - c_prev - travel))
+    departures = c + e
+    return np.concatenate([[start], departures[:-1]]) + travel
+
+def _lateness(order, T, ready, service, start):
+    order = np.asarray(order)
+    late = _arrivals(order, T, ready, service, start) - ready[order] - LATE_TOLERANCE_MIN
+    return float(np.maximum(late, 0.0).sum())
+
+def _nearest_neighbour(T, ready, service, start):
+    """Plus proche voisin en temps : trajet + attente + retard pénalisé."""
+    n = len(T)
+    todo = np.ones(n, dtype=bool)
+    todo[0] = False
+    order, t, cur = [], start, 0
+    for _ in range(n - 1):
+        arrival = t + T[cur]
+        cost = np.maximum(arrival, ready) - t + LATE_PENALTY * np.maximum(0.0, arrival - ready - LATE_TOLERANCE_MIN)
+        cost[~todo] = np.inf
+        k = int(np.argmin(cost))
+        order.append(k)
+        todo[k] = False
+        t = max(arrival[k], ready[k]) + service[k]
+        cur = k
+    return order
+
+def _two_opt(D, T, order, ready, service, start, max_passes=20):
+    """2-opt (meilleure amélioration vectorisée par position) sans aggraver les retards."""
+    route = np.array([0] + list(order) + [0])
+    n = len(route) - 2
+    late = _lateness(route[1:-1], T, ready, service, start)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n):
+            a, b = route[i - 1], route[i]
+            c, d = route[i + 1:n + 1], route[i + 2:n + 2]
+            delta = D[a, c] + D[b, d] - D[a, b] - D[c, d]
+            best = np.argsort(delta)[:TWO_OPT_CANDIDATES]
+            for k in best[delta[best] < -1e-9]:
+                j = i + 1 + int(k)
+                cand = np.concatenate([route[:i], route[i:j + 1][::-1], route[j + 1:]])
+                cand_late = _lateness(cand[1:-1], T, ready, service, start)
+                if cand_late <= late + 1e-9:
+                    route, late, improved = cand, cand_late, True
+                    break
+        if not improved:
+            break
+    return [int(k) for k in route[1:-1]]
+
+def _kmeans(coords, k, iterations=10):
+    """Regroupe les points en k zones (centres initiaux les plus éloignés)."""
+    centers = [coords[0]]
+    for _ in range(1, k):
+        dist = np.min([((coords - c) ** 2).sum(axis=1) for c in centers], axis=0)
+        centers.append(coords[int(np.argmax(dist))])
+    centers = np.array(centers)
+    for _ in range(iterations):
+        labels = np.argmin(((coords[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2), axis=1)
+        for c in range(k):
+            if np.any(labels == c):
+                centers[c] = coords[labels == c].mean(axis=0)
+    return labels
+
+
+# ---------------- Planification ----------------
+def _minute_of_day(values) -> np.ndarray:
+    ts = pd.to_datetime(pd.Series(values))
+    return (ts.dt.hour * 60 + ts.dt.minute).to_numpy(dtype=float)
+
+def assign_technicians(stops: pd.DataFrame, technician_ids) -> pd.Series:
+    """Technicien de chaque arrêt : celui affecté, sinon une zone géographique par technicien libre."""
+    tech = stops["technician_id"].astype("Int64") if "technician_id" in stops else pd.Series(pd.NA, index=stops.index, dtype="Int64")
+    missing = tech.isna().to_numpy()
+    if missing.any() and technician_ids:
+        coords = stops.loc[missing, ["latitude", "longitude"]].to_numpy(dtype=float)
+        load = tech.value_counts()
+        free = sorted(technician_ids, key=lambda t: (int(load.get(t, 0)), t))
+        k = min(len(free), len(coords))
+        labels = _kmeans(coords, k)
+        tech.loc[missing] = [free[c] for c in labels]
+    return tech
+
+def plan_routes(stops: pd.DataFrame, technician_ids=(), depot=DEFAULT_DEPOT,
+                speed_kmh=DEFAULT_SPEED_KMH, start_min=8 * 60) -> pd.DataFrame:
+    """Ordonne les arrêts de chaque technicien.
+
+    ``stops`` : colonnes booking_id, latitude, longitude, scheduled_at,
+    duration_min et (optionnel) technician_id. Renvoie une ligne par arrêt
+    avec l'ordre de passage, l'arrivée estimée, la distance depuis l'arrêt
+    précédent et le retard éventuel.
+    """
+    columns = ["technician_id", "seq", "booking_id", "latitude", "longitude",
+               "scheduled_at", "arrival", "leg_km", "late_min"]
+    if stops.empty:
+        return pd.DataFrame(columns=columns)
+    stops = stops.reset_index(drop=True)
+    tech = assign_technicians(stops, list(technician_ids))
+    ready_all = _minute_of_day(stops["scheduled_at"])
+    service_all = stops["duration_min"].fillna(sch.DEFAULT_DURATION_MIN).to_numpy(dtype=float)
+
+    out = []
+    for tech_id, idx in stops.groupby(tech.fillna(-1).to_numpy()).indices.items():
+        lat = np.concatenate([[depot[0]], stops["latitude"].to_numpy(dtype=float)[idx]])
+        lon = np.concatenate([[depot[1]], stops["longitude"].to_numpy(dtype=float)[idx]])
+        D = haversine_matrix(lat, lon)
+        T = D / speed_kmh * 60.0
+        ready = np.concatenate([[start_min], ready_all[idx]])
+        service = np.concatenate([[0.0], service_all[idx]])
+
+        order = _nearest_neighbour(T, ready, service, start_min)
+        order = _two_opt(D, T, order, ready, service, start_min)
+
+        arrivals = _arrivals(order, T, ready, service, start_min)
+        prev = [0] + order[:-1]
+        for seq, (k, p, t) in enumerate(zip(order, prev, arrivals), start=1):
+            out.append((None if tech_id == -1 else int(tech_id), seq, int(stops["booking_id"].iloc[idx[k - 1]]),
+                        lat[k], lon[k], stops["scheduled_at"].iloc[idx[k - 1]],
+                        int(round(t)), round(float(D[p, k]), 2),
+                        int(max(0.0, t - ready[k] - LATE_TOLERANCE_MIN))))
+    df = pd.DataFrame(out, columns=columns)
+    df["arrival"] = df["arrival"].map(lambda m: f"{m // 60:02d}:{m % 60:02d}")
+    return df
+
+def domicile_stops(day) -> pd.DataFrame:
+    """Interventions à domicile non annulées du jour, avec leur durée."""
+    return pd.read_sql_query("""
+        SELECT b.id AS booking_id, b.latitude, b.longitude, b.scheduled_at, b.technician_id,
+               COALESCE((SELECT SUM(duration_min) FROM booking_services WHERE booking_id=b.id), ?) AS duration_min
+        FROM bookings b
+        WHERE b.booking_type='domicile' AND b.status != 'annulé'
+          AND b.scheduled_at >= ? AND b.scheduled_at < ?
+          AND b.latitude IS NOT NULL AND b.longitude IS NOT NULL
+        ORDER BY b.scheduled_at
+    """, u.get_conn(), params=(sch.DEFAULT_DURATION_MIN, day.isoformat(), (day + timedelta(days=1)).isoformat()))
+
+def plan_day(day) -> pd.DataFrame:
+    depot = (float(u.get_config("depot_lat", DEFAULT_DEPOT[0])), float(u.get_config("depot_lon", DEFAULT_DEPOT[1])))
+    speed = float(u.get_config("avg_speed_kmh", DEFAULT_SPEED_KMH))
+    techs = u.get_technicians(active_only=True)["id"].tolist()
+    return plan_routes(domicile_stops(day), techs, depot, speed, sch.opening_hours()[0])
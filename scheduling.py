@@ -0,0 +1,193 @@
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+import instrumentation
+import utils as u
+
+# Paramètres par défaut (surchargeables dans la table config)
+DEFAULT_OPENING = "08:00"
+DEFAULT_CLOSING = "18:00"
+DEFAULT_SLOT_STEP_MIN = 15
+DEFAULT_DURATION_MIN = 45
+DEFAULT_WORKSHOP_CAPACITY = 1        # rendez-vous simultanés sans technicien actif (config workshop_capacity)
+
+# Durée de vie d'un planning journalier en mémoire (les écritures locales l'invalident)
+SCHEDULE_TTL = 5.0
+
+
+class SlotUnavailable(Exception):
+    """Plus aucun technicien libre sur le créneau demandé."""
+
+
+def _minutes(hhmm: str) -> int:
+    h, m = hhmm.split(":")[:2]
+    return int(h) * 60 + int(m)
+
+def opening_hours():
+    return (_minutes(u.get_config("opening_time", DEFAULT_OPENING)),
+            _minutes(u.get_config("closing_time", DEFAULT_CLOSING)))
+
+def slot_step() -> int:
+    return int(u.get_config("slot_step_min", DEFAULT_SLOT_STEP_MIN))
+
+
+# ---------------- Index d'intervalles ----------------
+class IntervalIndex:
+    """Intervalles [début, fin) en minutes, triés par début.
+
+    ``_max_end[i]`` est la fin maximale des intervalles 0..i : un
+    chevauchement avec [s, e) se teste par une recherche dichotomique.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self._max_end = []
+        self.load = 0
+
+    def add(self, start, end):
+        i = bisect_left(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.load += end - start
+        self._max_end[i:] = []
+        prev = self._max_end[i - 1] if i else -1
+        for e in self.ends[i:]:
+            prev = max(prev, e)
+            self._max_end.append(prev)
+
+    def overlaps(self, start, end) -> bool:
+        i = bisect_left(self.starts, end)
+        return i > 0 and self._max_end[i - 1] > start
+
+    def count_overlaps(self, start, end) -> int:
+        i = bisect_left(self.starts, end)
+        return sum(1 for e in self.ends[:i] if e > start)
+
+
+# ---------------- Planning journalier ----------------
+class DaySchedule:
+    """Réservations engagées d'une journée, indexées par technicien."""
+
+    def __init__(self, day, technician_ids, capacity=DEFAULT_WORKSHOP_CAPACITY):
+        self.day = day
+        self.by_tech = {int(t): IntervalIndex() for t in technician_ids}
+        self.unassigned = IntervalIndex()
+        self.capacity = int(capacity)
+
+    @classmethod
+    def load(cls, conn, day):
+        techs = [r[0] for r in conn.execute("SELECT id FROM technicians WHERE active=1 ORDER BY id")]
+        row = conn.execute("SELECT value FROM config WHERE key='workshop_capacity'").fetchone()
+        sched = cls(day, techs, row[0] if row else DEFAULT_WORKSHOP_CAPACITY)
+        rows = conn.execute("""
+            SELECT b.scheduled_at, b.technician_id,
+                   COALESCE((SELECT SUM(duration_min) FROM booking_services WHERE booking_id=b.id), ?)
+            FROM bookings b
+            WHERE b.scheduled_at >= ? AND b.scheduled_at < ? AND b.status != 'annulé'
+        """, (DEFAULT_DURATION_MIN, day.isoformat(), (day + timedelta(days=1)).isoformat()))
+        for scheduled_at, tech_id, duration in rows:
+            start = int(scheduled_at[11:13]) * 60 + int(scheduled_at[14:16])
+            sched.add(tech_id, start, start + int(duration))
+        return sched
+
+    def add(self, tech_id, start, end):
+        index = self.by_tech.get(tech_id) if tech_id is not None else None
+        (index or self.unassigned).add(start, end)
+
+    def free_technicians(self, start, end):
+        free = [t for t, idx in self.by_tech.items() if not idx.overlaps(start, end)]
+        # Les réservations sans technicien consomment aussi de la capacité
+        if len(free) <= self.unassigned.count_overlaps(start, end):
+            return []
+        return free
+
+    def pick_technician(self, start, end):
+        """Technicien libre le moins chargé de la journée (None si complet)."""
+        free = self.free_technicians(start, end)
+        if not free:
+            return None
+        return min(free, key=lambda t: (self.by_tech[t].load, t))
+
+    def is_free(self, start, end) -> bool:
+        if self.by_tech:
+            return bool(self.free_technicians(start, end))
+        # Aucun technicien actif (installation neuve) : capacité fixe de l'atelier
+        return self.unassigned.count_overlaps(start, end) < self.capacity
+
+    @staticmethod
+    def starts(duration, opening, closing, step) -> range:
+        """Débuts de créneau permis par les horaires (minutes), avant toute occupation."""
+        return range(opening, closing - max(int(duration), step) + 1, step)
+
+    def available_slots(self, duration, opening, closing, step):
+        duration = max(int(duration), step)
+        return [s for s in self.starts(duration, opening, closing, step) if self.is_free(s, s + duration)]
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def day_schedule(day) -> DaySchedule:
+    now = time.monotonic()
+    key = (u.current_path(), day)        # un planning par garage
+    hit = _cache.get(key)
+    if hit and now - hit[0] < SCHEDULE_TTL:
+        instrumentation.cache_access("planning du jour", True)
+        return hit[1]
+    instrumentation.cache_access("planning du jour", False)
+    sched = DaySchedule.load(u.get_conn(), day)
+    with _cache_lock:
+        if len(_cache) > 64:
+            _cache.clear()
+        _cache[key] = (now, sched)
+    return sched
+
+def invalidate(day=None):
+    with _cache_lock:
+        if day is None:
+            _cache.clear()
+        else:
+            _cache.pop((u.current_path(), day), None)
+
+
+# ---------------- API ----------------
+def available_slots(day, service_ids):
+    """Heures de début possibles (datetime) pour ces services à cette date."""
+    opening, closing = opening_hours()
+    step = slot_step()
+    sched = day_schedule(day)
+    minutes = sched.available_slots(u.quote_duration(service_ids), opening, closing, step)
+    base = datetime.combine(day, datetime.min.time())
+    now = datetime.now()
+    return [dt for dt in (base + timedelta(minutes=m) for m in minutes) if dt > now]
+
+def confirm_booking(user_id, vehicle_id, service_ids, total_price_da, booking_type,
+                    address, latitude, longitude, scheduled_dt, payment_mode="sur_place", mileage=None):
+    """Crée la réservation et affecte le technicien libre le moins chargé.
+
+    Lève SlotUnavailable hors horaires, hors pas de créneau, dans le passé ou
+    si plus personne n'est libre. Le planning du jour est relu dans la transaction (BEGIN IMMEDIATE), ce
+    qui sérialise les confirmations concurrentes, y compris entre processus.
+    """
+    day = scheduled_dt.date()
+    start = scheduled_dt.hour * 60 + scheduled_dt.minute
+    duration = u.quote_duration(service_ids)
+    end = start + max(duration, 1)
+    # Mêmes règles que available_slots() : horaires, pas des créneaux, pas de date passée
+    opening, closing = opening_hours()
+    if (start not in DaySchedule.starts(duration, opening, closing, slot_step())
+            or scheduled_dt.second or scheduled_dt.microsecond or scheduled_dt <= datetime.now()):
+        raise SlotUnavailable(scheduled_dt)
+    with u.transaction() as conn:
+        sched = DaySchedule.load(conn, day)
+        if not sched.is_free(start, end):
+            raise SlotUnavailable(scheduled_dt)
+        tech_id = sched.pick_technician(start, end)
+        bid = u.create_booking(user_id, vehicle_id, service_ids, total_price_da, booking_type,
+                               address, latitude, longitude, scheduled_dt, payment_mode,
+                               technician_id=tech_id, mileage=mileage)
+    invalidate(day)
+    return bid, tech_id
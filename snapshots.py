@@ -0,0 +1,409 @@
+"""Copies d'analyse et sauvegardes à chaud, par l'API de sauvegarde en ligne de SQLite.
+
+    python cli.py snapshot                  # rafraîchir la copie et appliquer la rétention
+    python cli.py snapshot --list
+    python cli.py snapshot --restore snapshots/vidange-20260301T020000Z.db --out vidange_restauree.db
+
+Statistiques, exports et rapport réseau lisent la dernière copie, ouverte en
+lecture seule : un long parcours ne retient ni verrou ni point de contrôle WAL
+sur la base des réservations. Passé ``snapshot_max_age_s`` secondes, elle est
+renouvelée en arrière-plan. Chaque copie, horodatée, est aussi une sauvegarde
+cohérente ; la rétention garde les plus récentes et une par jour, sauf celles
+en cours de lecture.
+"""
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import utils as u
+
+SNAPSHOT_DIR = "snapshots"       # à côté de la base copiée
+SNAPSHOT_MAX_AGE = 300           # s ; config snapshot_max_age_s (0 : lectures sur la base vive)
+SNAPSHOT_PAGES = 4096            # pages copiées par étape
+SNAPSHOT_SLEEP = 0.005           # s entre deux étapes
+MAX_RESTARTS = 3                 # copie relancée par des écritures concurrentes ; ensuite une seule étape
+KEEP_RECENT = 6                  # config snapshot_keep
+KEEP_DAYS = 7                    # une copie par jour ; config snapshot_keep_days
+LOCK_STALE = 3600                # s ; verrou de copie laissé par un processus tué, ignoré au-delà
+LEASE_STALE = 6 * 3600           # s ; lecture annoncée par un processus tué, ignorée au-delà
+_STAMP = "%Y%m%dT%H%M%SZ"
+
+
+class _Restarted(Exception):
+    pass
+
+
+# ---------------- Copies ----------------
+def snapshot_dir(path=None) -> str:
+    return os.path.join(os.path.dirname(path or u.current_path()), SNAPSHOT_DIR)
+
+def list_snapshots(path=None) -> list:
+    """Copies terminées de la base, de la plus ancienne à la plus récente : [(horodatage UTC, fichier)]."""
+    path = path or u.current_path()
+    folder = snapshot_dir(path)
+    if not os.path.isdir(folder):
+        return []
+    pattern = re.compile(re.escape(os.path.splitext(os.path.basename(path))[0]) + r"-(\d{8}T\d{6}Z)\.db$")
+    found = []
+    for name in os.listdir(folder):
+        m = pattern.match(name)
+        if m:
+            taken = datetime.strptime(m.group(1), _STAMP).replace(tzinfo=timezone.utc)
+            found.append((taken, os.path.join(folder, name)))
+    return sorted(found)
+
+def _age(taken) -> float:
+    return (datetime.now(timezone.utc) - taken).total_seconds()
+
+def _copy(src_path, dst_path, progress=None) -> dict:
+    """Copie en ligne par étapes de SNAPSHOT_PAGES pages.
+
+    Le verrou de lecture est rendu entre deux étapes ; si des écritures relancent
+    la copie plus de MAX_RESTARTS fois, elle repart en une seule étape (en WAL,
+    une lecture longue ne bloque pas les écrivains).
+    """
+    stats = {"pages": 0, "restarts": 0}
+    src = sqlite3.connect(src_path)
+    try:
+        for pages in (SNAPSHOT_PAGES, -1):
+            last = None
+
+            def step(status, remaining, total):
+                nonlocal last
+                if last is not None and remaining >= last:
+                    stats["restarts"] += 1
+                    if stats["restarts"] > MAX_RESTARTS:
+                        raise _Restarted
+                last = remaining
+                stats["pages"] = total
+                if progress:
+                    progress(total - remaining, total)
+
+            dst = sqlite3.connect(dst_path)
+            try:
+                src.backup(dst, pages=pages, progress=step, sleep=SNAPSHOT_SLEEP)
+                return stats
+            except _Restarted:
+                continue
+            finally:
+                dst.close()
+    finally:
+        src.close()
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+def _lock(path):
+    with _locks_lock:
+        return _locks.setdefault(path, threading.RLock())
+
+@contextmanager
+def _folder_lock(path, wait=True):
+    """Verrou des copies de la base, partagé entre processus (fichier créé en exclusif).
+
+    Produit False sans attendre si ``wait`` est faux et qu'un autre processus copie.
+    """
+    folder = snapshot_dir(path)
+    os.makedirs(folder, exist_ok=True)
+    lock = os.path.join(folder, os.path.splitext(os.path.basename(path))[0] + ".lock")
+    with _lock(path):
+        while True:
+            try:
+                fd = os.open(lock, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock) > LOCK_STALE:
+                        os.remove(lock)
+                        continue
+                except OSError:
+                    continue            # libéré entre-temps
+                if not wait:
+                    yield False
+                    return
+                time.sleep(0.1)
+        try:
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            yield True
+        finally:
+            os.remove(lock)
+
+def refresh(path=None, progress=None, if_older_than=None):
+    """Nouvelle copie horodatée de la base (et de son archive), puis rétention ; renvoie ses métadonnées.
+
+    Un seul rafraîchissement à la fois, tous processus confondus. Avec
+    ``if_older_than`` (s), rien n'est fait (None) si un autre processus copie
+    déjà ou vient de produire une copie assez récente.
+    """
+    path = path or u.current_path()
+    with _folder_lock(path, wait=if_older_than is None) as acquired:
+        if not acquired:
+            return None
+        snaps = list_snapshots(path)
+        if if_older_than is not None and snaps and _age(snaps[-1][0]) <= if_older_than:
+            return None
+        return _refresh(path, progress)
+
+def _refresh(path, progress):
+    taken = datetime.now(timezone.utc).replace(microsecond=0)
+    folder = snapshot_dir(path)
+    final = os.path.join(folder, f"{os.path.splitext(os.path.basename(path))[0]}-{taken.strftime(_STAMP)}.db")
+    # Fichiers temporaires uniques : une copie interrompue ne se mêle jamais à une autre
+    tmp, tmp_archive = (_mkstemp(folder) for _ in range(2))
+    try:
+        t0 = time.perf_counter()
+        stats = _copy(path, tmp, progress)
+        has_archive = os.path.exists(u.archive_path(path))
+        if has_archive:
+            stats["restarts"] += _copy(u.archive_path(path), tmp_archive)["restarts"]
+
+        conn = sqlite3.connect(tmp, isolation_level=None)
+        try:
+            # Journal classique : la copie s'ouvre en lecture seule sans créer de -wal ni de -shm
+            conn.execute("PRAGMA journal_mode=DELETE")
+            if has_archive:
+                # Base puis archive : un lot archivé entre les deux copies figure dans les deux
+                conn.execute("ATTACH DATABASE ? AS archive", (tmp_archive,))
+                conn.execute("PRAGMA archive.journal_mode=DELETE")
+                if conn.execute("SELECT 1 FROM archive.sqlite_master WHERE name='bookings'").fetchone():
+                    conn.execute("DELETE FROM archive.booking_services WHERE booking_id IN (SELECT id FROM main.bookings)")
+                    conn.execute("DELETE FROM archive.bookings WHERE id IN (SELECT id FROM main.bookings)")
+                conn.execute("DETACH DATABASE archive")
+            info = {"taken_at": taken.isoformat(), "seconds": round(time.perf_counter() - t0, 3),
+                    "pages": stats["pages"], "restarts": stats["restarts"], "source": path}
+            # Métadonnées dans la copie elle-même : la base vive n'est pas écrite
+            conn.execute("INSERT OR REPLACE INTO config(key, value) VALUES('snapshot', ?)", (json.dumps(info),))
+        finally:
+            conn.close()
+        if has_archive:
+            os.replace(tmp_archive, u.archive_path(final))
+        os.replace(tmp, final)          # visible seulement une fois complète
+        prune(path)
+        return info
+    finally:
+        for p in (tmp, tmp_archive):
+            if os.path.exists(p):
+                os.remove(p)
+
+def _mkstemp(folder) -> str:
+    fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=folder)
+    os.close(fd)
+    return tmp
+
+def restore(snapshot, out):
+    """Recopie une sauvegarde (et son archive) vers ``out`` ; la base vive n'est jamais écrasée."""
+    if os.path.exists(out):
+        raise ValueError(f"{out} existe déjà")
+    _copy(snapshot, out)
+    if os.path.exists(u.archive_path(snapshot)):
+        _copy(u.archive_path(snapshot), u.archive_path(out))
+    conn = sqlite3.connect(out, isolation_level=None)
+    try:
+        conn.execute("DELETE FROM config WHERE key='snapshot'")
+    finally:
+        conn.close()
+
+_readers = {}                    # copie -> lecteurs en cours (blocs analytics() du processus)
+_readers_lock = threading.Lock()
+
+def prune(path=None, keep=None, days=None) -> int:
+    """Garde les ``keep`` copies les plus récentes et la dernière de chacun des ``days`` derniers jours.
+
+    Une copie en cours de lecture (lease(), dans ce processus ou un autre) est
+    gardée jusqu'au passage suivant.
+    """
+    path = path or u.current_path()
+    keep = int(u.get_config("snapshot_keep", KEEP_RECENT)) if keep is None else keep
+    days = int(u.get_config("snapshot_keep_days", KEEP_DAYS)) if days is None else days
+    snaps = list_snapshots(path)
+    kept = {f for _, f in snaps[-keep:]} if keep > 0 else set()
+    daily = {}
+    for taken, f in snaps:
+        if _age(taken) <= days * 86400:
+            daily[taken.date()] = f
+    kept.update(daily.values())
+    removed = 0
+    for _, f in snaps:
+        if f in kept:
+            continue
+        with _readers_lock:
+            if _readers.get(f) or _leased_elsewhere(f):
+                continue
+            u.drop_pool(f)
+            try:
+                for base in (f, u.archive_path(f)):
+                    for p in (base, base + "-wal", base + "-shm"):
+                        if os.path.exists(p):
+                            os.remove(p)
+            except OSError:
+                continue        # encore ouverte (Windows) : au passage suivant
+        removed += 1
+    return removed
+
+def _lease_file(snap) -> str:
+    return f"{snap}.{os.getpid()}.lease"
+
+def _leased_elsewhere(snap) -> bool:
+    folder, name = os.path.split(snap)
+    fresh = False
+    for entry in os.listdir(folder):
+        if entry.startswith(name + ".") and entry.endswith(".lease"):
+            p = os.path.join(folder, entry)
+            try:
+                if time.time() - os.path.getmtime(p) > LEASE_STALE:
+                    os.remove(p)    # lecteur disparu sans rendre sa copie
+                else:
+                    fresh = True
+            except OSError:
+                pass
+    return fresh
+
+
+# ---------------- Lectures d'analyse ----------------
+def max_age() -> float:
+    return float(u.get_config("snapshot_max_age_s", SNAPSHOT_MAX_AGE))
+
+_renewing = set()
+
+def _renew(path, limit):
+    """Rafraîchissement en tâche de fond, un seul à la fois par base ; le lecteur ne l'attend pas."""
+    with _locks_lock:
+        if path in _renewing:
+            return
+        _renewing.add(path)
+
+    def run():
+        try:
+            with u.use_garage({"db_path": path}):
+                refresh(path, if_older_than=limit)
+        except Exception:
+            pass                # nouvel essai au prochain lecteur (ou par le Refresher)
+        finally:
+            with _locks_lock:
+                _renewing.discard(path)
+
+    threading.Thread(target=run, name=f"snapshot-renew:{path}", daemon=True).start()
+
+def current(path=None, max_age_s=None):
+    """Copie à lire pour la base : la dernière, renouvelée en arrière-plan si trop ancienne.
+
+    None si les copies sont désactivées (âge limite à 0) ou pas encore faites :
+    lecture sur la base vive.
+    """
+    path = path or u.current_path()
+    if os.path.basename(os.path.dirname(path)) == SNAPSHOT_DIR:
+        return path             # déjà dans un bloc analytics()
+    limit = max_age() if max_age_s is None else max_age_s
+    if limit <= 0 or path == ":memory:":
+        return None
+    snaps = list_snapshots(path)
+    if not snaps or _age(snaps[-1][0]) > limit:
+        _renew(path, limit)
+    return snaps[-1][1] if snaps else None
+
+@contextmanager
+def lease(max_age_s=None):
+    """Copie d'analyse du garage courant (voir current()), protégée de prune() le temps du bloc.
+
+    Ne change pas la base courante : lire par ``u.get_pool(snap, readonly=True)``.
+    None : lecture sur la base vive.
+    """
+    snap = current(max_age_s=max_age_s)
+    with _readers_lock:
+        if snap is not None and os.path.exists(snap):
+            _readers[snap] = _readers.get(snap, 0) + 1
+            if _readers[snap] == 1:
+                # Annonce aux autres processus (prune) ; retirée par le dernier lecteur d'ici
+                open(_lease_file(snap), "w").close()
+        else:
+            snap = None         # supprimée entre-temps : base vive
+    if snap is None:
+        yield None
+        return
+    try:
+        u.get_pool(snap, readonly=True)
+        yield snap
+    finally:
+        with _readers_lock:
+            _readers[snap] -= 1
+            if not _readers[snap]:
+                del _readers[snap]
+                try:
+                    os.remove(_lease_file(snap))
+                except OSError:
+                    pass
+
+@contextmanager
+def analytics(max_age_s=None):
+    """Lectures du bloc routées vers la copie d'analyse du garage courant (voir lease()).
+
+    La copie est ouverte en lecture seule et protégée de prune() le temps du bloc.
+    """
+    with lease(max_age_s) as snap:
+        if snap is None:
+            yield None
+            return
+        with u.use_garage(dict(u.current_garage() or {}, db_path=snap)):
+            yield snap
+
+def status(path=None):
+    """Âge et coût de la dernière copie (page Statistiques) ; None s'il n'y en a pas."""
+    snaps = list_snapshots(path)
+    if not snaps:
+        return None
+    taken, f = snaps[-1]
+    row = u.get_pool(f, readonly=True).connection().execute("SELECT value FROM config WHERE key='snapshot'").fetchone()
+    info = json.loads(row[0]) if row else {}
+    return {**info, "file": f, "bytes": os.path.getsize(f), "age_s": round(_age(taken)), "count": len(snaps)}
+
+
+# ---------------- Rafraîchissement en arrière-plan ----------------
+class Refresher(threading.Thread):
+    """Renouvelle la copie à mi-parcours de l'âge limite : les lecteurs ne l'attendent presque jamais."""
+
+    def __init__(self, path):
+        super().__init__(name=f"snapshot:{path}", daemon=True)
+        self.path = path
+        self.stopping = threading.Event()
+        self.errors = 0
+
+    def run(self):
+        while not self.stopping.is_set():
+            wait = 60.0
+            try:
+                with u.use_garage({"db_path": self.path}):
+                    limit = max_age()
+                    if limit > 0:
+                        snaps = list_snapshots(self.path)
+                        wait = limit / 2 - (_age(snaps[-1][0]) if snaps else limit)
+                        if wait <= 0:
+                            refresh(self.path, if_older_than=limit / 2)
+                            wait = limit / 2
+            except Exception:
+                # Disque plein, base verrouillée… : nouvel essai plus tard
+                self.errors += 1
+            self.stopping.wait(min(max(wait, 1.0), 60.0))
+
+    def stop(self, timeout=5.0):
+        self.stopping.set()
+        self.join(timeout)
+
+_refreshers = {}
+_refreshers_lock = threading.Lock()
+
+def start_refresher(path=None) -> Refresher:
+    """Un seul thread par processus et par base (idempotent)."""
+    path = path or u.current_path()
+    with _refreshers_lock:
+        worker = _refreshers.get(path)
+        if worker is None or not worker.is_alive():
+            worker = _refreshers[path] = Refresher(path)
+            worker.start()
+        return worker
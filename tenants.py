@@ -0,0 +1,161 @@
+"""Réseau de garages partenaires : une base SQLite par garage, un annuaire commun.
+
+    python cli.py garage-add oran "LuxeVidange Oran"
+    python cli.py --garage oran stats-check
+    python cli.py --garage all maintenance
+    python cli.py report
+
+L'annuaire (DB_PATH) garde les comptes clients et la table des garages ; chaque
+garage a ses services, techniciens, paramètres, véhicules et réservations dans
+son propre fichier, donc son propre verrou d'écriture. La base historique reste
+celle du premier garage ("principal").
+"""
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import snapshots
+import utils as u
+
+GARAGES_DIR = "garages"          # à côté de DB_PATH
+MAIN_SLUG = "principal"
+REPORT_WORKERS = 8
+# Durée (s) pendant laquelle un identifiant inconnu n'est plus cherché dans l'annuaire
+MISS_TTL = 5.0
+
+
+# ---------------- Annuaire ----------------
+_COLUMNS = ("id", "slug", "name", "db_path", "active")
+_by_slug = {}
+_misses = {}                     # identifiant inconnu -> instant (monotonic) de la recherche
+_by_slug_lock = threading.Lock()
+
+def list_garages(active_only=True) -> list:
+    rows = u.directory_conn().execute(
+        f"SELECT {', '.join(_COLUMNS)} FROM garages {'WHERE active=1' if active_only else ''} ORDER BY id").fetchall()
+    return [dict(zip(_COLUMNS, r)) for r in rows]
+
+def get_garage(slug):
+    """Garage actif par son identifiant court, base initialisée ; None si inconnu.
+
+    Appelé à chaque requête API : les garages trouvés sont gardés en mémoire, un
+    identifiant inconnu n'est recherché (une ligne) qu'une fois par MISS_TTL.
+    """
+    garage = _by_slug.get(slug)
+    if garage is not None:
+        return garage
+    missed = _misses.get(slug)
+    if missed is not None and time.monotonic() - missed < MISS_TTL:
+        return None
+    row = u.directory_conn().execute(
+        f"SELECT {', '.join(_COLUMNS)} FROM garages WHERE slug=? AND active=1", (slug,)).fetchone()
+    with _by_slug_lock:
+        if row is None:
+            if len(_misses) > 1024:
+                _misses.clear()
+            _misses[slug] = time.monotonic()
+            return None
+        garage = _by_slug.setdefault(slug, dict(zip(_COLUMNS, row)))
+        _misses.pop(slug, None)
+    with u.use_garage(garage):
+        u.ensure_db()
+    return garage
+
+def known_garage(slug):
+    """Garage déjà en mémoire (sans accès disque), sinon None."""
+    return _by_slug.get(slug)
+
+def _garage_path(slug) -> str:
+    return os.path.join(os.path.dirname(u.DB_PATH), GARAGES_DIR, f"{slug}.db")
+
+def create_garage(slug, name, db_path=None) -> dict:
+    """Enregistre un garage et crée sa base (catalogue par défaut, enseigne = nom du garage).
+
+    Le premier appel enregistre aussi la base historique sous MAIN_SLUG.
+    """
+    if not re.fullmatch(r"[a-z0-9][a-z0-9-]{0,31}", slug or ""):
+        raise ValueError("identifiant : minuscules, chiffres et tirets (32 caractères au plus)")
+    db_path = db_path or _garage_path(slug)
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    now = datetime.utcnow().isoformat()
+    with u.directory_transaction() as conn:
+        if conn.execute("SELECT 1 FROM garages WHERE slug=?", (slug,)).fetchone():
+            raise ValueError(f"garage {slug} déjà enregistré")
+        if slug != MAIN_SLUG and not conn.execute("SELECT 1 FROM garages LIMIT 1").fetchone():
+            brand = u.get_config("brand", "LuxeVidange")
+            conn.execute("INSERT INTO garages(slug, name, db_path, created_at) VALUES(?,?,?,?)",
+                         (MAIN_SLUG, brand, u.DB_PATH, now))
+        gid = conn.execute("INSERT INTO garages(slug, name, db_path, created_at) VALUES(?,?,?,?)",
+                           (slug, name, db_path, now)).lastrowid
+    garage = {"id": gid, "slug": slug, "name": name, "db_path": db_path, "active": 1}
+    with u.use_garage(garage):
+        u.ensure_db()
+        u.set_config("brand", name)
+    with _by_slug_lock:
+        _misses.pop(slug, None)
+    return garage
+
+def resolve(spec) -> list:
+    """Garages désignés en ligne de commande : un identifiant, "all", ou rien (base courante)."""
+    if not spec:
+        return [None]
+    if spec == "all":
+        return list_garages() or [None]
+    garage = get_garage(spec)
+    if garage is None:
+        raise ValueError(f"garage inconnu : {spec}")
+    return [garage]
+
+
+# ---------------- Rapports réseau ----------------
+def fan_out(fn, garages=None, workers=REPORT_WORKERS) -> dict:
+    """fn() exécutée dans chaque garage, en parallèle (une connexion par base et par thread).
+
+    SQLite libère le GIL pendant les requêtes : les lectures des différentes bases
+    se recouvrent réellement.
+    """
+    garages = list_garages() if garages is None else garages
+    if not garages:
+        return {}
+
+    def run(garage):
+        with u.use_garage(garage):
+            u.ensure_db()
+            return fn()
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(garages)), thread_name_prefix="garages") as ex:
+        return dict(zip((g["slug"] for g in garages), ex.map(run, garages)))
+
+def _with_note(df):
+    df["note"] = (df["rating_sum"] / df["rating_nb"].where(df["rating_nb"] != 0)).round(2)
+    return df.drop(columns=["rating_sum", "rating_nb"])
+
+def network_stats(garages=None) -> dict:
+    """Activité consolidée du réseau : par garage et par mois (hors annulations).
+
+    Les notes sont recombinées à partir des sommes et effectifs de chaque garage,
+    pas en moyennant des moyennes. Chaque garage est lu sur sa copie d'analyse.
+    """
+    import pandas as pd
+    garages = list_garages() if garages is None else garages
+
+    def monthly():
+        with snapshots.analytics():
+            return u.monthly_stats()
+
+    parts = fan_out(monthly, garages)
+    names = {g["slug"]: g["name"] for g in garages}
+    cols = ["mois", "prestations", "ca_da", "rating_sum", "rating_nb"]
+    frames = [df.assign(garage=slug) for slug, df in parts.items() if not df.empty]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=cols + ["garage"])
+    sums = ["prestations", "ca_da", "rating_sum", "rating_nb"]
+    df[sums] = df[sums].fillna(0).astype("int64")
+
+    by_garage = df.groupby("garage", sort=False)[sums].sum().reindex(list(names), fill_value=0)
+    by_garage = _with_note(by_garage.reset_index())
+    by_garage.insert(1, "nom", by_garage["garage"].map(names))
+    monthly = _with_note(df.groupby("mois")[sums].sum().reset_index())
+    return {"garages": by_garage, "monthly": monthly, "detail": _with_note(df[["garage"] + cols])}
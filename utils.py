@@ -1,243 +1,1423 @@
 import sqlite3
-import hashlib
+import contextvars
 import json
-from datetime import datetime
-import pandas as pd
+import os
+import re
+import threading
+import time
+import urllib.parse
+import weakref
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
 
-DB_PATH = "vidange.db"
+import instrumentation
+import passwords
+
+# Dossier des données (bases, archives, copies, garages, journal des notifications)
+DATA_DIR = os.environ.get("VIDANGE_DATA_DIR", ".")
+DB_PATH = os.path.join(DATA_DIR, "vidange.db")     # annuaire (comptes, garages) et base du premier garage
+
+def data_dir() -> str:
+    """Dossier de l'annuaire : DB_PATH peut être changé après import (cli --db, benchs)."""
+    return os.path.dirname(os.path.abspath(DB_PATH))
+
+# Pragmas appliqués à chaque nouvelle connexion du pool
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("foreign_keys", "ON"),
+    ("busy_timeout", "5000"),
+    ("cache_size", "-16000"),      # ~16 Mo par connexion
+    ("mmap_size", "268435456"),    # 256 Mo
+    ("temp_store", "MEMORY"),
+)
+# Base d'archive (réservations anciennes), attachée à chaque connexion sous le nom "archive"
+ARCHIVE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+)
+
+def archive_path(path=None) -> str:
+    path = path or current_path()
+    if path == ":memory:":
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}_archive{ext or '.db'}"
 
 # ---------------- Base de données ----------------
+class _Lease:
+    """Connexion empruntée par un thread (rendue au pool à la fin du thread)."""
+    __slots__ = ("conn", "depth", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.depth = 0
+
+
+class ConnectionPool:
+    """Pool de connexions SQLite avec affinité par thread.
+
+    Chaque thread garde la même connexion tant qu'il vit ; à sa fin, la
+    connexion retourne dans la réserve et sert au thread suivant (Streamlit
+    démarre un thread par exécution du script). ``readonly`` : fichier ouvert
+    en lecture seule (copie d'analyse), sans pragma persistant ni archive créée.
+    """
+
+    def __init__(self, path, max_idle=16, readonly=False):
+        self.path = path
+        self.max_idle = max_idle
+        self.readonly = readonly
+        self._local = threading.local()
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.readonly:
+            return self._connect_readonly()
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                               cached_statements=256, factory=instrumentation.TimedConnection)
+        for name, value in PRAGMAS:
+            conn.execute(f"PRAGMA {name}={value};")
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path(self.path),))
+        for name, value in ARCHIVE_PRAGMAS:
+            conn.execute(f"PRAGMA archive.{name}={value};")
+        return conn
+
+    def _connect_readonly(self):
+        uri = lambda p: f"file:{urllib.parse.quote(os.path.abspath(p))}?mode=ro"
+        conn = sqlite3.connect(uri(self.path), uri=True, check_same_thread=False, isolation_level=None,
+                               cached_statements=256, factory=instrumentation.TimedConnection)
+        for name, value in PRAGMAS:
+            if name not in ("journal_mode", "synchronous"):
+                conn.execute(f"PRAGMA {name}={value};")
+        # Archive absente : schéma vide, history_tables() s'en tient à la base principale
+        archive = archive_path(self.path)
+        conn.execute("ATTACH DATABASE ? AS archive", (uri(archive) if os.path.exists(archive) else ":memory:",))
+        return conn
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _lease(self):
+        lease = getattr(self._local, "lease", None)
+        if lease is None:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            lease = _Lease(conn or self._connect())
+            weakref.finalize(lease, self._release, lease.conn)
+            self._local.lease = lease
+        return lease
+
+    def connection(self):
+        return self._lease().conn
+
+    @contextmanager
+    def transaction(self):
+        lease = self._lease()
+        conn = lease.conn
+        if lease.depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        else:
+            conn.execute(f"SAVEPOINT sp{lease.depth}")
+        lease.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            lease.depth -= 1
+            if lease.depth == 0:
+                conn.execute("ROLLBACK")
+            else:
+                conn.execute(f"ROLLBACK TO sp{lease.depth}")
+                conn.execute(f"RELEASE sp{lease.depth}")
+            raise
+        lease.depth -= 1
+        if lease.depth == 0:
+            conn.execute("COMMIT")
+        else:
+            conn.execute(f"RELEASE sp{lease.depth}")
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(path=None, readonly=False) -> ConnectionPool:
+    """Pool de la base ; ``readonly`` ne compte qu'à la création du pool (premier appel pour ce fichier)."""
+    path = path or current_path()
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(path, ConnectionPool(path, readonly=readonly))
+    return pool
+
+def drop_pool(path):
+    """Oublie une base qui disparaît (copie d'analyse périmée) : connexions inactives fermées."""
+    with _pools_lock:
+        pool = _pools.pop(path, None)
+        _caches.pop(path, None)
+    if pool is not None:
+        pool.close()
+
 def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
+    """Connexion du thread courant (ne pas la fermer : elle appartient au pool)."""
+    return get_pool().connection()
 
-def hash_pw(pw: str) -> str:
-    return hashlib.sha256(pw.encode("utf-8")).hexdigest()
+@contextmanager
+def transaction():
+    """Transaction en écriture (BEGIN IMMEDIATE) ; imbricable via SAVEPOINT."""
+    with get_pool().transaction() as conn:
+        yield conn
+
+# ---------------- Garages (routage) ----------------
+# Garage courant du contexte (exécution Streamlit, requête API, tâche de tenants.fan_out) ;
+# None : base DB_PATH, comme en mono-garage. get_pool() et donc tous les helpers le suivent.
+_garage = contextvars.ContextVar("garage", default=None)
 
-def init_db():
+def current_path() -> str:
+    garage = _garage.get()
+    return garage["db_path"] if garage else DB_PATH
+
+def current_garage():
+    return _garage.get()
+
+def set_garage(garage):
+    """Garage des appels suivants dans le contexte courant (dict de tenants.list_garages() ou None)."""
+    _garage.set(garage)
+
+@contextmanager
+def use_garage(garage):
+    token = _garage.set(garage)
+    try:
+        yield garage
+    finally:
+        _garage.reset(token)
+
+def directory_conn():
+    """Connexion à l'annuaire (comptes clients, garages), quel que soit le garage courant."""
+    return get_pool(DB_PATH).connection()
+
+@contextmanager
+def directory_transaction():
+    with get_pool(DB_PATH).transaction() as conn:
+        yield conn
+
+def ensure_members(conn, user_ids):
+    """Copie dans la base du garage les comptes de l'annuaire qui n'y figurent pas encore.
+
+    Clés étrangères, jointures (nom du client) et recherche restent locales au
+    garage ; le mot de passe, lui, ne quitte pas l'annuaire.
+    """
+    if current_path() == DB_PATH:
+        return
+    ids = json.dumps([int(i) for i in user_ids])
+    missing = [r[0] for r in conn.execute(
+        "SELECT value FROM json_each(?) WHERE value NOT IN (SELECT id FROM users)", (ids,))]
+    if not missing:
+        return
+    rows = directory_conn().execute(
+        "SELECT id, name, email, phone, created_at FROM users WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(missing),)).fetchall()
+    conn.executemany("INSERT OR IGNORE INTO users(id, name, email, phone, password_hash, created_at) "
+                     "VALUES(?,?,?,?,'!',?)", rows)
+
+# ---------------- Traçage des requêtes ----------------
+_traces = threading.local()
+
+def _on_statement(sql):
+    for queries in _traces.stack:
+        queries.append(sql)
+
+@contextmanager
+def trace_queries():
+    """Requêtes SQL exécutées par le thread courant pendant le bloc (triggers compris).
+
+    Le rappel n'est posé sur la connexion que le temps du traçage : aucun coût
+    hors diagnostic.
+    """
+    stack = _traces.__dict__.setdefault("stack", [])
     conn = get_conn()
-    cur = conn.cursor()
+    queries = []
+    stack.append(queries)
+    conn.set_trace_callback(_on_statement)
+    try:
+        yield queries
+    finally:
+        stack.pop()
+        if not stack:
+            conn.set_trace_callback(None)
 
-    # Utilisateurs
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            phone TEXT,
-            password_hash TEXT NOT NULL,
-            created_at TEXT NOT NULL
-        );
-    """)
+def hash_pw(pw: str) -> str:
+    return passwords.hash_password_bounded(pw)
 
-    # Véhicules
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS vehicles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            make TEXT NOT NULL,
-            model TEXT NOT NULL,
-            plate TEXT NOT NULL,
-            mileage INTEGER,
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-        );
-    """)
+_initialized = set()
+_init_lock = threading.Lock()
 
-    # Catalogue de services
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS services (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            base_price_da INTEGER NOT NULL,
-            duration_min INTEGER DEFAULT 45,
-            category TEXT DEFAULT 'Entretien',
-            active INTEGER DEFAULT 1
-        );
+def ensure_db():
+    """init_db() une seule fois par processus et par base (le script Streamlit est relancé à chaque interaction).
+
+    Initialise l'annuaire et la base du garage courant.
+    """
+    for path in dict.fromkeys((DB_PATH, current_path())):
+        if path in _initialized:
+            continue
+        with _init_lock:
+            if path not in _initialized:
+                init_db(path)
+                _initialized.add(path)
+
+def init_db(path=None):
+    path = path or current_path()
+    with get_pool(path).transaction() as conn:
+        cur = conn.cursor()
+
+        # Utilisateurs
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                phone TEXT,
+                password_hash TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            );
+        """)
+
+        # Véhicules
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS vehicles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                make TEXT NOT NULL,
+                model TEXT NOT NULL,
+                plate TEXT NOT NULL,
+                mileage INTEGER,
+                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+            );
+        """)
+
+        # Catalogue de services
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS services (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                base_price_da INTEGER NOT NULL,
+                duration_min INTEGER DEFAULT 45,
+                category TEXT DEFAULT 'Entretien',
+                active INTEGER DEFAULT 1
+            );
+        """)
+
+        # Paramètres
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS config (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+
+        # Techniciens
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS technicians (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                phone TEXT,
+                active INTEGER DEFAULT 1
+            );
+        """)
+
+        # Réservations
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS bookings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                vehicle_id INTEGER NOT NULL,
+                service_ids TEXT NOT NULL,         -- JSON list of service IDs
+                total_price_da INTEGER NOT NULL,
+                booking_type TEXT NOT NULL,        -- 'atelier' | 'domicile'
+                address TEXT,
+                latitude REAL,
+                longitude REAL,
+                scheduled_at TEXT NOT NULL,
+                status TEXT DEFAULT 'planifié',     -- planifié | en_cours | terminé | annulé
+                technician_id INTEGER,
+                payment_mode TEXT DEFAULT 'sur_place',
+                rating INTEGER,                     -- 1-5
+                notes TEXT,
+                created_at TEXT NOT NULL,
+                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY(vehicle_id) REFERENCES vehicles(id) ON DELETE CASCADE,
+                FOREIGN KEY(technician_id) REFERENCES technicians(id) ON DELETE SET NULL
+            );
+        """)
+
+        # Annuaire : routage des garages (base DB_PATH uniquement)
+        if path == DB_PATH:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS garages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    slug TEXT UNIQUE NOT NULL,
+                    name TEXT NOT NULL,
+                    db_path TEXT NOT NULL,
+                    active INTEGER DEFAULT 1,
+                    created_at TEXT NOT NULL
+                );
+            """)
+
+        _migrate(conn)
+        _repair_bulk_load(conn)
+        _ensure_archive(conn)
+
+        # Seed config si vide
+        cur.execute("SELECT COUNT(*) FROM config;")
+        if cur.fetchone()[0] == 0:
+            cur.executemany("INSERT INTO config(key,value) VALUES(?,?)", [
+                ("domicile_surcharge_da", "3000"),
+                ("brand", "LuxeVidange")
+            ])
+            _bump_cache_version(conn)
+
+        # Seed services si vide
+        cur.execute("SELECT COUNT(*) FROM services;")
+        if cur.fetchone()[0] == 0:
+            cur.executemany(
+                "INSERT INTO services(name, base_price_da, duration_min, category, active) VALUES(?,?,?,?,1)",
+                [
+                    ("Vidange simple", 12000, 45, "Vidange"),
+                    ("Filtre huile", 4000, 15, "Filtres"),
+                    ("Filtre air", 3000, 15, "Filtres"),
+                    ("Filtre carburant", 5000, 25, "Filtres"),
+                    ("Filtre habitacle", 3500, 20, "Filtres"),
+                    ("Lavage extérieur", 1500, 20, "Confort"),
+                    ("Check-up rapide", 2000, 20, "Diagnostic"),
+                ]
+            )
+            _bump_cache_version(conn)
+
+# ---------------- Migrations ----------------
+def _m1_indexes(conn):
+    # Index des requêtes chaudes (listes client/admin, planning, véhicules)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bookings_user_created ON bookings(user_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bookings_created ON bookings(created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bookings_status_sched ON bookings(status, scheduled_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bookings_tech_sched ON bookings(technician_id, scheduled_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vehicles_user ON vehicles(user_id)")
+    conn.execute("ANALYZE")
+
+def _m2_booking_services(conn):
+    # Table de liaison réservation ↔ services (remplace la liste JSON bookings.service_ids)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS booking_services (
+            booking_id INTEGER NOT NULL,
+            service_id INTEGER NOT NULL,
+            price_at_booking_da INTEGER NOT NULL,
+            duration_min INTEGER NOT NULL,
+            PRIMARY KEY(booking_id, service_id),
+            FOREIGN KEY(booking_id) REFERENCES bookings(id) ON DELETE CASCADE,
+            FOREIGN KEY(service_id) REFERENCES services(id)
+        ) WITHOUT ROWID;
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_booking_services_service ON booking_services(service_id, booking_id)")
+    # Reprise des réservations existantes (tarif actuel faute d'historique)
+    conn.execute("""
+        INSERT OR IGNORE INTO booking_services(booking_id, service_id, price_at_booking_da, duration_min)
+        SELECT b.id, s.id, s.base_price_da, COALESCE(s.duration_min, 45)
+        FROM bookings b, json_each(b.service_ids) j
+        JOIN services s ON s.id = CAST(j.value AS INTEGER)
     """)
 
-    # Paramètres
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS config (
-            key TEXT PRIMARY KEY,
-            value TEXT NOT NULL
-        );
+def _m3_scheduled_index(conn):
+    # Pagination admin par (scheduled_at, id) sans filtre
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bookings_sched ON bookings(scheduled_at)")
+
+def _stats_upsert(table, key_cols, key_exprs, row, sign):
+    # Ajoute (sign=1) ou retire (sign=-1) une réservation d'une table d'agrégats
+    return f"""
+        INSERT INTO {table}({", ".join(key_cols)}, nb, revenue_da, rating_sum, rating_nb)
+        VALUES({", ".join(key_exprs)}, {sign}, {sign} * {row}.total_price_da,
+               {sign} * COALESCE({row}.rating, 0), {sign} * ({row}.rating IS NOT NULL))
+        ON CONFLICT({", ".join(key_cols)}) DO UPDATE SET
+            nb = nb + excluded.nb, revenue_da = revenue_da + excluded.revenue_da,
+            rating_sum = rating_sum + excluded.rating_sum, rating_nb = rating_nb + excluded.rating_nb;"""
+
+def _service_stats_upsert(row, sign):
+    return f"""
+        INSERT INTO monthly_service_stats(month, service_id, status, nb, revenue_da)
+        SELECT substr({row}.scheduled_at, 1, 7), bs.service_id, {row}.status, {sign}, {sign} * bs.price_at_booking_da
+        FROM booking_services bs WHERE bs.booking_id = {row}.id
+        ON CONFLICT(month, service_id, status) DO UPDATE SET
+            nb = nb + excluded.nb, revenue_da = revenue_da + excluded.revenue_da;"""
+
+def _booking_stats_sql(row, sign):
+    return (_stats_upsert("daily_stats", ("day", "status", "technician_id"),
+                          (f"substr({row}.scheduled_at, 1, 10)", f"{row}.status", f"COALESCE({row}.technician_id, 0)"),
+                          row, sign)
+            + _stats_upsert("monthly_stats", ("month", "status", "technician_id"),
+                            (f"substr({row}.scheduled_at, 1, 7)", f"{row}.status", f"COALESCE({row}.technician_id, 0)"),
+                            row, sign))
+
+def _m4_stats(conn):
+    # Agrégats maintenus par triggers dans la transaction de chaque écriture
+    for table, period in (("daily_stats", "day"), ("monthly_stats", "month")):
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {period} TEXT NOT NULL,
+                status TEXT NOT NULL,
+                technician_id INTEGER NOT NULL,    -- 0 = non affecté
+                nb INTEGER NOT NULL DEFAULT 0,
+                revenue_da INTEGER NOT NULL DEFAULT 0,
+                rating_sum INTEGER NOT NULL DEFAULT 0,
+                rating_nb INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY({period}, status, technician_id)
+            ) WITHOUT ROWID;
+        """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS monthly_service_stats (
+            month TEXT NOT NULL,
+            service_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            nb INTEGER NOT NULL DEFAULT 0,
+            revenue_da INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(month, service_id, status)
+        ) WITHOUT ROWID;
     """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_bookings_insert AFTER INSERT ON bookings
+        BEGIN {_booking_stats_sql("NEW", 1)}
+        END;""")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_bookings_update
+        AFTER UPDATE OF status, technician_id, rating, total_price_da, scheduled_at ON bookings
+        BEGIN {_booking_stats_sql("OLD", -1)} {_booking_stats_sql("NEW", 1)}
+        END;""")
+    _stats_delete_trigger(conn)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_services_status
+        AFTER UPDATE OF status, scheduled_at ON bookings
+        BEGIN {_service_stats_upsert("OLD", -1)} {_service_stats_upsert("NEW", 1)}
+        END;""")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_booking_services_insert AFTER INSERT ON booking_services
+        BEGIN
+            INSERT INTO monthly_service_stats(month, service_id, status, nb, revenue_da)
+            SELECT substr(b.scheduled_at, 1, 7), NEW.service_id, b.status, 1, NEW.price_at_booking_da
+            FROM bookings b WHERE b.id = NEW.booking_id
+            ON CONFLICT(month, service_id, status) DO UPDATE SET
+                nb = nb + excluded.nb, revenue_da = revenue_da + excluded.revenue_da;
+        END;""")
+    rebuild_stats(conn)
 
-    # Techniciens
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS technicians (
+# Archivage (_archive_batch) : la ligne "archiving" de config, posée et retirée dans la
+# transaction du lot, fait garder l'historique aux agrégats sans toucher au schéma
+_ARCHIVING_KEY = "archiving"
+
+def _stats_delete_trigger(conn):
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_bookings_delete BEFORE DELETE ON bookings
+        WHEN NOT EXISTS (SELECT 1 FROM config WHERE key='{_ARCHIVING_KEY}')
+        BEGIN {_booking_stats_sql("OLD", -1)} {_service_stats_upsert("OLD", -1)}
+        END;""")
+
+def _m5_outbox(conn):
+    # Notifications à envoyer, écrites dans la transaction de l'événement ; dates en secondes epoch
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            phone TEXT,
-            active INTEGER DEFAULT 1
+            event TEXT NOT NULL,               -- confirmation | statut | annulation
+            booking_id INTEGER,
+            channel TEXT NOT NULL,             -- email | sms
+            recipient TEXT NOT NULL,
+            payload TEXT NOT NULL,             -- JSON
+            status TEXT NOT NULL DEFAULT 'pending',  -- pending | sent | failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            sent_at REAL,
+            last_error TEXT
         );
     """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_sent ON outbox(sent_at) WHERE status = 'sent'")
+
+def _m6_booking_version(conn):
+    # Compteur de modifications pour les mises à jour conditionnelles (voir booking_state)
+    conn.execute("ALTER TABLE bookings ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
 
-    # Réservations
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS bookings (
+def _m7_mileage(conn):
+    # Historique des relevés kilométriques (vehicles.mileage ne garde que le dernier)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS mileage_readings (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
             vehicle_id INTEGER NOT NULL,
-            service_ids TEXT NOT NULL,         -- JSON list of service IDs
-            total_price_da INTEGER NOT NULL,
-            booking_type TEXT NOT NULL,        -- 'atelier' | 'domicile'
-            address TEXT,
-            latitude REAL,
-            longitude REAL,
-            scheduled_at TEXT NOT NULL,
-            status TEXT DEFAULT 'planifié',     -- planifié | en_cours | terminé | annulé
-            technician_id INTEGER,
-            payment_mode TEXT DEFAULT 'sur_place',
-            rating INTEGER,                     -- 1-5
-            notes TEXT,
-            created_at TEXT NOT NULL,
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
-            FOREIGN KEY(vehicle_id) REFERENCES vehicles(id) ON DELETE CASCADE,
-            FOREIGN KEY(technician_id) REFERENCES technicians(id) ON DELETE SET NULL
+            mileage INTEGER NOT NULL,
+            read_at TEXT NOT NULL,
+            source TEXT NOT NULL,              -- vehicule | reservation | import
+            booking_id INTEGER,
+            FOREIGN KEY(vehicle_id) REFERENCES vehicles(id) ON DELETE CASCADE
         );
     """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_mileage_vehicle ON mileage_readings(vehicle_id, read_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_mileage_booking ON mileage_readings(booking_id) WHERE booking_id IS NOT NULL")
+    # Prochaines échéances par catégorie, recalculées chaque nuit (maintenance.run_nightly)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS maintenance_due (
+            vehicle_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            due_date TEXT NOT NULL,
+            due_km INTEGER,
+            km_per_day REAL NOT NULL,
+            last_service_at TEXT,
+            computed_at TEXT NOT NULL,
+            PRIMARY KEY(vehicle_id, category)
+        ) WITHOUT ROWID;
+    """)
+    conn.execute("""INSERT INTO mileage_readings(vehicle_id, mileage, read_at, source)
+                    SELECT id, mileage, ?, 'vehicule' FROM vehicles WHERE mileage > 0""",
+                 (datetime.utcnow().isoformat(timespec="seconds"),))
 
-    conn.commit()
-
-    # Seed config si vide
-    cur.execute("SELECT COUNT(*) FROM config;")
-    if cur.fetchone()[0] == 0:
-        cur.executemany("INSERT INTO config(key,value) VALUES(?,?)", [
-            ("domicile_surcharge_da", "3000"),
-            ("brand", "LuxeVidange")
-        ])
-
-    # Seed services si vide
-    cur.execute("SELECT COUNT(*) FROM services;")
-    if cur.fetchone()[0] == 0:
-        cur.executemany(
-            "INSERT INTO services(name, base_price_da, duration_min, category, active) VALUES(?,?,?,?,1)",
-            [
-                ("Vidange simple", 12000, 45, "Vidange"),
-                ("Filtre huile", 4000, 15, "Filtres"),
-                ("Filtre air", 3000, 15, "Filtres"),
-                ("Filtre carburant", 5000, 25, "Filtres"),
-                ("Filtre habitacle", 3500, 20, "Filtres"),
-                ("Lavage extérieur", 1500, 20, "Confort"),
-                ("Check-up rapide", 2000, 20, "Diagnostic"),
-            ]
-        )
+# Recherche plein texte : un seul index FTS5, rowid = (type << 40) + id, trié clients puis
+# véhicules puis réservations (rowid décroissant), les plus récents d'abord dans chaque type
+SEARCH_KINDS = {3: "client", 2: "véhicule", 1: "réservation"}
+SEARCH_SHIFT = 40
+_DIGITS = lambda col: f"replace(replace(replace(COALESCE({col}, ''), ' ', ''), '-', ''), '.', '')"
+_SEARCH_SOURCES = {
+    # table : (type, texte indexé, colonnes surveillées)
+    "users": (3, f"NEW.name || ' ' || NEW.email || ' ' || COALESCE(NEW.phone, '') || ' ' || {_DIGITS('NEW.phone')}",
+              "name, email, phone"),
+    "vehicles": (2, f"COALESCE(NEW.make, '') || ' ' || COALESCE(NEW.model, '') || ' ' || COALESCE(NEW.plate, '') "
+                    f"|| ' ' || {_DIGITS('NEW.plate')}", "make, model, plate"),
+    "bookings": (1, "TRIM(COALESCE(NEW.address, '') || ' ' || COALESCE(NEW.notes, ''))", "address, notes"),
+}
+
+def _m8_search(conn):
+    # Un index de préfixe par longueur saisie : sans lui, "client"* fusionne toute la liste
+    # des documents avant de trier ; detail=column car aucune recherche de phrase
+    conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+                        body, tokenize='unicode61 remove_diacritics 2', prefix='2 3 4 5 6 7 8', detail=column)""")
+    for table, (kind, body, columns) in _SEARCH_SOURCES.items():
+        key = f"({kind} << {SEARCH_SHIFT}) + NEW.id"
+        insert = f"INSERT INTO search_index(rowid, body) SELECT {key}, {body} WHERE {body} != '';"
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_search_{table}_insert AFTER INSERT ON {table} BEGIN {insert} END;")
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_search_{table}_update AFTER UPDATE OF {columns} ON {table}
+                         BEGIN DELETE FROM search_index WHERE rowid = {key}; {insert} END;""")
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_search_{table}_delete AFTER DELETE ON {table}
+                         BEGIN DELETE FROM search_index WHERE rowid = ({kind} << {SEARCH_SHIFT}) + OLD.id; END;""")
+    rebuild_search_index(conn)
+
+def _m9_email_case(conn):
+    # Emails en minuscules, comme normalize_email() ; deux comptes ne différant que
+    # par la casse restent tels quels (l'un des deux ne se connecte plus qu'à l'identique)
+    conn.execute("""UPDATE users SET email = lower(trim(email))
+                    WHERE email != lower(trim(email))
+                      AND lower(trim(email)) NOT IN (SELECT email FROM users)""")
+
+def _m10_archive_guard(conn):
+    # Trigger de suppression gardé par un drapeau plutôt que supprimé / recréé à chaque lot archivé
+    conn.execute("DROP TRIGGER IF EXISTS trg_stats_bookings_delete")
+    _stats_delete_trigger(conn)
+
+def _repair_bulk_load(conn):
+    # Fin de bulk_load(), ou chargement interrompu (processus tué) : index différés
+    # et triggers d'agrégats manquants recréés, agrégats recalculés
+    pending = conn.execute("SELECT value FROM config WHERE key='bulk_load_indexes'").fetchone()
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger')")}
+    for name, sql in json.loads(pending[0]) if pending else ():
+        if name not in existing:
+            conn.execute(sql)
+    conn.execute("DELETE FROM config WHERE key='bulk_load_indexes'")
+    if not existing.issuperset(_STATS_TRIGGERS):
+        _m4_stats(conn)
+
+# MIGRATIONS[i] fait passer PRAGMA user_version de i à i+1 : ajouter en fin de liste uniquement.
+MIGRATIONS = [
+    _m1_indexes,
+    _m2_booking_services,
+    _m3_scheduled_index,
+    _m4_stats,
+    _m5_outbox,
+    _m6_booking_version,
+    _m7_mileage,
+    _m8_search,
+    _m9_email_case,
+    _m10_archive_guard,
+]
+
+def schema_version(conn=None) -> int:
+    return (conn or get_conn()).execute("PRAGMA user_version").fetchone()[0]
+
+def _migrate(conn):
+    version = schema_version(conn)
+    for i, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        step(conn)
+        conn.execute(f"PRAGMA user_version={i}")
+
+# Réservations avec libellés des services (une sous-requête indexée par ligne),
+# nom du client et immatriculation (jointures par clé primaire)
+def _bookings_select(bookings="bookings", booking_services=("booking_services",)):
+    # Une sous-requête par table de services (base chaude, archive) : chacune reste une recherche par clé
+    services = ", ".join(f"""(SELECT GROUP_CONCAT(s.name || ' (' || bs.price_at_booking_da || ' DA)', ', ')
+            FROM {table} bs JOIN services s ON s.id = bs.service_id
+            WHERE bs.booking_id = b.id)""" for table in booking_services)
+    if len(booking_services) > 1:
+        services = f"COALESCE({services})"
+    return f"""
+    SELECT b.*, cu.name AS client_name, v.plate,
+           {services} AS services
+    FROM {bookings} b
+    LEFT JOIN users cu ON cu.id = b.user_id
+    LEFT JOIN vehicles v ON v.id = b.vehicle_id"""
+
+_BOOKINGS_SELECT = _bookings_select()
+
+# Requêtes chaudes contrôlées par audit_query_plans() (paramètres factices)
+HOT_QUERIES = {
+    "get_user_by_email": ("SELECT id, name, email, phone, password_hash FROM users WHERE email=?", ("x",)),
+    "user_vehicles": ("SELECT id, user_id, make, model, plate, mileage FROM vehicles WHERE user_id=? ORDER BY id", (1,)),
+    "list_bookings(user_id)": (_BOOKINGS_SELECT + " WHERE b.user_id=? ORDER BY b.created_at DESC, b.id DESC", (1,)),
+    "list_bookings()": (_BOOKINGS_SELECT + " ORDER BY b.created_at DESC, b.id DESC", ()),
+    "bookings_by_status": ("SELECT * FROM bookings WHERE status=? AND scheduled_at>=? ORDER BY scheduled_at", ("planifié", "")),
+    "list_bookings_page()": (_BOOKINGS_SELECT + " WHERE (b.scheduled_at, b.id) < (?, ?) ORDER BY b.scheduled_at DESC, b.id DESC LIMIT 50", ("", 0)),
+    "bookings_by_technician": ("SELECT id, scheduled_at FROM bookings WHERE technician_id=? AND scheduled_at BETWEEN ? AND ? ORDER BY scheduled_at", (1, "", "")),
+    "get_config": ("SELECT value FROM config WHERE key=?", ("brand",)),
+    "outbox_due": ("SELECT id FROM outbox WHERE status='pending' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT 50", (0,)),
+}
+
+def audit_query_plans(conn=None) -> dict:
+    """EXPLAIN QUERY PLAN des requêtes chaudes ; renvoie {nom: [étapes fautives]}.
+
+    Une étape est fautive si elle parcourt une table sans index ("SCAN t")
+    ou trie en mémoire ("USE TEMP B-TREE").
+    """
+    conn = conn or get_conn()
+    issues = {}
+    for name, (q, params) in HOT_QUERIES.items():
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + q, params)]
+        bad = [d for d in plan
+               if (d.startswith("SCAN ") and " USING " not in d) or "TEMP B-TREE" in d]
+        if bad:
+            issues[name] = bad
+    return issues
+
+# ---------------- Lignes ----------------
+# Pages client : n-uplets nommés (sans dictionnaire par ligne) ; pandas n'est
+# importé que par le back-office, via frame().
+class Service(namedtuple("Service", "id name base_price_da duration_min category active")):
+    __slots__ = ()
+
+    @property
+    def label(self) -> str:
+        return f"{self.name} — {self.base_price_da} DA"
+
+class Technician(namedtuple("Technician", "id name phone active")):
+    __slots__ = ()
+
+class Vehicle(namedtuple("Vehicle", "id user_id make model plate mileage")):
+    __slots__ = ()
+
+    @property
+    def label(self) -> str:
+        return f"#{self.id} - {self.make} {self.model} ({self.plate})"
+
+class Booking(namedtuple("Booking", "id scheduled_at booking_type services total_price_da status payment_mode rating")):
+    __slots__ = ()
+
+    @property
+    def when(self) -> str:
+        return self.scheduled_at[:16].replace("T", " ")
+
+class BookingDetail(namedtuple("BookingDetail", "id vehicle_id plate scheduled_at booking_type services total_price_da "
+                                                "status technician_id payment_mode address rating created_at")):
+    __slots__ = ()
+
+def fetch(cls, sql, params=(), conn=None) -> list:
+    """Résultat de ``sql`` en lignes ``cls`` (colonnes dans l'ordre des champs)."""
+    cur = (conn or get_conn()).cursor()
+    cur.row_factory = lambda _, row: cls._make(row)
+    return cur.execute(sql, params).fetchall()
 
-    conn.commit()
-    conn.close()
+def frame(rows, cls) -> "pd.DataFrame":
+    """Lignes en DataFrame, avec les types que donnerait pd.read_sql_query."""
+    import pandas as pd
+    return pd.DataFrame.from_records(rows, columns=cls._fields, coerce_float=True)
+
+# ---------------- Cache catalogue & paramètres ----------------
+# Intervalle minimal entre deux lectures de config.cache_version (cohérence multi-processus)
+CACHE_CHECK_INTERVAL = 1.0
+
+class CatalogCache:
+    """Catalogue des services, techniciens et table config, partagés par toutes les sessions.
+
+    Toute écriture incrémente config.cache_version dans la même transaction ;
+    chaque processus compare sa version à celle de la base (au plus une fois
+    par CACHE_CHECK_INTERVAL) et recharge si elle a changé.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+        self._checked = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _load(conn):
+        services = fetch(Service, "SELECT id, name, base_price_da, duration_min, category, active FROM services ORDER BY id",
+                         conn=conn)
+        active = [s for s in services if s.active == 1]
+        lookup = {s.id: f"{s.name} ({s.base_price_da} DA)" for s in services}
+        config = dict(conn.execute("SELECT key, value FROM config").fetchall())
+        quote = QuoteEngine(active, int(config.get("domicile_surcharge_da", "3000")))
+        technicians = fetch(Technician, "SELECT id, name, phone, active FROM technicians ORDER BY id", conn=conn)
+        return {"services": services, "active": active, "lookup": lookup, "config": config, "quote": quote,
+                "technicians": technicians}
+
+    def get(self):
+        now = time.monotonic()
+        data = self._data
+        if data is not None and now - self._checked < CACHE_CHECK_INTERVAL:
+            self.hits += 1
+            return data
+        conn = get_conn()
+        row = conn.execute("SELECT value FROM config WHERE key='cache_version'").fetchone()
+        version = row[0] if row else None
+        with self._lock:
+            if self._data is None or version != self._version:
+                self.misses += 1
+                self._data = self._load(conn)
+                self._version = version
+            else:
+                self.hits += 1
+            self._checked = now
+            return self._data
+
+    def invalidate(self):
+        # Force une vérification de version au prochain accès
+        self._checked = 0.0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "version": self._version,
+                "hit_rate": round(self.hits / total, 4) if total else None}
+
+
+_caches = {}
+
+def get_cache(path=None) -> CatalogCache:
+    path = path or current_path()
+    cache = _caches.get(path)
+    if cache is None:
+        with _pools_lock:
+            cache = _caches.setdefault(path, CatalogCache())
+    return cache
+
+def _bump_cache_version(conn):
+    conn.execute("""INSERT INTO config(key,value) VALUES('cache_version','1')
+                    ON CONFLICT(key) DO UPDATE SET value=CAST(value AS INTEGER)+1""")
+
+@contextmanager
+def catalog_transaction():
+    """Transaction modifiant services/techniciens/config : publie une nouvelle version du cache."""
+    with transaction() as conn:
+        yield conn
+        _bump_cache_version(conn)
+    get_cache().invalidate()
+
+def cache_stats() -> dict:
+    return get_cache().stats()
 
 # ---------------- Paramètres & Services ----------------
 def get_config(key: str, default=None):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT value FROM config WHERE key=?", (key,))
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else default
+    return get_cache().get()["config"].get(key, default)
 
 def set_config(key: str, value: str):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO config(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value;",
-        (key, value)
-    )
-    conn.commit()
-    conn.close()
-
-def get_services(active_only=True) -> pd.DataFrame:
-    conn = get_conn()
-    q = "SELECT id, name, base_price_da, duration_min, category, active FROM services"
-    if active_only:
-        q += " WHERE active=1"
-    df = pd.read_sql_query(q, conn)
-    conn.close()
-    return df
+    with catalog_transaction() as conn:
+        conn.execute(
+            "INSERT INTO config(key,value) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET value=excluded.value;",
+            (key, value)
+        )
+
+def service_rows(active_only=True) -> list:
+    """Services du catalogue en cache (liste partagée : ne pas la modifier)."""
+    data = get_cache().get()
+    return data["active"] if active_only else data["services"]
+
+def get_services(active_only=True) -> "pd.DataFrame":
+    return frame(service_rows(active_only), Service)
+
+def create_service(name, base_price_da, duration_min, category):
+    with catalog_transaction() as conn:
+        conn.execute("INSERT INTO services(name, base_price_da, duration_min, category, active) VALUES(?,?,?,?,1)",
+                     (name, int(base_price_da), int(duration_min), category))
+
+def update_service(service_id, name, base_price_da, duration_min, category):
+    with catalog_transaction() as conn:
+        conn.execute("UPDATE services SET name=?, base_price_da=?, duration_min=?, category=? WHERE id=?",
+                     (name, int(base_price_da), int(duration_min), category, int(service_id)))
+
+def set_service_active(service_id, active):
+    with catalog_transaction() as conn:
+        conn.execute("UPDATE services SET active=? WHERE id=?", (1 if active else 0, int(service_id)))
 
 def services_lookup() -> dict:
-    df = get_services(active_only=False)
-    return {int(r.id): f"{r.name} ({r.base_price_da} DA)" for _, r in df.iterrows()}
+    return get_cache().get()["lookup"]
 
 def get_service_names(ids):
     lookup = services_lookup()
     return [lookup.get(int(i), f"#{i}") for i in ids]
 
+# ---------------- Techniciens ----------------
+def get_technicians(active_only=False) -> "pd.DataFrame":
+    rows = get_cache().get()["technicians"]
+    return frame([t for t in rows if t.active == 1] if active_only else rows, Technician)
+
+def create_technician(name, phone):
+    with catalog_transaction() as conn:
+        conn.execute("INSERT INTO technicians(name, phone, active) VALUES(?,?,1)", (name, phone))
+
 # ---------------- Utilisateurs & Véhicules ----------------
+# Comptes : toujours dans l'annuaire ; les bases de garage n'en ont qu'une copie (ensure_members)
+def normalize_email(email) -> str:
+    """Forme stockée et cherchée des emails (connexion insensible à la casse, UI comme API)."""
+    return str(email or "").strip().lower()
+
 def get_user_by_email(email: str):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, email, phone, password_hash FROM users WHERE email=?", (email,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+    return directory_conn().execute(
+        "SELECT id, name, email, phone, password_hash FROM users WHERE email=?", (normalize_email(email),)
+    ).fetchone()
 
 def create_user(name, email, phone, password):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""INSERT INTO users(name, email, phone, password_hash, created_at)
-                   VALUES(?,?,?,?,?)""",
-                (name, email, phone, hash_pw(password), datetime.utcnow().isoformat()))
-    conn.commit()
-    conn.close()
-
-def authenticate(email, password):
+    """Lève passwords.PasswordBusy si le calcul du hachage est saturé."""
+    # Hachage avant BEGIN IMMEDIATE : le KDF ne retient pas le verrou d'écriture de l'annuaire
+    pw_hash = hash_pw(password)
+    with directory_transaction() as conn:
+        conn.execute("""INSERT INTO users(name, email, phone, password_hash, created_at)
+                        VALUES(?,?,?,?,?)""",
+                     (name, normalize_email(email), phone, pw_hash, datetime.utcnow().isoformat()))
+
+def authenticate(email, password, ip=None):
+    """Utilisateur authentifié ou None ; lève passwords.LoginRateLimited / PasswordBusy."""
+    email = normalize_email(email)
+    passwords.check_login_rate(email, ip)
     row = get_user_by_email(email)
-    if not row:
+    # Email inconnu : même coût de vérification pour ne rien révéler
+    stored = row[4] if row else passwords.dummy_hash()
+    if not passwords.verify_password_bounded(password, stored) or not row:
         return None
     uid, name, em, phone, pw_hash = row
-    if pw_hash == hash_pw(password):
-        return {"id": uid, "name": name, "email": em, "phone": phone}
-    return None
+    if passwords.needs_rehash(pw_hash):
+        try:
+            new_hash = hash_pw(password)
+        except passwords.PasswordBusy:
+            new_hash = None         # mise à niveau remise à la prochaine connexion
+        if new_hash:
+            with directory_transaction() as conn:
+                conn.execute("UPDATE users SET password_hash=? WHERE id=? AND password_hash=?",
+                             (new_hash, uid, pw_hash))
+    passwords.login_succeeded(email)
+    return {"id": uid, "name": name, "email": em, "phone": phone}
 
-def get_user_vehicles(user_id) -> pd.DataFrame:
-    conn = get_conn()
-    df = pd.read_sql_query("SELECT * FROM vehicles WHERE user_id=?", conn, params=(user_id,))
-    conn.close()
-    return df
+def user_vehicles(user_id) -> list:
+    return fetch(Vehicle, "SELECT id, user_id, make, model, plate, mileage FROM vehicles WHERE user_id=? ORDER BY id",
+                 (user_id,))
+
+def get_user_vehicles(user_id) -> "pd.DataFrame":
+    return frame(user_vehicles(user_id), Vehicle)
 
 def upsert_vehicle(user_id, make, model, plate, mileage, vehicle_id=None):
-    conn = get_conn()
-    cur = conn.cursor()
-    if vehicle_id:
-        cur.execute("""UPDATE vehicles SET make=?, model=?, plate=?, mileage=?
-                       WHERE id=? AND user_id=?""", (make, model, plate, mileage, vehicle_id, user_id))
-    else:
-        cur.execute("""INSERT INTO vehicles(user_id, make, model, plate, mileage)
-                       VALUES(?,?,?,?,?)""", (user_id, make, model, plate, mileage))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        ensure_members(conn, [user_id])
+        if vehicle_id:
+            row = conn.execute("SELECT mileage FROM vehicles WHERE id=? AND user_id=?", (vehicle_id, user_id)).fetchone()
+            if row is None:
+                return
+            conn.execute("""UPDATE vehicles SET make=?, model=?, plate=?, mileage=?
+                            WHERE id=? AND user_id=?""", (make, model, plate, mileage, vehicle_id, user_id))
+            if mileage != row[0]:
+                record_mileage(conn, vehicle_id, mileage, "vehicule")
+            return vehicle_id
+        else:
+            cur = conn.execute("""INSERT INTO vehicles(user_id, make, model, plate, mileage)
+                                  VALUES(?,?,?,?,?)""", (user_id, make, model, plate, mileage))
+            record_mileage(conn, cur.lastrowid, mileage, "vehicule")
+            return cur.lastrowid
+
+def record_mileage(conn, vehicle_id, mileage, source, booking_id=None, read_at=None):
+    """Ajoute un relevé à l'historique (kilométrage nul ou absent ignoré)."""
+    if not mileage or int(mileage) <= 0:
+        return
+    conn.execute("INSERT INTO mileage_readings(vehicle_id, mileage, read_at, source, booking_id) VALUES(?,?,?,?,?)",
+                 (int(vehicle_id), int(mileage), read_at or datetime.utcnow().isoformat(timespec="seconds"),
+                  source, booking_id))
 
 # ---------------- Devis & Réservations ----------------
+class QuoteEngine:
+    """Table de prix/durées des services actifs, indexée par ID.
+
+    Construite une fois par version du catalogue (voir CatalogCache) ;
+    ``quote`` est en O(k) pour k services, en Python pur ; ``price_batch``
+    chiffre des milliers de combinaisons en une multiplication matricielle.
+    """
+
+    def __init__(self, services, domicile_surcharge_da: int):
+        services = sorted(services, key=lambda s: s.id)
+        self.ids = [int(s.id) for s in services]
+        self.prices = [int(s.base_price_da) for s in services]
+        self.durations = [45 if s.duration_min is None else int(s.duration_min) for s in services]
+        self.domicile_surcharge_da = int(domicile_surcharge_da)
+        self._index = {i: k for k, i in enumerate(self.ids)}
+
+    def surcharge(self, booking_type) -> int:
+        return self.domicile_surcharge_da if booking_type == "domicile" else 0
+
+    def quote(self, service_ids, booking_type):
+        """(total, base, surcharge, durée en minutes) ; les IDs inconnus/inactifs sont ignorés."""
+        idx = [k for k in map(self._index.get, dict.fromkeys(int(i) for i in service_ids)) if k is not None]
+        base = sum(self.prices[k] for k in idx)
+        surcharge = self.surcharge(booking_type)
+        return base + surcharge, base, surcharge, sum(self.durations[k] for k in idx)
+
+    def mask(self, combos) -> "np.ndarray":
+        """Matrice booléenne (n combinaisons × n services) à partir de listes d'IDs."""
+        import numpy as np
+        ids = np.asarray(self.ids, dtype=np.int64)
+        rows = np.repeat(np.arange(len(combos)), [len(c) for c in combos])
+        flat = np.fromiter((int(i) for c in combos for i in c), dtype=np.int64, count=len(rows))
+        pos = np.searchsorted(ids, flat)
+        pos = np.minimum(pos, max(len(ids) - 1, 0))
+        known = (ids[pos] == flat) if len(ids) else np.zeros(len(flat), dtype=bool)
+        m = np.zeros((len(combos), len(ids)), dtype=bool)
+        m[rows[known], pos[known]] = True
+        return m
+
+    def price_batch(self, combos, booking_type="atelier"):
+        """Chiffre n combinaisons d'un coup.
+
+        ``combos`` : liste de listes d'IDs ou matrice booléenne déjà alignée
+        sur ``self.ids``. Renvoie (totaux, bases, durées) en tableaux NumPy.
+        """
+        import numpy as np
+        m = combos if isinstance(combos, np.ndarray) else self.mask(combos)
+        m = m.astype(np.int64, copy=False)
+        base = m @ np.asarray(self.prices, dtype=np.int64)
+        return base + self.surcharge(booking_type), base, m @ np.asarray(self.durations, dtype=np.int64)
+
+
+def quote_engine() -> QuoteEngine:
+    return get_cache().get()["quote"]
+
 def calc_quote(selected_service_ids, booking_type):
-    df = get_services(active_only=True)
-    df_sel = df[df["id"].isin(selected_service_ids)]
-    base = int(df_sel["base_price_da"].sum()) if not df_sel.empty else 0
-    surcharge = int(get_config("domicile_surcharge_da", "3000")) if booking_type == "domicile" else 0
-    return base + surcharge, base, surcharge
+    total, base, surcharge, _ = quote_engine().quote(selected_service_ids, booking_type)
+    return total, base, surcharge
+
+def quote_duration(selected_service_ids) -> int:
+    return quote_engine().quote(selected_service_ids, "atelier")[3]
+
+PAYMENT_MODES = ("sur_place",)
 
 def create_booking(user_id, vehicle_id, service_ids, total_price_da, booking_type,
-                   address, latitude, longitude, scheduled_dt, payment_mode="sur_place"):
+                   address, latitude, longitude, scheduled_dt, payment_mode="sur_place", technician_id=None,
+                   mileage=None):
+    """Lève ValueError si un service est inconnu ou retiré du catalogue."""
+    active = {s.id for s in service_rows()}
+    unknown = [sid for sid in service_ids if int(sid) not in active]
+    if unknown:
+        raise ValueError(f"services inconnus ou inactifs : {unknown}")
+    with transaction() as conn:
+        ensure_members(conn, [user_id])
+        cur = conn.execute("""INSERT INTO bookings(
+                user_id, vehicle_id, service_ids, total_price_da, booking_type,
+                address, latitude, longitude, scheduled_at, status, technician_id, payment_mode, created_at
+            ) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+            (user_id, vehicle_id, json.dumps(service_ids), total_price_da, booking_type,
+             address, latitude, longitude, scheduled_dt.isoformat(), "planifié", technician_id, payment_mode,
+             datetime.utcnow().isoformat())
+        )
+        bid = cur.lastrowid
+        conn.executemany("""INSERT INTO booking_services(booking_id, service_id, price_at_booking_da, duration_min)
+                            SELECT ?, id, base_price_da, COALESCE(duration_min, 45) FROM services
+                            WHERE id=? AND active=1""",
+                         [(bid, int(sid)) for sid in dict.fromkeys(service_ids)])
+        if mileage:
+            record_mileage(conn, vehicle_id, mileage, "reservation", booking_id=bid)
+            conn.execute("UPDATE vehicles SET mileage=MAX(COALESCE(mileage, 0), ?) WHERE id=?", (int(mileage), vehicle_id))
+        enqueue_notification(conn, "confirmation", bid)
+        return bid
+
+# ---------------- Notifications (outbox) ----------------
+# Un message par canal ; le SMS seulement si le client a renseigné un téléphone
+_ENQUEUE_SQL = """
+    INSERT INTO outbox(event, booking_id, channel, recipient, payload, next_attempt_at, created_at)
+    SELECT :event, b.id, c.channel, CASE c.channel WHEN 'sms' THEN u.phone ELSE u.email END,
+           json_object('nom', u.name, 'booking_id', b.id, 'date', b.scheduled_at, 'statut', b.status,
+                       'total_da', b.total_price_da, 'lieu', b.booking_type),
+           :now, :now
+    FROM bookings b JOIN users u ON u.id = b.user_id
+    JOIN (SELECT 'email' AS channel UNION ALL SELECT 'sms') c
+      ON c.channel = 'email' OR COALESCE(TRIM(u.phone), '') != ''
+    WHERE b.id = :booking_id"""
+
+def enqueue_notification(conn, event, booking_id):
+    """À appeler dans la transaction qui modifie la réservation : le message part si et seulement si elle est validée."""
+    enqueue_notifications(conn, event, [booking_id])
+
+def enqueue_notifications(conn, event, booking_ids):
+    now = time.time()
+    conn.executemany(_ENQUEUE_SQL, ({"event": event, "booking_id": int(b), "now": now} for b in booking_ids))
+
+def _bookings_source(conn, history):
+    if history and history_tables(conn)[0] != "bookings":
+        return _bookings_select("bookings_all", ("main.booking_services", "archive.booking_services"))
+    return _BOOKINGS_SELECT
+
+def user_bookings(user_id, history=False, row=Booking) -> list:
+    """Réservations d'un client (page Mes rendez-vous ; ``row=BookingDetail`` pour l'API), les plus récentes en tête."""
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""INSERT INTO bookings(
-            user_id, vehicle_id, service_ids, total_price_da, booking_type,
-            address, latitude, longitude, scheduled_at, status, payment_mode, created_at
-        ) VALUES(?,?,?,?,?,?,?,?,?,?,?,?)""",
-        (user_id, vehicle_id, json.dumps(service_ids), total_price_da, booking_type,
-         address, latitude, longitude, scheduled_dt.isoformat(), "planifié", payment_mode, datetime.utcnow().isoformat())
-    )
-    conn.commit()
-    bid = cur.lastrowid
-    conn.close()
-    return bid
-
-def list_bookings(user_id=None) -> pd.DataFrame:
+    return fetch(row, f"""SELECT {', '.join(row._fields)}
+                              FROM ({_bookings_source(conn, history)} WHERE b.user_id=?)
+                              ORDER BY created_at DESC, id DESC""", (user_id,), conn)
+
+def list_bookings(user_id=None, history=False) -> "pd.DataFrame":
+    """Réservations de la base chaude ; ``history=True`` ajoute celles déjà archivées."""
+    import pandas as pd
     conn = get_conn()
+    select = _bookings_source(conn, history)
     if user_id:
-        df = pd.read_sql_query("SELECT * FROM bookings WHERE user_id=? ORDER BY datetime(created_at) DESC", conn, params=(user_id,))
-    else:
-        df = pd.read_sql_query("SELECT * FROM bookings ORDER BY datetime(created_at) DESC", conn)
-    conn.close()
+        return pd.read_sql_query(select + " WHERE b.user_id=? ORDER BY b.created_at DESC, b.id DESC",
+                                 conn, params=(user_id,))
+    return pd.read_sql_query(select + " ORDER BY b.created_at DESC, b.id DESC", conn)
+
+def _bookings_filters(status=None, date_from=None, date_to=None, technician_id=None, booking_type=None,
+                      user_id=None, vehicle_id=None, booking_id=None):
+    clauses, params = [], []
+    for column, value in (("b.user_id", user_id), ("b.vehicle_id", vehicle_id), ("b.id", booking_id)):
+        if value:
+            clauses.append(f"{column}=?")
+            params.append(int(value))
+    if status:
+        clauses.append("b.status=?")
+        params.append(status)
+    if date_from:
+        clauses.append("b.scheduled_at >= ?")
+        params.append(date_from.isoformat())
+    if date_to:
+        clauses.append("b.scheduled_at < ?")
+        params.append((date_to + timedelta(days=1)).isoformat())
+    if technician_id:
+        clauses.append("b.technician_id=?")
+        params.append(int(technician_id))
+    if booking_type:
+        clauses.append("b.booking_type=?")
+        params.append(booking_type)
+    return clauses, params
+
+def list_bookings_page(status=None, date_from=None, date_to=None, technician_id=None,
+                       booking_type=None, after=None, page_size=50, user_id=None, vehicle_id=None, booking_id=None):
+    """Une page de réservations, de la plus tardive à la plus ancienne.
+
+    Pagination par clé (scheduled_at, id) : ``after`` est le couple de la
+    dernière ligne de la page précédente (None pour la première page).
+    Renvoie (DataFrame de la page, nombre total de lignes filtrées).
+    """
+    import pandas as pd
+    clauses, params = _bookings_filters(status, date_from, date_to, technician_id, booking_type,
+                                        user_id, vehicle_id, booking_id)
+    conn = get_conn()
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    total = conn.execute("SELECT COUNT(*) FROM bookings b" + where, params).fetchone()[0]
+
+    if after:
+        clauses = clauses + ["(b.scheduled_at, b.id) < (?, ?)"]
+        params = params + [after[0], int(after[1])]
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    df = pd.read_sql_query(
+        _BOOKINGS_SELECT + where + " ORDER BY b.scheduled_at DESC, b.id DESC LIMIT ?",
+        conn, params=params + [int(page_size)])
+    return df, total
+
+# ---------------- Recherche ----------------
+SEARCH_LIMIT = 20
+SEARCH_MIN_CHARS = 2
+
+def _match_query(text):
+    # Chaque mot devient un préfixe entre guillemets (pas de syntaxe FTS5 côté utilisateur)
+    words = [w for w in re.findall(r"\w+", text or "") if len(w) >= SEARCH_MIN_CHARS]
+    return " ".join(f'"{w}"*' for w in words)
+
+def search(text, limit=SEARCH_LIMIT) -> "pd.DataFrame":
+    """Clients, véhicules et réservations dont le texte contient tous les mots tapés (en préfixe).
+
+    Renvoie kind, id, user_id et un libellé ; les clients d'abord, puis les
+    véhicules, puis les réservations, les plus récents en tête.
+    """
+    import pandas as pd
+    match = _match_query(text)
+    if not match:
+        return pd.DataFrame(columns=["kind", "id", "user_id", "label"])
+    df = pd.read_sql_query(f"""
+        WITH hits AS (
+            SELECT rowid >> {SEARCH_SHIFT} AS kind, rowid & ((1 << {SEARCH_SHIFT}) - 1) AS ref
+            FROM search_index WHERE search_index MATCH ? ORDER BY rowid DESC LIMIT ?
+        )
+        SELECT h.kind, h.ref AS id, COALESCE(cu.id, v.user_id, b.user_id) AS user_id,
+               CASE h.kind
+                   WHEN 3 THEN cu.name || ' — ' || cu.email || COALESCE(' — ' || cu.phone, '')
+                   WHEN 2 THEN v.plate || ' — ' || v.make || ' ' || v.model || ' (' || vu.name || ')'
+                   ELSE '#' || b.id || ' — ' || substr(b.scheduled_at, 1, 16) || ' — ' || bu.name
+                        || COALESCE(' — ' || b.address, '')
+               END AS label
+        FROM hits h
+        LEFT JOIN users cu ON h.kind = 3 AND cu.id = h.ref
+        LEFT JOIN vehicles v ON h.kind = 2 AND v.id = h.ref
+        LEFT JOIN users vu ON vu.id = v.user_id
+        LEFT JOIN bookings b ON h.kind = 1 AND b.id = h.ref
+        LEFT JOIN users bu ON bu.id = b.user_id""", get_conn(), params=(match, int(limit)))
+    df["kind"] = df["kind"].map(SEARCH_KINDS)
     return df
+
+def rebuild_search_index(conn=None):
+    """Reconstruit l'index de recherche depuis les tables sources."""
+    with (nullcontext(conn) if conn else transaction()) as conn:
+        conn.execute("DELETE FROM search_index")
+        for table, (kind, body, _) in _SEARCH_SOURCES.items():
+            body = body.replace("NEW.", "")
+            conn.execute(f"""INSERT INTO search_index(rowid, body)
+                             SELECT ({kind} << {SEARCH_SHIFT}) + id, {body} FROM {table} WHERE {body} != ''""")
+        conn.execute("INSERT INTO search_index(search_index) VALUES('optimize')")
+
+# ---------------- Statistiques ----------------
+# Agrégats recalculés depuis bookings / booking_services (référence des triggers)
+# (archives comprises : l'archivage ne retire rien des agrégats)
+_STATS_FROM_BOOKINGS = {
+    "daily_stats": """
+        SELECT substr(scheduled_at, 1, 10), status, COALESCE(technician_id, 0), COUNT(*),
+               SUM(total_price_da), COALESCE(SUM(rating), 0), COUNT(rating)
+        FROM {bookings} GROUP BY 1, 2, 3""",
+    "monthly_stats": """
+        SELECT substr(scheduled_at, 1, 7), status, COALESCE(technician_id, 0), COUNT(*),
+               SUM(total_price_da), COALESCE(SUM(rating), 0), COUNT(rating)
+        FROM {bookings} GROUP BY 1, 2, 3""",
+    "monthly_service_stats": """
+        SELECT substr(b.scheduled_at, 1, 7), bs.service_id, b.status, COUNT(*), SUM(bs.price_at_booking_da)
+        FROM {booking_services} bs JOIN {bookings} b ON b.id = bs.booking_id GROUP BY 1, 2, 3""",
+}
+
+def _stats_queries(conn):
+    bookings, booking_services = history_tables(conn)
+    return {table: q.format(bookings=bookings, booking_services=booking_services)
+            for table, q in _STATS_FROM_BOOKINGS.items()}
+
+def rebuild_stats(conn=None):
+    """Recalcule entièrement les tables d'agrégats depuis les réservations."""
+    with (nullcontext(conn) if conn else transaction()) as conn:
+        for table, query in _stats_queries(conn).items():
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(f"INSERT INTO {table} {query}")
+
+def check_stats() -> dict:
+    """Compare les agrégats incrémentaux à un recalcul complet ; {table: nb de lignes divergentes}."""
+    conn = get_conn()
+    diff = {}
+    for table, query in _stats_queries(conn).items():
+        current = f"SELECT * FROM {table} WHERE nb != 0"
+        n = conn.execute(f"""SELECT (SELECT COUNT(*) FROM ({current} EXCEPT {query})),
+                                    (SELECT COUNT(*) FROM ({query} EXCEPT {current}))""").fetchone()
+        if n[0] or n[1]:
+            diff[table] = n[0] + n[1]
+    return diff
+
+_STATS_TRIGGERS = ("trg_stats_bookings_insert", "trg_stats_bookings_update", "trg_stats_bookings_delete",
+                   "trg_stats_services_status", "trg_stats_booking_services_insert")
+
+# Cache de pages (Kio) le temps d'un chargement en masse
+BULK_CACHE_KIB = 262144
+
+@contextmanager
+def bulk_load(defer_indexes=()):
+    """Chargement en masse : triggers d'agrégats suspendus, recalcul complet à la fin.
+
+    Le bloc ouvre ses propres transactions (par lots) ; le recalcul final,
+    fait dans la même transaction que la recréation des triggers, couvre
+    aussi les écritures concurrentes faites entre-temps. Les index secondaires
+    des tables ``defer_indexes`` sont supprimés puis reconstruits en un tri :
+    rentable seulement si le volume chargé dépasse celui déjà en base, et
+    seulement hors service (les lectures concurrentes perdent ces index).
+    Leur définition est gardée dans ``config`` jusqu'à la reconstruction :
+    après un arrêt brutal, init_db() recrée index et triggers manquants.
+    """
+    conn = get_conn()
+    conn.execute(f"PRAGMA cache_size=-{BULK_CACHE_KIB}")
+    with transaction() as conn:
+        for name in _STATS_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        marks = ",".join("?" * len(defer_indexes))
+        indexes = conn.execute(f"""SELECT name, sql FROM sqlite_master
+                                   WHERE type='index' AND sql IS NOT NULL AND tbl_name IN ({marks})""",
+                               tuple(defer_indexes)).fetchall()
+        for name, _ in indexes:
+            conn.execute(f"DROP INDEX {name}")
+        if indexes:
+            conn.execute("INSERT OR REPLACE INTO config(key, value) VALUES('bulk_load_indexes', ?)",
+                         (json.dumps([tuple(r) for r in indexes]),))
+    try:
+        yield conn
+    finally:
+        with transaction() as conn:
+            _repair_bulk_load(conn)
+        conn.execute(f"PRAGMA cache_size={dict(PRAGMAS)['cache_size']}")
+
+def monthly_stats() -> "pd.DataFrame":
+    """Prestations, CA et notes par mois (hors annulations)."""
+    import pandas as pd
+    return pd.read_sql_query("""
+        SELECT month AS mois, SUM(nb) AS prestations, SUM(revenue_da) AS ca_da,
+               SUM(rating_sum) AS rating_sum, SUM(rating_nb) AS rating_nb
+        FROM monthly_stats WHERE status != 'annulé'
+        GROUP BY month HAVING SUM(nb) != 0 ORDER BY month
+    """, get_conn())
+
+def daily_stats(date_from, date_to) -> "pd.DataFrame":
+    import pandas as pd
+    return pd.read_sql_query("""
+        SELECT day AS jour, SUM(nb) AS prestations, SUM(revenue_da) AS ca_da
+        FROM daily_stats WHERE status != 'annulé' AND day >= ? AND day <= ?
+        GROUP BY day HAVING SUM(nb) != 0 ORDER BY day
+    """, get_conn(), params=(date_from.isoformat(), date_to.isoformat()))
+
+def status_stats() -> "pd.DataFrame":
+    import pandas as pd
+    return pd.read_sql_query("""
+        SELECT status AS statut, SUM(nb) AS nb, SUM(revenue_da) AS montant_da
+        FROM monthly_stats GROUP BY status HAVING SUM(nb) != 0 ORDER BY nb DESC
+    """, get_conn())
+
+def technician_stats() -> "pd.DataFrame":
+    import pandas as pd
+    return pd.read_sql_query("""
+        SELECT ms.technician_id, COALESCE(t.name, '—') AS technicien,
+               SUM(ms.nb) AS prestations, SUM(ms.revenue_da) AS ca_da,
+               ROUND(1.0 * SUM(ms.rating_sum) / NULLIF(SUM(ms.rating_nb), 0), 2) AS note
+        FROM monthly_stats ms LEFT JOIN technicians t ON t.id = ms.technician_id
+        WHERE ms.status != 'annulé'
+        GROUP BY ms.technician_id HAVING SUM(ms.nb) != 0 ORDER BY prestations DESC
+    """, get_conn())
+
+def service_stats() -> "pd.DataFrame":
+    """Popularité et CA par service (réservations non annulées)."""
+    import pandas as pd
+    return pd.read_sql_query("""
+        SELECT s.id, s.name, s.category,
+               COALESCE(SUM(m.nb), 0) AS nb, COALESCE(SUM(m.revenue_da), 0) AS ca_da
+        FROM services s
+        LEFT JOIN monthly_service_stats m ON m.service_id = s.id AND m.status != 'annulé'
+        GROUP BY s.id ORDER BY nb DESC, ca_da DESC
+    """, get_conn())
+
+# ---------------- Archives ----------------
+# Réservations closes et anciennes déplacées vers archive.bookings / archive.booking_services :
+# les écrans et index courants ne paient plus pour l'historique.
+ARCHIVE_HORIZON_DAYS = 365
+ARCHIVE_BATCH = 2_000
+ARCHIVED_STATUSES = ("terminé", "annulé")
+_ARCHIVED_TABLES = {"bookings": "id", "booking_services": "booking_id"}
+
+def _columns(conn, schema, table) -> list:
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+def _ensure_archive(conn):
+    """Tables d'archive calquées sur la base chaude, sans clés étrangères (clients et véhicules n'y sont pas)."""
+    for table in _ARCHIVED_TABLES:
+        info = conn.execute(f"PRAGMA main.table_info({table})").fetchall()
+        have = set(_columns(conn, "archive", table))
+        if not have:
+            cols = ", ".join(f"{r[1]} {r[2]}" for r in info)
+            pk = ", ".join(r[1] for r in sorted(info, key=lambda r: r[5]) if r[5])
+            conn.execute(f"CREATE TABLE archive.{table} ({cols}, archived_at TEXT, PRIMARY KEY({pk}))")
+        else:
+            # Colonnes ajoutées en base chaude depuis la création de l'archive
+            for r in info:
+                if r[1] not in have:
+                    conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {r[1]} {r[2]}")
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_bookings_user ON bookings(user_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_bookings_sched ON bookings(scheduled_at)")
+
+def history_tables(conn) -> tuple:
+    """(réservations, services réservés) base chaude + archive, en vues temporaires de cette connexion.
+
+    Sans tables d'archive (base pas encore initialisée), la base chaude seule.
+    """
+    if conn.execute("SELECT 1 FROM temp.sqlite_master WHERE name='bookings_all'").fetchone():
+        return "bookings_all", "booking_services_all"
+    if not _columns(conn, "archive", "bookings"):
+        return "bookings", "booking_services"
+    for table in _ARCHIVED_TABLES:
+        cols = ", ".join(_columns(conn, "main", table))
+        conn.execute(f"""CREATE TEMP VIEW IF NOT EXISTS {table}_all AS
+                         SELECT {cols} FROM main.{table} UNION ALL SELECT {cols} FROM archive.{table}""")
+    return "bookings_all", "booking_services_all"
+
+def _archive_batch(conn, ids, archived_at):
+    key = json.dumps(ids)
+    for table, col in _ARCHIVED_TABLES.items():
+        cols = ", ".join(_columns(conn, "main", table))
+        conn.execute(f"""INSERT OR IGNORE INTO archive.{table}({cols}, archived_at)
+                         SELECT {cols}, ? FROM main.{table} WHERE {col} IN (SELECT value FROM json_each(?))""",
+                     (archived_at, key))
+        # Ligne ignorée : reprise d'un lot déjà copié (identique), sinon collision d'ID -> rien n'est supprimé
+        same = " AND ".join(f"a.{c} IS m.{c}" for c in _columns(conn, "main", table))
+        clash = conn.execute(f"""SELECT COUNT(*) FROM main.{table} m WHERE {col} IN (SELECT value FROM json_each(?))
+                                  AND NOT EXISTS (SELECT 1 FROM archive.{table} a WHERE {same})""", (key,)).fetchone()[0]
+        if clash:
+            raise sqlite3.IntegrityError(f"archive.{table} : {clash} ligne(s) en conflit avec une ligne déjà archivée")
+    # Trigger de suppression neutralisé le temps du lot : les agrégats gardent l'historique
+    conn.execute("INSERT OR REPLACE INTO main.config(key, value) VALUES(?, '1')", (_ARCHIVING_KEY,))
+    conn.execute("DELETE FROM main.booking_services WHERE booking_id IN (SELECT value FROM json_each(?))", (key,))
+    conn.execute("DELETE FROM main.bookings WHERE id IN (SELECT value FROM json_each(?))", (key,))
+    conn.execute("DELETE FROM main.config WHERE key=?", (_ARCHIVING_KEY,))
+
+def archive_bookings(horizon_days=None, batch=ARCHIVE_BATCH, now=None, max_rows=None) -> dict:
+    """Déplace vers l'archive les réservations terminées ou annulées prévues avant l'horizon.
+
+    Un lot par transaction : copie (INSERT OR IGNORE) puis suppression en base
+    chaude ; une ligne d'archive de même clé mais différente annule le lot. Interrompu, le travail reprend au lot suivant ; relancé, il ne
+    déplace que ce qui reste. Les deux fichiers ne sont pas validés de façon
+    atomique en WAL : après un arrêt brutal, un lot peut exister des deux côtés
+    et la reprise le termine.
+    """
+    horizon = int(horizon_days if horizon_days is not None else get_config("archive_horizon_days", ARCHIVE_HORIZON_DAYS))
+    cutoff = ((now or datetime.now()) - timedelta(days=horizon)).isoformat()
+    archived_at = datetime.utcnow().isoformat(timespec="seconds")
+    marks = ",".join("?" * len(ARCHIVED_STATUSES))
+    moved = batches = 0
+    t0 = time.perf_counter()
+    while max_rows is None or moved < max_rows:
+        size = batch if max_rows is None else min(batch, max_rows - moved)
+        with transaction() as conn:
+            ids = [r[0] for r in conn.execute(
+                f"SELECT id FROM main.bookings WHERE status IN ({marks}) AND scheduled_at < ? LIMIT ?",
+                ARCHIVED_STATUSES + (cutoff, size))]
+            if not ids:
+                break
+            _archive_batch(conn, ids, archived_at)
+        moved += len(ids)
+        batches += 1
+    summary = {"cutoff": cutoff, "moved": moved, "batches": batches, "at": archived_at,
+               "seconds": round(time.perf_counter() - t0, 2)}
+    if moved:
+        set_config("archive_last_run", json.dumps(summary))
+    return summary
+
+def archive_status() -> dict:
+    """Dernier archivage (date, horizon, volume) ; {} si aucun."""
+    return json.loads(get_config("archive_last_run", "{}"))